@@ -0,0 +1,79 @@
+#Benchmarks sending one move to the spectators of a game over loopback
+#sockets, encoding the update once and sharing the bytes against encoding it
+#again for every socket with the board rendered each time, as before updates
+#were shared and renders cached per version.
+#Run from the root of the repo with: python -m benchmarks.bench_broadcast [-s 2000]
+import argparse
+import asyncio
+import time
+
+from src.chess_server.server import GameServer, raise_open_file_limit
+
+UPDATES = 20
+
+async def drain_forever(reader):
+    while await reader.read(65536):
+        pass
+
+async def connect(port, count):
+    return [await asyncio.open_connection("127.0.0.1", port) for _ in range(count)]
+
+def encode_per_socket(game, move):
+    board = game.board
+    for spectator in game.spectators:
+        board._display = None #no render cached
+        spectator.writer.write(spectator.protocol.update(move, board))
+
+async def time_updates(broadcast, game, move):
+    seconds = 0
+    for _ in range(UPDATES):
+        start = time.perf_counter()
+        broadcast(game, move)
+        seconds += time.perf_counter() - start
+        #let the spectators read everything before the next update
+        while any(s.writer.transport.get_write_buffer_size() for s in game.spectators):
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.01)
+    return seconds / UPDATES
+
+async def main(spectator_count):
+    game_server = GameServer(park_games=False)
+    server = await game_server.start("127.0.0.1", 0)
+    spectator_server = await asyncio.start_server(game_server.handle_spectator,
+                                                  "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    spectator_port = spectator_server.sockets[0].getsockname()[1]
+    players = await connect(port, 2)
+    spectators = await connect(spectator_port, spectator_count)
+    for _, writer in spectators:
+        writer.write(b"watch 1\n")
+    drains = [asyncio.ensure_future(drain_forever(reader))
+              for reader, _ in players + spectators]
+    game = game_server.games[1]
+    while len(game.spectators) < spectator_count:
+        await asyncio.sleep(0.01)
+    game.board.move_piece((5, 2), (5, 4))
+    move = game.board.move_history[-1]
+    shared = await time_updates(lambda game, move: game.broadcast(move), game, move)
+    per_socket = await time_updates(encode_per_socket, game, move)
+    size = len(game.spectators.copy().pop().protocol.update(move, game.board))
+    print(f"{'spectators':>11}{'update B':>10}{'per socket':>13}{'shared':>11}"
+          f"{'speedup':>9}")
+    print(f"{spectator_count:>11}{size:>10}{per_socket*1e3:>11.2f}ms"
+          f"{shared*1e3:>9.2f}ms{per_socket/shared:>8.2f}x")
+    for drain in drains:
+        drain.cancel()
+    for _, writer in players + spectators:
+        writer.close()
+    #let the server see the connections close before the loop stops
+    while game_server.games or game.spectators:
+        await asyncio.sleep(0.01)
+    server.close()
+    spectator_server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spectator broadcast benchmark")
+    parser.add_argument("-s", help="spectators (default 2000)", type=int, default=2000)
+    args = parser.parse_args()
+    raise_open_file_limit()
+    asyncio.run(main(args.s))
@@ -0,0 +1,128 @@
+#Benchmarks flag-fall scheduling as the number of running game clocks grows:
+#microseconds per move (cancel the mover's timer, set the opponent's) and per
+#tick of the clock, for the shared timer wheel and for a heap of deadlines
+#with lazy deletion, next to pressing the clocks without any timers. Moves
+#go to random games, so with many clocks every move also waits on memory: the
+#rise per move with the clock count is shared by all three, and the cost of
+#scheduling is the difference to the clocks without timers. A wheel tick
+#walks one slot, so its cost grows with clocks / SLOTS; the heap keeps every
+#cancelled deadline until it is due. Games are simulated with a fake clock,
+#without sockets.
+#Run from the root of the repo with: python -m benchmarks.bench_clocks [-m 200000]
+import argparse
+import heapq
+import random
+import time
+
+from src.chess_server.clock import GameClock, TimeControl, TimerWheel, TICK
+
+CLOCK_COUNTS = (10, 100, 1000, 10000, 100000)
+#an hour per side, so no flag falls in the simulated time
+TIME_CONTROL = TimeControl(3600, 3)
+MOVES_PER_TICK = 20 #moves played between two ticks
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class NoTimers:
+    """
+    Scheduler setting no timers, to time the moves on the clocks alone
+    """
+    heap = ()
+
+    def schedule(self, when, callback, *args):
+        return None
+
+    def cancel(self, timer):
+        pass
+
+    def advance(self, now):
+        return 0
+
+
+class HeapScheduler:
+    """
+    Deadlines in a heap, cancelled timers are marked and dropped when popped
+    """
+    def __init__(self):
+        self.heap = []
+        self.order = 0
+
+    def schedule(self, when, callback, *args):
+        self.order += 1
+        timer = [when, self.order, callback, args]
+        heapq.heappush(self.heap, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    def advance(self, now):
+        fired = 0
+        while self.heap and self.heap[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.heap)
+            if callback is not None:
+                callback(*args)
+                fired += 1
+        return fired
+
+
+def flag_fell(game_clock):
+    raise AssertionError("no flag falls in the benchmark")
+
+def run(scheduler, fake_time, count, moves):
+    """
+    Starts count clocks then plays moves on random games, moving the time
+    on by a whole tick every MOVES_PER_TICK moves
+
+    Returns:
+        (microseconds per move, microseconds per tick)
+    """
+    rng = random.Random(1)
+    clocks = []
+    for _ in range(count):
+        game_clock = GameClock(TIME_CONTROL, fake_time())
+        game_clock.timer = scheduler.schedule(game_clock.deadline(), flag_fell, game_clock)
+        clocks.append(game_clock)
+    picks = [rng.randrange(count) for _ in range(moves)]
+    move_seconds = tick_seconds = 0.0
+    for start in range(0, moves, MOVES_PER_TICK):
+        began = time.perf_counter()
+        for index in picks[start:start + MOVES_PER_TICK]:
+            game_clock = clocks[index]
+            scheduler.cancel(game_clock.timer)
+            game_clock.press(fake_time())
+            game_clock.timer = scheduler.schedule(game_clock.deadline(), flag_fell,
+                                                  game_clock)
+        ended = time.perf_counter()
+        fake_time.now += TICK
+        scheduler.advance(fake_time())
+        move_seconds += ended - began
+        tick_seconds += time.perf_counter() - ended
+    ticks = -(-moves // MOVES_PER_TICK)
+    return move_seconds / moves * 1e6, tick_seconds / ticks * 1e6
+
+def main(moves):
+    print(f"{'clocks':>8}{'no timers us/move':>19}{'wheel us/move':>15}{'us/tick':>9}"
+          f"{'heap us/move':>14}{'us/tick':>9}{'heap size':>11}")
+    for count in CLOCK_COUNTS:
+        times = []
+        for scheduler in (NoTimers(), None, HeapScheduler()):
+            fake_time = FakeTime()
+            if scheduler is None:
+                scheduler = TimerWheel(clock=fake_time)
+            times.append(run(scheduler, fake_time, count, moves))
+        print(f"{count:>8}{times[0][0]:>19.2f}{times[1][0]:>15.2f}{times[1][1]:>9.2f}"
+              f"{times[2][0]:>14.2f}{times[2][1]:>9.2f}{len(scheduler.heap):>11}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flag-fall scheduling benchmark")
+    parser.add_argument("-m", help="moves played per clock count (default 200000)",
+        type=int, default=200000)
+    main(parser.parse_args().m)
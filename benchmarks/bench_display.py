@@ -0,0 +1,77 @@
+#Benchmarks display_board: rendering by string concatenation with a dict
+#probe per square as it was before, rendering once per version, and a parked
+#CompactBoard rendering a new version and keeping the render of its Board
+#or of an earlier request. Also compares bytes sent per move for a client following a
+#game with whole boards against deltas since its last version.
+#Run from the root of the repo with: python -m benchmarks.bench_display
+import timeit
+
+from src.chess_server.engine import Board
+from src.chess_server.protocol import TEXT, BINARY
+from benchmarks.bench_movegen import POSITIONS, play
+
+def concatenated_display(board):
+    """
+    display_board as it was before, probing the dict for each square and
+    building the string with +=
+    """
+    rows = []
+    for y in range(8, 0, -1):
+        row = [y]
+        for x in range(1, 9):
+            if board.board.get((x, y)):
+                row.append(board.board[(x, y)].symbol)
+            else:
+                row.append(" ")
+        rows.append(row)
+    col_str = "    a   b   c   d   e   f   g   h\n"
+    row_divider = "  --------------------------------\n"
+    row_template = "{} | {} | {} | {} | {} | {} | {} | {} | {}\n"
+    pretty_board = col_str + row_divider
+    for row in rows:
+        pretty_board += row_template.format(*row)
+        pretty_board += row_divider
+    pretty_board += col_str
+    return pretty_board
+
+def render_compact(compact):
+    compact._display = None #as if the version changed since the last render
+    return compact.display_board()
+
+def bench(function, number=2000):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+def follow(protocol, deltas):
+    """
+    Returns bytes per move sent to a client asking for the board after
+    every move, as whole boards or as deltas since the previous move
+    """
+    sent = plies = 0
+    for moves in POSITIONS.values():
+        board = Board()
+        for msg in moves.split():
+            version = board.version
+            play(board, msg)
+            sent += len(protocol.delta(board, version) if deltas
+                        else protocol.board(board))
+            plies += 1
+    return sent / plies
+
+def main():
+    board = play(Board(), POSITIONS["open_middlegame"])
+    assert concatenated_display(board) == board.display_board()
+    compact = board.compact()
+    print(f"{'display_board':<20}{'us':>8}")
+    for name, function in [
+            ("concatenated", lambda: concatenated_display(board)),
+            ("cached", board.display_board),
+            ("CompactBoard render", lambda: render_compact(compact)),
+            ("CompactBoard cached", compact.display_board)]:
+        print(f"{name:<20}{bench(function)*1e6:>8.2f}")
+    print(f"\n{'protocol':<20}{'board B':>8}{'delta B':>8}")
+    for name, protocol in (("text", TEXT), ("binary", BINARY)):
+        print(f"{name:<20}{follow(protocol, False):>8.1f}"
+              f"{follow(protocol, True):>8.1f}")
+
+if __name__ == "__main__":
+    main()
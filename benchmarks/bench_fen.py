@@ -0,0 +1,43 @@
+#Benchmarks setting up positions: replaying each game's moves from the start
+#through move_piece against loading its FEN with load_fens, for both board
+#representations, plus the time to write the FENs back out with to_fen.
+#Run from the root of the repo with: python -m benchmarks.bench_fen [-g 500]
+import argparse
+import time
+
+from src.chess_server.engine import create_board, load_fens
+from benchmarks.bench_memory import random_moves
+
+PLIES = 60
+
+def replay(representation, games):
+    boards = []
+    for moves in games:
+        board = create_board(representation)
+        for move in moves:
+            board.move_piece(*move)
+        boards.append(board)
+    return boards
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main(game_count):
+    games = [random_moves(seed, PLIES) for seed in range(game_count)]
+    print(f"{'engine':<10}{'replay/s':>10}{'load_fens/s':>13}{'speedup':>9}{'to_fen/s':>10}")
+    for representation in ("dict", "bitboard"):
+        replayed, replay_seconds = timed(replay, representation, games)
+        fens, fen_seconds = timed(lambda: [board.to_fen() for board in replayed])
+        loaded, load_seconds = timed(load_fens, fens, representation)
+        assert [board.to_fen() for board in loaded] == fens
+        print(f"{representation:<10}{game_count / replay_seconds:>10.0f}"
+              f"{game_count / load_seconds:>13.0f}{replay_seconds / load_seconds:>8.1f}x"
+              f"{game_count / fen_seconds:>10.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FEN loading benchmark")
+    parser.add_argument("-g", help="positions (default 500)", type=int, default=500)
+    args = parser.parse_args()
+    main(args.g)
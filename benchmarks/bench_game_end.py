@@ -0,0 +1,33 @@
+#Benchmarks the checkmate/stalemate test run after every move (early exit
+#has_legal_move) against generating every legal move first.
+#Run from the root of the repo with: python -m benchmarks.bench_game_end
+import timeit
+
+from src.chess_server.engine import Board, WHITE, BLACK
+from benchmarks.bench_movegen import POSITIONS, play
+
+END_POSITIONS = {
+    "check_blocked": "e2-e4 f7-f6 d2-d4 b7-b6 d1-h5",
+    "double_check": "e2-e4 e7-e5 g1-f3 d7-d6 f1-c4 c8-g4 b1-c3 g7-g6 "
+                    "f3-e5 g4-d1 c4-f7 e8-e7 c3-d5",
+    "checkmate": "f2-f3 e7-e5 g2-g4 d8-h4",
+    "stalemate": "e2-e3 a7-a5 d1-h5 a8-a6 h5-a5 h7-h5 h2-h4 a6-h6 a5-c7 "
+                 "f7-f6 c7-d7 e8-f7 d7-b7 d8-d3 b7-b8 d3-h7 b8-c8 f7-g6 c8-e6",
+}
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+def main(number=200):
+    print(f"{'position':<18}{'all moves':>12}{'early exit':>12}{'speedup':>10}")
+    for name, moves in {**POSITIONS, **END_POSITIONS}.items():
+        board = play(Board(), moves)
+        color = WHITE if board.last_moved_color == BLACK else BLACK
+        assert board.has_legal_move(color) == bool(list(board.legal_moves(color)))
+        exhaustive = bench(lambda: list(board.legal_moves(color)), number)
+        early_exit = bench(lambda: board.has_legal_move(color), number)
+        print(f"{name:<18}{exhaustive*1e6:>10.1f}us{early_exit*1e6:>10.1f}us"
+              f"{exhaustive/early_exit:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
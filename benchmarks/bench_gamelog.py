@@ -0,0 +1,65 @@
+#Benchmarks the game log: bytes written per move (write amplification over
+#the 3 bytes a move takes in PackedHistory) and the time to recover every
+#game on restart, for several snapshot intervals. Recovery is timed on the
+#log as written, replaying the moves after each snapshot, and again on the
+#log it rewrites, which ends every game with a snapshot.
+#Run from the root of the repo with: python -m benchmarks.bench_gamelog [-g 1000]
+import argparse
+import os
+import tempfile
+import time
+
+from src.chess_server.engine import Board
+from src.chess_server.gamelog import GameLog
+from benchmarks.bench_memory import random_moves
+
+PLIES = 60
+
+def write_log(path, games, snapshot_every):
+    """
+    Logs the games with their moves interleaved, as a busy server would
+
+    Returns:
+        number of moves logged
+    """
+    game_log = GameLog(path, snapshot_every)
+    boards = {game_id: Board() for game_id in range(1, len(games) + 1)}
+    for game_id in boards:
+        game_log.game_started(game_id)
+    moves = 0
+    for ply in range(PLIES):
+        for game_id, board in boards.items():
+            if ply < len(games[game_id - 1]):
+                board.move_piece(*games[game_id - 1][ply])
+                game_log.moved(game_id, board)
+                moves += 1
+        game_log.sync()
+    game_log.close()
+    return moves
+
+def time_recovery(path):
+    start = time.perf_counter()
+    games = GameLog(path).recover()
+    return time.perf_counter() - start, len(games)
+
+def main(game_count):
+    #games that end early are dropped by recovery, the rest are in progress
+    games = [random_moves(seed, PLIES) for seed in range(game_count)]
+    print(f"{'snapshot every':<16}{'log B/move':>11}{'amplif.':>9}"
+          f"{'recover ms':>12}{'rewritten ms':>14}{'games':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for snapshot_every in (1, 8, 16, 32, 0):
+            path = os.path.join(directory, f"games{snapshot_every}.log")
+            moves = write_log(path, games, snapshot_every)
+            size = os.path.getsize(path)
+            recover, recovered = time_recovery(path)
+            rewritten, _ = time_recovery(path)
+            print(f"{snapshot_every or 'never':<16}{size / moves:>11.1f}"
+                  f"{size / moves / 3:>9.1f}{recover*1e3:>12.0f}"
+                  f"{rewritten*1e3:>14.0f}{recovered:>7}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Game log benchmark")
+    parser.add_argument("-g", help="games (default 1000)", type=int, default=1000)
+    args = parser.parse_args()
+    main(args.g)
@@ -0,0 +1,85 @@
+#Benchmarks random access to the positions of a game and takeback as games
+#get longer: microseconds to rebuild the position after a random ply from the
+#snapshots of the move history and by replaying the game from the start, to
+#take back a move with its MoveRecord and from a snapshot, and the bytes of
+#the history per ply with its snapshots, next to a 64 byte board per ply.
+#Run from the root of the repo with: python -m benchmarks.bench_history [-g 20]
+import argparse
+import random
+import time
+
+from src.chess_server.engine import Board, TAKEBACK_PLIES
+from benchmarks.bench_memory import random_moves
+
+GAME_LENGTHS = (40, 80, 160, 320)
+QUERIES = 200 #position_at calls per game length
+
+
+def timed(function, *args):
+    began = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - began
+
+def replay(moves, ply):
+    board = Board()
+    for move in moves[:ply]:
+        board.move_piece(*move)
+    return board
+
+def takeback_times(moves):
+    """
+    Returns (seconds per takeback with the MoveRecord, seconds per takeback
+    from a snapshot) taking back a whole game
+    """
+    board = Board()
+    for move in moves:
+        board.move_piece(*move)
+    in_place = from_snapshot = 0.0
+    for taken in range(len(moves)):
+        seconds = timed(board.takeback)
+        if taken < TAKEBACK_PLIES:
+            in_place += seconds
+        else:
+            from_snapshot += seconds
+    return in_place / TAKEBACK_PLIES, from_snapshot / (len(moves) - TAKEBACK_PLIES)
+
+def main(games):
+    print(f"{'plies':>6}{'position_at us':>16}{'replay us':>11}{'takeback us':>13}"
+          f"{'from snapshot us':>18}{'history B/ply':>15}{'boards B/ply':>14}")
+    for length in GAME_LENGTHS:
+        rng = random.Random(length)
+        games_moves = []
+        seed = 0
+        while len(games_moves) < games:
+            seed += 1
+            moves = random_moves(seed, length)
+            if len(moves) == length: #games ending early are left out
+                games_moves.append(moves)
+        boards = []
+        for moves in games_moves:
+            board = Board()
+            for move in moves:
+                board.move_piece(*move)
+            boards.append((board, moves))
+        position_at = replayed = 0.0
+        for _ in range(QUERIES):
+            board, moves = rng.choice(boards)
+            ply = rng.randint(0, length)
+            position_at += timed(board.position_at, ply)
+            replayed += timed(replay, moves, ply)
+        in_place = from_snapshot = 0.0
+        for moves in games_moves:
+            times = takeback_times(moves)
+            in_place += times[0]
+            from_snapshot += times[1]
+        history_bytes = sum(board.move_history.nbytes() for board, _ in boards)
+        print(f"{length:>6}{position_at / QUERIES * 1e6:>16.1f}"
+              f"{replayed / QUERIES * 1e6:>11.1f}{in_place / games * 1e6:>13.1f}"
+              f"{from_snapshot / games * 1e6:>18.1f}"
+              f"{history_bytes / games / length:>15.2f}{64:>14}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Position history benchmark")
+    parser.add_argument("-g", help="games of each length (default 20)", type=int,
+        default=20)
+    main(parser.parse_args().g)
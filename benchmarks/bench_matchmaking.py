@@ -0,0 +1,116 @@
+#Benchmarks pairing latency with many clients waiting: a simulated lobby is
+#filled until the given number of clients wait, then clients keep arriving
+#(and some waiting ones leave), each arrival paired or queued. Reports the
+#mean and 99th percentile microseconds per arrival for the Matchmaker and
+#for a list of waiting clients scanned on every arrival. Ratings are spread
+#around 1500, and time controls are drawn from a wide range of custom ones,
+#as clients only stay waiting while nobody in range of them does.
+#Run from the root of the repo with: python -m benchmarks.bench_matchmaking [-w 50000]
+import argparse
+import random
+import time
+
+from src.chess_server.matchmaking import Matchmaker, RATING_BUCKET, RATING_RANGE
+
+ARRIVALS = 20000 #timed arrivals for the Matchmaker
+SCAN_ARRIVALS = 500 #timed arrivals for the scan, slower
+LEAVE_SHARE = 0.3 #share of the events that are a waiting client leaving
+UNRATED_SHARE = 0.1 #share of the clients without a rating
+
+
+class LinearScan:
+    """
+    Waiting clients in arrival order, scanned for the nearest rating bucket
+    within range with the same time control
+    """
+    def __init__(self, rating_range=RATING_RANGE, bucket_width=RATING_BUCKET):
+        self.span = rating_range // bucket_width
+        self.bucket_width = bucket_width
+        self.waiting = [] #(client, bucket, time_control)
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __contains__(self, client):
+        return any(entry[0] == client for entry in self.waiting)
+
+    def seek(self, client, rating=None, time_control=None):
+        bucket = None if rating is None else rating // self.bucket_width
+        best = None
+        for index, (other, other_bucket, other_control) in enumerate(self.waiting):
+            if other_control != time_control or (bucket is None) != (other_bucket is None):
+                continue
+            distance = 0 if bucket is None else abs(bucket - other_bucket)
+            if distance <= self.span and (best is None or distance < best[0]):
+                best = (distance, index)
+        if best is None:
+            self.waiting.append((client, bucket, time_control))
+            return None
+        return self.waiting.pop(best[1])[0]
+
+    def cancel(self, client):
+        for index, entry in enumerate(self.waiting):
+            if entry[0] == client:
+                del self.waiting[index]
+                return
+
+
+def arrival(rng):
+    """
+    Returns (rating, time control key) of a new client
+    """
+    rating = None
+    if rng.random() >= UNRATED_SHARE:
+        rating = min(max(int(rng.gauss(1500, 350)), 100), 3200)
+    return rating, f"{rng.randint(1, 180)}+{rng.randint(0, 180)}"
+
+def fill(waiting, rng):
+    """
+    Returns a Matchmaker with waiting clients, numbered from 1 in arrival
+    order, and the number of clients that arrived
+    """
+    matchmaker = Matchmaker()
+    clients = 0
+    while len(matchmaker) < waiting:
+        clients += 1
+        matchmaker.seek(clients, *arrival(rng))
+    return matchmaker, clients
+
+def run(matchmaker, clients, arrivals, rng):
+    """
+    Times arrivals on a filled matchmaker
+
+    Returns:
+        (mean, 99th percentile) microseconds per arrival
+    """
+    times = []
+    while len(times) < arrivals:
+        if rng.random() < LEAVE_SHARE:
+            matchmaker.cancel(rng.randint(1, clients))
+            continue
+        clients += 1
+        rating, time_control = arrival(rng)
+        began = time.perf_counter()
+        matchmaker.seek(clients, rating, time_control)
+        times.append(time.perf_counter() - began)
+    times.sort()
+    return (sum(times) / len(times) * 1e6, times[int(len(times) * 0.99)] * 1e6)
+
+def main(waiting):
+    print(f"{'waiting':>8}{'pairing':>14}{'mean us':>9}{'p99 us':>9}")
+    matchmaker, clients = fill(waiting, random.Random(1))
+    #the same clients waiting, filling the scan would take its quadratic time
+    scan = LinearScan()
+    for seek in matchmaker.seeks.values():
+        scan.waiting.append((seek.client, None if seek.rating is None else
+                             seek.rating // scan.bucket_width, seek.time_control))
+    for name, pairing, arrivals in (("matchmaker", matchmaker, ARRIVALS),
+                                    ("scan", scan, SCAN_ARRIVALS)):
+        mean, p99 = run(pairing, clients, arrivals, random.Random(2))
+        print(f"{waiting:>8}{name:>14}{mean:>9.2f}{p99:>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Matchmaking latency benchmark")
+    parser.add_argument("-w", help="clients waiting (default 50000)", type=int,
+        default=50000)
+    main(parser.parse_args().w)
@@ -0,0 +1,68 @@
+#Benchmarks memory per hosted game: bytes for an idle game in the starting
+#position and extra bytes per 100 moves played, for a playable Board, a
+#BitBoard and a parked CompactBoard.
+#Run from the root of the repo with: python -m benchmarks.bench_memory
+import gc
+import random
+import tracemalloc
+
+from src.chess_server.engine import Board, WHITE, BLACK
+from src.chess_server.bitboard import BitBoard
+
+GAMES = 200
+PLIES = 100
+
+def random_moves(seed, plies=PLIES):
+    """
+    Returns the moves of a random game, cut short if it ends
+    """
+    rng = random.Random(seed)
+    board = Board()
+    moves = []
+    while len(moves) < plies and not board.outcome:
+        color = WHITE if board.last_moved_color == BLACK else BLACK
+        move = rng.choice(sorted(board.legal_moves(color), key=str))
+        board.move_piece(*move)
+        moves.append(move)
+    return moves
+
+def played(make, moves):
+    board = make()
+    for move in moves:
+        board.move_piece(*move)
+    return board
+
+def bytes_per_game(make_game):
+    """
+    Returns the traced bytes held per game when GAMES games are kept alive
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    games = [make_game(i) for i in range(GAMES)]
+    gc.collect() #boards that were compacted are freed by the cycle collector
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del games
+    return held / GAMES
+
+def main():
+    games = [random_moves(seed) for seed in range(GAMES)]
+    plies = sum(map(len, games)) / GAMES
+    representations = {
+        "Board": Board,
+        "BitBoard": BitBoard,
+        "CompactBoard": lambda: Board().compact(),
+    }
+    print(f"{'representation':<16}{'idle B':>10}{'per 100 moves B':>17}")
+    for name, make in representations.items():
+        if name == "CompactBoard":
+            make_played = lambda i: played(Board, games[i]).compact()
+        else:
+            make_played = lambda i: played(make, games[i])
+        idle = bytes_per_game(lambda i: make())
+        after = bytes_per_game(make_played)
+        print(f"{name:<16}{idle:>10.0f}{(after - idle) * 100 / plies:>17.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#Benchmarks the legality cache on games sharing their openings, as on a busy
+#server: the games follow the POSITIONS openings and then go their own way
+#with random moves. Reports microseconds per move of the shared opening and
+#of the random tail with the cache off and on, and the hit rate.
+#Run from the root of the repo with: python -m benchmarks.bench_move_cache [-g 300]
+import argparse
+import random
+import time
+
+from src.chess_server.engine import Board, WHITE, BLACK
+from src.chess_server.movecache import MOVE_CACHE, MOVE_CACHE_SIZE
+from src.chess_server.parser import msg_to_move
+from benchmarks.bench_movegen import POSITIONS
+
+TAIL_PLIES = 30
+
+def make_games(count):
+    """
+    Returns (opening moves, tail moves) of count games, cycling over the
+    openings with a random tail each
+    """
+    openings = [[msg_to_move(msg) for msg in moves.split()]
+                for moves in POSITIONS.values() if moves]
+    games = []
+    for seed in range(count):
+        rng = random.Random(seed)
+        opening = openings[seed % len(openings)]
+        board = Board()
+        for move in opening:
+            board.move_piece(*move)
+        tail = []
+        while len(tail) < TAIL_PLIES and not board.outcome:
+            color = WHITE if board.last_moved_color == BLACK else BLACK
+            move = rng.choice(sorted(board.legal_moves(color), key=str))
+            board.move_piece(*move)
+            tail.append(move)
+        games.append((opening, tail))
+    return games
+
+def play_games(games):
+    """
+    Returns seconds spent on the opening moves and on the tail moves
+    """
+    opening_seconds = tail_seconds = 0.0
+    for opening, tail in games:
+        board = Board()
+        start = time.perf_counter()
+        for move in opening:
+            board.move_piece(*move)
+        middle = time.perf_counter()
+        for move in tail:
+            board.move_piece(*move)
+        opening_seconds += middle - start
+        tail_seconds += time.perf_counter() - middle
+    return opening_seconds, tail_seconds
+
+def main(game_count):
+    games = make_games(game_count)
+    opening_moves = sum(len(opening) for opening, _ in games)
+    tail_moves = sum(len(tail) for _, tail in games)
+    print(f"{'cache':<8}{'opening us/move':>16}{'tail us/move':>14}{'hit rate':>10}")
+    for size in (0, MOVE_CACHE_SIZE):
+        MOVE_CACHE.clear()
+        MOVE_CACHE.resize(size)
+        opening_seconds, tail_seconds = play_games(games)
+        lookups = MOVE_CACHE.hits + MOVE_CACHE.misses
+        print(f"{size or 'off':<8}{opening_seconds / opening_moves * 1e6:>16.1f}"
+              f"{tail_seconds / tail_moves * 1e6:>14.1f}"
+              f"{MOVE_CACHE.hits / lookups:>10.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Legality cache benchmark")
+    parser.add_argument("-g", help="games played (default 300)", type=int, default=300)
+    main(parser.parse_args().g)
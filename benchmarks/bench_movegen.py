@@ -0,0 +1,78 @@
+#Benchmarks piece move generation with the precomputed lookup tables against
+#the original square by square scanning, and against the bitboard engine.
+#Run from the root of the repo with: python -m benchmarks.bench_movegen
+import timeit
+
+from src.chess_server.engine import Board, CARDINALS, DIAGONALS
+from src.chess_server.bitboard import BitBoard
+from src.chess_server.parser import msg_to_move
+
+POSITIONS = {
+    "start": "",
+    "italian": "e2-e4 e7-e5 g1-f3 b8-c6 f1-c4 f8-c5 c2-c3 g8-f6 d2-d4 e5-d4 "
+               "c3-d4 c5-b4 b1-c3 f6-e4 e1-g1 e4-c3 b2-c3 b4-c3 d1-b3 d7-d5",
+    "queens_gambit": "d2-d4 d7-d5 c2-c4 e7-e6 b1-c3 g8-f6 c1-g5 f8-e7 e2-e3 "
+                     "e8-g8 g1-f3 b8-d7 a1-c1 c7-c6 f1-d3 d5-c4 d3-c4 f6-d5",
+    "open_middlegame": "e2-e4 c7-c5 g1-f3 d7-d6 d2-d4 c5-d4 f3-d4 g8-f6 b1-c3 "
+                       "a7-a6 c1-e3 e7-e5 d4-b3 c8-e6 f2-f3 f8-e7 d1-d2 e8-g8 "
+                       "e1-c1 b8-d7 g2-g4 b7-b5 g4-g5 b5-b4 c3-e2 f6-e8",
+}
+SLIDING_DIRECTIONS = {"R": CARDINALS, "B": DIAGONALS, "Q": CARDINALS + DIAGONALS}
+
+def play(board, moves):
+    for msg in moves.split():
+        assert board.move_piece(*msg_to_move(msg)), msg
+    return board
+
+def stepwise_moves(piece):
+    """
+    Move generation as it was before the lookup tables, walking each ray one
+    square at a time with bounds checks
+    """
+    kind = piece.symbol.upper()
+    valid_moves = set()
+    if kind == "P":
+        return piece.list_moves()
+    if kind in SLIDING_DIRECTIONS:
+        for direction in SLIDING_DIRECTIONS[kind]:
+            pos = (piece.pos[0] + direction[0], piece.pos[1] + direction[1])
+            while piece.empty_square(pos):
+                valid_moves.add(pos)
+                pos = (pos[0] + direction[0], pos[1] + direction[1])
+            if piece.verify_square(pos):
+                valid_moves.add(pos)
+        return valid_moves
+    if kind == "C":
+        steps = [(1, 2), (2, 1), (2, -1), (1, -2),
+                 (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+    else:
+        steps = CARDINALS + DIAGONALS
+        valid_moves.update(piece.list_castling_moves())
+    for step in steps:
+        pos = (piece.pos[0] + step[0], piece.pos[1] + step[1])
+        if piece.verify_square(pos):
+            valid_moves.add(pos)
+    return valid_moves
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+def main(number=2000):
+    print(f"{'position':<18}{'stepwise':>12}{'tables':>12}{'bitboard':>12}"
+          f"{'speedup':>10}")
+    for name, moves in POSITIONS.items():
+        board = play(Board(), moves)
+        bit_board = play(BitBoard(), moves)
+        pieces = list(board.board.values())
+        positions = list(board.board)
+        for piece in pieces:
+            assert stepwise_moves(piece) == piece.list_moves()
+        stepwise = bench(lambda: [stepwise_moves(p) for p in pieces], number)
+        tables = bench(lambda: [p.list_moves() for p in pieces], number)
+        bitboard = bench(lambda: [bit_board.list_targets(pos) for pos in positions],
+                         number)
+        print(f"{name:<18}{stepwise*1e6:>10.1f}us{tables*1e6:>10.1f}us"
+              f"{bitboard*1e6:>10.1f}us{stepwise/tables:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#Benchmarks the opening book: microseconds per opening move as the server
+#plays it (move, reply, park) validated on a Board with the legality cache
+#off and on, and taken from the book; and the time to load a book and to
+#build its positions the first time games reach them.
+#Run from the root of the repo with: python -m benchmarks.bench_openings [-g 500]
+import argparse
+import time
+
+from src.chess_server.movecache import MOVE_CACHE, MOVE_CACHE_SIZE
+from src.chess_server.openings import OpeningBook, BOOK_PLIES
+from src.chess_server.protocol import TEXT
+from src.chess_server.server import Game
+from benchmarks.bench_memory import random_moves
+from benchmarks.bench_movegen import POSITIONS
+from src.chess_server.games import parse_move
+
+OPENINGS = [[parse_move(msg) for msg in moves.split()][:BOOK_PLIES]
+            for moves in POSITIONS.values() if moves]
+
+def validated(lines):
+    """
+    Plays the lines as GameServer.handle_request does outside the book
+    """
+    for line in lines:
+        game = Game(1, None, None)
+        for move in line:
+            game.board.move_piece(*move)
+            TEXT.move(game.board.move_history[-1], own=True)
+            game.park()
+
+def from_book(book, lines):
+    """
+    Plays the lines as GameServer.play_book_move does, up to a move ending
+    the game, which is not in the book
+    """
+    for line in lines:
+        game = Game(1, None, None, book=book.root)
+        for move in line:
+            node = game.book.child(move)
+            if node is None:
+                break
+            game.book = node
+            game.compact_board = node.snapshot
+            node.replies[TEXT][0]
+
+def per_move(function, lines):
+    start = time.perf_counter()
+    function(lines)
+    return (time.perf_counter() - start) / sum(map(len, lines)) * 1e6
+
+def main(game_count):
+    lines = [OPENINGS[i % len(OPENINGS)] for i in range(game_count)]
+    book = OpeningBook(OPENINGS)
+    from_book(book, OPENINGS) #build the positions
+    MOVE_CACHE.resize(0)
+    print(f"validated, no cache  {per_move(validated, lines):8.1f} us/move")
+    MOVE_CACHE.resize(MOVE_CACHE_SIZE)
+    validated(OPENINGS)
+    print(f"validated, cache     {per_move(validated, lines):8.1f} us/move")
+    print(f"opening book         {per_move(lambda l: from_book(book, l), lines):8.1f} us/move")
+    book_lines = [random_moves(seed, 16) for seed in range(game_count)]
+    start = time.perf_counter()
+    book = OpeningBook(book_lines)
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    from_book(book, book_lines)
+    built = time.perf_counter() - start
+    print(f"{game_count} line book: loaded in {loaded * 1e3:.1f}ms, positions built "
+          f"on first use in {built * 1e3:.0f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Opening book benchmark")
+    parser.add_argument("-g", help="games played and lines of the loaded book "
+        "(default 500)", type=int, default=500)
+    main(parser.parse_args().g)
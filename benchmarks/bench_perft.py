@@ -0,0 +1,60 @@
+#Perft benchmark suite: counts the legal move tree of a set of positions with
+#both board representations, checks the counts and reports nodes per second.
+#Besides the openings played from the start, the standard perft positions
+#(Kiwipete and positions 3-6 of the Chess Programming Wiki) are set up from
+#FEN; they cover castling, en passant, promotions and checks.
+#Run from the root of the repo with: python -m benchmarks.bench_perft [-d 3]
+import argparse
+import time
+
+from src.chess_server.engine import create_board, load_fens
+from benchmarks.bench_movegen import POSITIONS, play
+
+FEN_POSITIONS = {
+    "kiwipete": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "position_3": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "position_4": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "position_5": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "position_6": "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+}
+#published perft results
+EXPECTED = {
+    "start": {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609},
+    "kiwipete": {1: 48, 2: 2039, 3: 97862, 4: 4085603},
+    "position_3": {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624},
+    "position_4": {1: 6, 2: 264, 3: 9467, 4: 422333},
+    "position_5": {1: 44, 2: 1486, 3: 62379, 4: 2103487},
+    "position_6": {1: 46, 2: 2079, 3: 89890, 4: 3894594},
+}
+
+def set_up(representation, name):
+    if name in FEN_POSITIONS:
+        return load_fens([FEN_POSITIONS[name]], representation)[0]
+    return play(create_board(representation), POSITIONS[name])
+
+def run_perft(representation, name, depth):
+    board = set_up(representation, name)
+    start = time.perf_counter()
+    nodes = board.perft(depth)
+    return nodes, time.perf_counter() - start
+
+def main(depth):
+    print(f"{'position':<18}{'engine':<10}{'depth':>6}{'nodes':>10}"
+          f"{'seconds':>9}{'nodes/s':>10}")
+    for name in [*POSITIONS, *FEN_POSITIONS]:
+        counts = set()
+        for representation in ("dict", "bitboard"):
+            nodes, seconds = run_perft(representation, name, depth)
+            counts.add(nodes)
+            print(f"{name:<18}{representation:<10}{depth:>6}{nodes:>10}"
+                  f"{seconds:>9.2f}{nodes/seconds:>10.0f}")
+        expected = EXPECTED.get(name, {}).get(depth)
+        if len(counts) > 1 or (expected and counts != {expected}):
+            raise SystemExit(f"perft mismatch for {name}: {counts}, "
+                             f"expected {expected}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft benchmark")
+    parser.add_argument("-d", help="perft depth (default 3)", type=int, default=3)
+    args = parser.parse_args()
+    main(args.d)
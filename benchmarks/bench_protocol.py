@@ -0,0 +1,63 @@
+#Benchmarks bytes on the wire and protocol CPU time per move (decoding the
+#request and encoding the reply for both players) for the text and binary
+#protocols. Engine time is left out, it is the same for both.
+#Run from the root of the repo with: python -m benchmarks.bench_protocol
+import re
+import timeit
+
+from src.chess_server.engine import Board
+from src.chess_server.parser import msg_to_move, square_to_tuple
+from src.chess_server.protocol import TEXT, BINARY, encode_request
+from benchmarks.bench_movegen import POSITIONS, play
+
+def two_pass_text(buffer, history):
+    """
+    Text handling as it was before, validating and converting each message
+    with separate uncompiled regex searches
+    """
+    pattern = r'^([a-h][1-8])-([a-h][1-8])$'
+    replies = []
+    for line, move in zip(buffer.split(b"\n"), history):
+        msg = line.decode().strip()
+        if re.search(pattern, msg):
+            squares = re.search(pattern, msg)
+            (square_to_tuple(squares[1]), square_to_tuple(squares[2]))
+        reply = TEXT.move(move, own=True)
+        replies += [reply, reply]
+    return replies
+
+def run_protocol(protocol, buffer, history):
+    replies = []
+    start = 0
+    for move in history:
+        _, start = protocol.next_request(buffer, start)
+        reply = protocol.move(move, own=True)
+        if protocol.shared_move_reply:
+            replies += [reply, reply]
+        else:
+            replies += [reply, protocol.move(move, own=False)]
+    return replies
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+def main(number=200):
+    msgs = " ".join(POSITIONS.values()).split()
+    history = []
+    for moves in POSITIONS.values():
+        history += play(Board(), moves).move_history
+    text = "".join(msg + "\n" for msg in msgs).encode()
+    binary = b"".join(encode_request(*msg_to_move(msg)) for msg in msgs)
+    plies = len(history)
+    print(f"{'protocol':<16}{'request B':>10}{'replies B':>10}{'us/move':>9}")
+    for name, buffer, function in [
+            ("text (2 regex)", text, lambda: two_pass_text(text, history)),
+            ("text", text, lambda: run_protocol(TEXT, text, history)),
+            ("binary", binary, lambda: run_protocol(BINARY, binary, history))]:
+        reply_bytes = sum(map(len, function()))
+        seconds = bench(function, number)
+        print(f"{name:<16}{len(buffer)/plies:>10.1f}{reply_bytes/plies:>10.1f}"
+              f"{seconds/plies*1e6:>9.2f}")
+
+if __name__ == "__main__":
+    main()
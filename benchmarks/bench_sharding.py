@@ -0,0 +1,105 @@
+#Benchmarks server throughput in moves per second with games sharded over
+#1, 2, 4... worker processes. Games are paired from one process, then played
+#by several client processes so the clients are not the bottleneck.
+#Run from the root of the repo with: python -m benchmarks.bench_sharding [-g 200]
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_movegen import POSITIONS
+
+MOVES = POSITIONS["open_middlegame"].split()
+CLIENT_PROCESSES = max(2, os.cpu_count() // 2)
+
+def read_until(sock, text, buffer):
+    while text not in buffer[0]:
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError(f"closed before {text!r}")
+        buffer[0] += data
+    buffer[0] = buffer[0].split(text, 1)[1]
+
+def play_games(games, start, results):
+    """
+    Plays the benchmark moves in every game, one move in flight per game
+    """
+    buffers = {sock: [b""] for game in games for sock in game}
+    start.wait()
+    begin = time.perf_counter()
+    for ply, msg in enumerate(MOVES, 1):
+        for game in games:
+            game[(ply - 1) % 2].sendall(msg.encode() + b"\n")
+        for game in games:
+            for sock in game:
+                read_until(sock, f"{ply}. ".encode(), buffers[sock])
+                read_until(sock, b"\n", buffers[sock])
+    results.put((begin, time.perf_counter()))
+
+def connect_games(port, count, first):
+    games = []
+    for _ in range(count):
+        white = first or socket.create_connection(("127.0.0.1", port))
+        first = None
+        black = socket.create_connection(("127.0.0.1", port))
+        for sock in (white, black):
+            read_until(sock, b"you play", [b""])
+        games.append((white, black))
+    return games
+
+def wait_for_port(port, server):
+    """
+    Returns the first connection once the server is up
+    """
+    for _ in range(100):
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except ConnectionRefusedError:
+            if server.poll() is not None:
+                raise SystemExit("server exited")
+            time.sleep(0.1)
+    raise SystemExit("server did not start")
+
+def bench(workers, game_count, port):
+    server = subprocess.Popen([sys.executable, "-m", "src.chess_server",
+                               "-p", str(port), "-w", str(workers)])
+    try:
+        first = wait_for_port(port, server)
+        games = connect_games(port, game_count, first)
+        context = multiprocessing.get_context("fork")
+        start, results = context.Event(), context.Queue()
+        clients = [context.Process(target=play_games,
+                                   args=(games[i::CLIENT_PROCESSES], start, results))
+                   for i in range(CLIENT_PROCESSES)]
+        for client in clients:
+            client.start()
+        start.set()
+        times = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+        seconds = max(end for _, end in times) - min(begin for begin, _ in times)
+        return game_count * len(MOVES) / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(game_count, max_workers):
+    print(f"{'workers':>8}{'games':>8}{'moves/s':>10}{'scaling':>9}")
+    workers, base = 1, None
+    while workers <= max_workers:
+        rate = bench(workers, game_count, 21000 + workers)
+        base = base or rate
+        print(f"{workers:>8}{game_count:>8}{rate:>10.0f}{rate/base:>8.2f}x")
+        workers *= 2
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded server benchmark")
+    parser.add_argument("-g", help="concurrent games (default 200)", type=int,
+                        default=200)
+    parser.add_argument("-w", help="most worker processes (default cpu count)",
+                        type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    main(args.g, args.w)
@@ -0,0 +1,83 @@
+#Benchmarks the game registry with many idle games: memory held by the
+#games (boards, estimated by the registry, and in total, including the Game
+#objects that stay in memory) with and without a memory budget, time per move of the active games
+#(which stay in memory) and time to reload a spilled game on its next request.
+#Requests are run as GameServer.serve_player runs them, without sockets.
+#Run from the root of the repo with: python -m benchmarks.bench_spill [-g 20000]
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+
+from src.chess_server.engine import Board
+from src.chess_server.registry import GameRegistry
+from src.chess_server.server import Game
+from benchmarks.bench_memory import random_moves
+from benchmarks.bench_movegen import POSITIONS, play
+
+ACTIVE = 50
+
+def request(games, game, move=None):
+    """
+    One request as the server runs it: reload if spilled, play, park
+    """
+    games.touch(game)
+    if move:
+        assert game.board.move_piece(*move)
+    else:
+        game.position().display_board()
+    game.park()
+    games.touch(game)
+
+def fill(games, idle_count):
+    idle = play(Board(), POSITIONS["italian"]).compact()
+    for game_id in range(1, idle_count + 1):
+        game = Game(game_id, None, None, idle)
+        games[game_id] = game
+        game.compact_board = game.board.compact() #a board of its own
+        game.park()
+        games.touch(game)
+
+def time_active_moves(games, first_id):
+    """
+    Returns seconds per move of ACTIVE games taking turns, all starting after
+    the idle games were last used
+    """
+    active = [Game(first_id + i, None, None) for i in range(ACTIVE)]
+    for game in active:
+        games[game.game_id] = game
+    moves = random_moves(1, 40)
+    start = time.perf_counter()
+    for move in moves:
+        for game in active:
+            request(games, game, move)
+    return (time.perf_counter() - start) / (len(moves) * ACTIVE)
+
+def main(idle_count):
+    print(f"{'budget MB':<10}{'boards MB':>10}{'held MB':>9}{'us/move':>9}"
+          f"{'reload us':>11}{'spilled':>9}")
+    for budget in (None, 2 * 1024 * 1024):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            gc.collect()
+            tracemalloc.start()
+            games = GameRegistry(budget, spill_dir)
+            fill(games, idle_count)
+            gc.collect()
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            boards = games.resident_bytes
+            per_move = time_active_moves(games, idle_count + 1)
+            start = time.perf_counter()
+            for game_id in range(1, 201):
+                request(games, games[game_id])
+            reload = (time.perf_counter() - start) / 200
+            print(f"{budget // 1024 // 1024 if budget else 'none':<10}"
+                  f"{boards / 1024 / 1024:>10.1f}{held / 1024 / 1024:>9.1f}{per_move*1e6:>9.1f}{reload*1e6:>11.1f}"
+                  f"{games.spills:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Idle game spilling benchmark")
+    parser.add_argument("-g", help="idle games (default 20000)", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.g)
@@ -0,0 +1,63 @@
+#Benchmarks the cost of stats collection on the request path: decoding,
+#playing and replying to the moves of several games with stats off, with
+#stats on, and with debug logging on (what -v did for visibility before).
+#Run from the root of the repo with: python -m benchmarks.bench_stats
+import logging
+import timeit
+
+from src.chess_server.engine import Board
+from src.chess_server.protocol import TEXT
+from src.chess_server.server import request_kind
+from src.chess_server.stats import STATS, PARSE, MOVE, REPLY, clock
+from benchmarks.bench_movegen import POSITIONS
+
+def play_requests(buffers):
+    """
+    Runs the moves of each game the way GameServer.serve_player and
+    handle_request do, with their stats calls
+    """
+    for buffer in buffers:
+        board = Board()
+        start = 0
+        while True:
+            timed = STATS.enabled
+            if timed:
+                began = clock()
+            request, start = TEXT.next_request(buffer, start)
+            if not isinstance(request, tuple):
+                break
+            if timed:
+                STATS.observe(PARSE, clock() - began)
+                STATS.count("requests", request_kind(request))
+                began = clock()
+            board.move_piece(*request)
+            if timed:
+                STATS.observe(MOVE, clock() - began)
+                began = clock()
+            TEXT.move(board.move_history[-1], own=True)
+            if timed:
+                STATS.observe(REPLY, clock() - began)
+
+def bench(function, number=20):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+def main():
+    buffers = ["".join(msg + "\n" for msg in moves.split()).encode()
+               for moves in POSITIONS.values()]
+    plies = sum(len(moves.split()) for moves in POSITIONS.values())
+    logging.getLogger().addHandler(logging.NullHandler())
+    print(f"{'mode':<16}{'us/move':>9}{'overhead':>10}")
+    base = None
+    for name, stats, level in [("stats off", False, logging.WARNING),
+                               ("stats on", True, logging.WARNING),
+                               ("debug logging", False, logging.DEBUG)]:
+        STATS.enable(stats)
+        logging.getLogger().setLevel(level)
+        seconds = bench(lambda: play_requests(buffers)) / plies
+        base = base or seconds
+        print(f"{name:<16}{seconds*1e6:>9.1f}{(seconds / base - 1)*100:>9.1f}%")
+    STATS.enable(False)
+    logging.getLogger().setLevel(logging.WARNING)
+
+if __name__ == "__main__":
+    main()
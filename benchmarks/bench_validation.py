@@ -0,0 +1,48 @@
+#Benchmarks batch validation of an archive of random games, in games per
+#second as the pool grows from 1 to every core, and the peak memory of the
+#process streaming the archive.
+#Run from the root of the repo with: python -m benchmarks.bench_validation [-g 400]
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+from src.chess_client.validate import validate_files
+from src.chess_server.parser import tuple_to_square
+from benchmarks.bench_memory import random_moves
+
+PLIES = 80
+
+def write_archive(directory, game_count):
+    """
+    Writes one file per game in our own format
+    """
+    for seed in range(game_count):
+        with open(os.path.join(directory, f"game_{seed:06}"), "w") as game_file:
+            for from_pos, to_pos, promotion in random_moves(seed, PLIES):
+                symbol = {"C": "N"}.get(promotion, promotion)
+                game_file.write(f"{tuple_to_square(from_pos)}-{tuple_to_square(to_pos)}"
+                                f"{'=' + symbol if symbol else ''}\n")
+
+def main(game_count):
+    cores = os.cpu_count()
+    worker_counts = sorted({n for n in (1, 2, 4, cores) if n <= cores})
+    with tempfile.TemporaryDirectory() as directory:
+        write_archive(directory, game_count)
+        print(f"{'workers':>8}{'games/s':>10}{'speedup':>9}{'invalid':>9}{'max RSS MB':>12}")
+        base = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            invalid = sum(not report.valid()
+                          for report in validate_files([directory], workers))
+            rate = game_count / (time.perf_counter() - start)
+            base = base or rate
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"{workers:>8}{rate:>10.0f}{rate / base:>8.2f}x{invalid:>9}{rss:>12.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch validation benchmark")
+    parser.add_argument("-g", help="games (default 400)", type=int, default=400)
+    args = parser.parse_args()
+    main(args.g)
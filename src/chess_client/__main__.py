@@ -0,0 +1,45 @@
+import argparse
+import json
+import logging
+
+import src.chess_client.client as Client
+from src.chess_server.games import load_games
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chess Client load generator")
+    parser.add_argument("-v", help="activate the verbose mode", action="store_true")
+    parser.add_argument("-i", help="IP address of the server (default 127.0.0.1)",
+        default=Client.HOST)
+    parser.add_argument("-p", help="port of the server (default 2000)",
+        type=int, default=Client.PORT)
+    parser.add_argument("-f", help="game files or directories of them, PGN for "
+        "names ending in .pgn", nargs="+", required=True)
+    parser.add_argument("-c", help="player connections, two per game (default 2)",
+        type=int, default=2)
+    parser.add_argument("-r", help="target moves per second over all connections "
+        "(default as fast as the server answers)", type=float)
+    parser.add_argument("-d", help="seconds measured per run (default 10)",
+        type=float, default=10)
+    parser.add_argument("-w", help="seconds of warmup before measuring (default 2)",
+        type=float, default=2)
+    parser.add_argument("-n", help="runs, the median of each result is reported "
+        "(default 1)", type=int, default=1)
+    parser.add_argument("-b", help="play over the binary protocol", action="store_true")
+    parser.add_argument("-j", help="print the results as JSON", action="store_true")
+    args = parser.parse_args()
+
+    if args.v:
+        logging.basicConfig(level=logging.DEBUG)
+
+    results = Client.run(load_games(args.f), args.n, host=args.i, port=args.p,
+                         connections=args.c, rate=args.r, duration=args.d,
+                         warmup=args.w, binary=args.b)
+    if args.j:
+        print(json.dumps({"runs": [result.summary() for result in results],
+                          "median": Client.median_summary(results)}))
+    else:
+        for result in results:
+            print(result.report())
+        if len(results) > 1:
+            print("median:", ", ".join(f"{key} {value}" for key, value in
+                                       Client.median_summary(results).items()))
@@ -1,24 +1,286 @@
-import argparse
-import os
-import socket
-
-parser = argparse.ArgumentParser(description="Chess Client")
-parser.add_argument("-v", help="activate the verbose mode", action="store_true")
-parser.add_argument("-i", help="IP address of the interface (default 127.0.0.1)",
-    default="127.0.0.1")
-parser.add_argument("-p", help="port for server listens on (default 2000)",
-    type=int, default=2000)
-parser.add_argument("-f", help="input file of a game")
-args = parser.parse_args()
-
-HOST = args.i
-PORT = args.p
-if args.v:
-    logging.basicConfig(level=logging.DEBUG)
-
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.connect((HOST, PORT))
-    s.sendall(b'Hello, world')
-    data = s.recv(1024)
-
-print('Received', repr(data))
\ No newline at end of file
+#Load generator: replays game files over pairs of connections to a server at
+#a target move rate and measures the reply latency of every move.
+#Latency is measured from the time a move was due to be sent, not from when
+#it was sent, so a server falling behind the rate shows up in the latency
+#instead of silently lowering the rate (coordinated omission). Moves during
+#a warmup period are played but not measured.
+import asyncio
+import logging
+import math
+
+from src.chess_server.engine import Board
+from src.chess_server.parser import tuple_to_square
+from src.chess_server.protocol import (TEXT, FRAME, OK, OPPONENT_MOVED, WAITING,
+    BINARY_ON, STATUS_TEXT, encode_request, decode_move_flags)
+
+HOST = "127.0.0.1"
+PORT = 2000
+QUANTILES = (0.5, 0.99, 0.999)
+CONNECT_TIMEOUT = 10 #seconds to connect and pair
+REPLY_TIMEOUT = 10 #seconds past the end of a run before unanswered games are cut
+#lines of the "Game N started" message, which is followed by the board
+START_LINES = TEXT.game_started(1, "white", Board()).count(b"\n")
+ERROR_REPLIES = set(STATUS_TEXT.values())
+
+
+class ReplyError(Exception):
+    pass
+
+
+def quantile(latencies, q):
+    """
+    Returns the q quantile (0-1) of sorted latencies by nearest rank, 0 if
+    there are none
+    """
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, max(math.ceil(q * len(latencies)) - 1, 0))]
+
+def text_playable(moves):
+    """
+    Cuts a game before its first underpromotion, which the text protocol
+    cannot express
+    """
+    for ply, move in enumerate(moves):
+        if move[2] not in (None, "Q"):
+            logging.warning("Replaying %s of %s moves over text, "
+                            "underpromotions need -b", ply, len(moves))
+            return moves[:ply]
+    return moves
+
+
+class Connection:
+    """
+    One player connection of the load generator
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.binary = False
+
+    async def expect(self, start):
+        line = (await self.reader.readline()).decode()
+        if not line.startswith(start):
+            raise ReplyError(f"expected {start!r}, got {line.strip()!r}")
+
+    async def game_started(self):
+        await self.expect("Game ")
+        for _ in range(START_LINES - 1):
+            await self.reader.readline()
+
+    async def switch_to_binary(self):
+        self.writer.write(b"binary\n")
+        await self.expect(STATUS_TEXT[BINARY_ON])
+        self.binary = True
+
+    def send(self, move):
+        if self.binary:
+            self.writer.write(encode_request(*move))
+        else:
+            self.writer.write(
+                f"{tuple_to_square(move[0])}-{tuple_to_square(move[1])}\n".encode())
+
+    async def reply(self, own):
+        """
+        Reads the reply to a move, own or the opponent's
+
+        Returns:
+            True if the move ended the game
+        """
+        if self.binary:
+            status, _, _, flags = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+            if status != (OK if own else OPPONENT_MOVED):
+                raise ReplyError(f"status {status}")
+            return decode_move_flags(flags)[3] is not None
+        line = (await self.reader.readline()).decode().strip()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        if line in ERROR_REPLIES:
+            raise ReplyError(line)
+        return "Checkmate" in line or "Draw by" in line
+
+    def close(self):
+        self.writer.close()
+
+
+class LoadResult:
+    """
+    Measured moves of a run: their reply latencies in seconds, sorted, and
+    the seconds they were measured over
+    """
+    def __init__(self, latencies, seconds, games, errors):
+        self.latencies = sorted(latencies)
+        self.seconds = seconds
+        self.games = games
+        self.errors = errors
+
+    def moves_per_second(self):
+        return len(self.latencies) / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        """
+        Returns a dict of the results, latencies in milliseconds
+        """
+        summary = {"moves": len(self.latencies), "seconds": round(self.seconds, 3),
+                   "moves_per_second": round(self.moves_per_second(), 1),
+                   "games": self.games, "errors": self.errors}
+        for q in QUANTILES:
+            name = "p" + f"{q * 100:g}".replace(".", "")
+            summary[f"{name}_ms"] = round(quantile(self.latencies, q) * 1e3, 3)
+        return summary
+
+    def report(self):
+        summary = self.summary()
+        return (f"{summary['moves']} moves in {summary['seconds']}s: "
+                f"{summary['moves_per_second']} moves/s, latency "
+                f"p50 {summary['p50_ms']}ms p99 {summary['p99_ms']}ms "
+                f"p999 {summary['p999_ms']}ms, {summary['games']} games, "
+                f"{summary['errors']} errors")
+
+
+class LoadGenerator:
+    """
+    Plays games in pairs of connections, each pair replaying one game after
+    another from the list until the run is over. With a rate, the moves of
+    every pair are due at evenly spaced times adding up to that rate; without
+    one each move is sent as soon as the previous one is answered.
+    """
+    def __init__(self, games, host=HOST, port=PORT, connections=2, rate=None,
+                 duration=10, warmup=2, binary=False):
+        """
+        Arguments:
+            games: list of games as returned by games.load_games
+            host, port: address of the server
+            connections: player connections, rounded up to whole pairs
+            rate: target moves per second over all connections, None for
+                as fast as the server answers
+            duration: seconds of measured play
+            warmup: seconds of play before measuring
+            binary: play over the binary protocol instead of text
+        """
+        self.games = games if binary else [text_playable(game) for game in games]
+        self.games = [game for game in self.games if game]
+        if not self.games:
+            raise ValueError("no games to replay")
+        self.host = host
+        self.port = port
+        self.pairs = max(1, (connections + 1) // 2)
+        self.interval = self.pairs / rate if rate else 0.0
+        self.duration = duration
+        self.warmup = warmup
+        self.binary = binary
+        self.pairing = None
+        self.start = self.measure_from = self.stop_at = None
+        self.latencies = []
+        self.games_played = 0
+        self.errors = 0
+
+    async def run(self):
+        """
+        Returns the LoadResult of one run
+        """
+        loop = asyncio.get_running_loop()
+        self.pairing = asyncio.Lock()
+        self.latencies = []
+        self.games_played = self.errors = 0
+        self.start = loop.time()
+        self.measure_from = self.start + self.warmup
+        self.stop_at = self.measure_from + self.duration
+        tasks = [loop.create_task(self.play(index)) for index in range(self.pairs)]
+        _, pending = await asyncio.wait(
+            tasks, timeout=self.warmup + self.duration + REPLY_TIMEOUT)
+        for task in pending:
+            task.cancel()
+            self.errors += 1
+        seconds = min(loop.time(), self.stop_at) - self.measure_from
+        return LoadResult(self.latencies, max(seconds, 0.0), self.games_played,
+                          self.errors)
+
+    async def play(self, index):
+        """
+        Plays games over one pair of connections until the run is over
+        """
+        loop = asyncio.get_running_loop()
+        #the pairs are staggered so their moves are not all due at once
+        due = self.start + self.interval * index / self.pairs
+        game_index = index
+        while loop.time() < self.stop_at:
+            try:
+                white, black = await asyncio.wait_for(self.connect_pair(),
+                                                      CONNECT_TIMEOUT)
+            except (OSError, ReplyError, asyncio.TimeoutError) as error:
+                logging.warning("Could not start a game: %s", error)
+                self.errors += 1
+                await asyncio.sleep(min(1.0, self.stop_at - loop.time()))
+                continue
+            try:
+                due = await self.replay(white, black, self.games[game_index % len(self.games)],
+                                        max(due, loop.time()))
+                self.games_played += 1
+            except (ConnectionError, ReplyError, asyncio.IncompleteReadError) as error:
+                logging.warning("Game stopped: %s", error)
+                self.errors += 1
+            finally:
+                white.close()
+                black.close()
+            game_index += self.pairs
+
+    async def connect_pair(self):
+        """
+        Connects a white and a black player paired into the same game. Pairs
+        are connected one at a time, as the server pairs in arrival order.
+        """
+        async with self.pairing:
+            white = Connection(*await asyncio.open_connection(self.host, self.port))
+            await white.expect(STATUS_TEXT[WAITING])
+            black = Connection(*await asyncio.open_connection(self.host, self.port))
+            await black.game_started()
+        await white.game_started()
+        if self.binary:
+            await white.switch_to_binary()
+            await black.switch_to_binary()
+        return white, black
+
+    async def replay(self, white, black, moves, due):
+        """
+        Plays the moves of a game from the due time of its first move
+
+        Returns:
+            due time of the move after the game
+        """
+        loop = asyncio.get_running_loop()
+        for ply, move in enumerate(moves):
+            if due >= self.stop_at:
+                break
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            mover, opponent = (white, black) if ply % 2 == 0 else (black, white)
+            mover.send(move)
+            game_over = await mover.reply(own=True)
+            answered = loop.time()
+            if self.measure_from <= due and answered <= self.stop_at:
+                self.latencies.append(answered - due)
+            await opponent.reply(own=False)
+            due = due + self.interval if self.interval else loop.time()
+            if game_over:
+                break
+        return due
+
+def run(games, repeats=1, **options):
+    """
+    Runs the load generator repeats times, options as for LoadGenerator
+
+    Returns:
+        list of LoadResult, one per run
+    """
+    generator = LoadGenerator(games, **options)
+    return [asyncio.run(generator.run()) for _ in range(repeats)]
+
+def median_summary(results):
+    """
+    Returns the median of every value of the summaries of several runs
+    """
+    summaries = [result.summary() for result in results]
+    return {key: sorted(summary[key] for summary in summaries)[len(summaries) // 2]
+            for key in summaries[0]}
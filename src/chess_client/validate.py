@@ -0,0 +1,141 @@
+#Batch validation of archived games, eg. imports and anti-cheat audits.
+#Games stream from the files through a generator pipeline, in batches, to a
+#pool of worker processes that replay them on a Board each. At most a few
+#batches per worker are in flight, so memory stays flat however large the
+#archive is, and reports come back in archive order.
+#Run from the root of the repo with:
+#python -m src.chess_client.validate -f archive.pgn [-w 4] [-a] [-j]
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from src.chess_server.games import (GameFileError, game_sources, parse_move,
+    play, resolve_san)
+from src.chess_server.engine import Board, WHITE, BLACK
+
+BATCH_SIZE = 64 #games sent to a worker at a time
+BATCHES_IN_FLIGHT = 4 #per worker, bounds the games read ahead
+
+
+class GameReport:
+    """
+    Result of replaying one game: the moves played, the first illegal move
+    as (move number, move, message) or None, and the final state of the board
+    """
+    __slots__ = ("name", "moves", "illegal", "outcome", "to_move", "position")
+
+    def __init__(self, name, moves, illegal, board):
+        self.name = name
+        self.moves = moves
+        self.illegal = illegal
+        self.outcome = board.outcome
+        self.to_move = WHITE if board.last_moved_color == BLACK else BLACK
+        self.position = board.square_symbols() #symbols of a1..h8, space for empty
+
+    def valid(self):
+        return self.illegal is None
+
+    def summary(self):
+        return {"name": self.name, "moves": self.moves, "illegal": self.illegal,
+                "outcome": self.outcome, "to_move": self.to_move,
+                "position": self.position}
+
+    def __str__(self):
+        if self.illegal:
+            return f"{self.name}: {self.illegal[2]}"
+        state = self.outcome or f"{self.to_move} to move"
+        return f"{self.name}: {self.moves} moves, {state}"
+
+
+def validate_game(name, moves, san):
+    """
+    Replays a game as streamed by games.game_sources
+
+    Returns:
+        GameReport, stopping at the first illegal move
+    """
+    board = Board()
+    for ply, token in enumerate(moves):
+        label = f"move {ply + 1} {token}"
+        try:
+            move = resolve_san(board, token, label) if san else parse_move(token)
+            if move is None:
+                raise GameFileError(f"{label}: not a move")
+            play(board, move, label)
+        except GameFileError as error:
+            return GameReport(name, ply, (ply + 1, token, str(error)), board)
+    return GameReport(name, len(moves), None, board)
+
+def validate_batch(batch):
+    return [validate_game(*game) for game in batch]
+
+def batches(games, size):
+    games = iter(games)
+    while True:
+        batch = list(itertools.islice(games, size))
+        if not batch:
+            return
+        yield batch
+
+def validate_games(games, workers=None, batch_size=BATCH_SIZE):
+    """
+    Validates a stream of (name, moves, san) games over a process pool
+
+    Arguments:
+        games: iterable of games as yielded by games.game_sources
+        workers: worker processes, the number of cores if None, and 1 to
+            validate in this process
+        batch_size: games sent to a worker at a time
+
+    Returns:
+        generator of GameReport in the order of the games
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        for batch in batches(games, batch_size):
+            yield from validate_batch(batch)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for batch in batches(games, batch_size):
+            pending.append(pool.submit(validate_batch, batch))
+            if len(pending) >= workers * BATCHES_IN_FLIGHT:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def validate_files(paths, workers=None, batch_size=BATCH_SIZE):
+    """
+    Validates the games of files and directories, as validate_games
+    """
+    return validate_games(game_sources(paths), workers, batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch game validation")
+    parser.add_argument("-f", help="game files or directories of them, PGN for "
+        "names ending in .pgn", nargs="+", required=True)
+    parser.add_argument("-w", help="worker processes (default one per core)", type=int)
+    parser.add_argument("-b", help=f"games per batch (default {BATCH_SIZE})",
+        type=int, default=BATCH_SIZE)
+    parser.add_argument("-a", help="report every game, not only the invalid ones",
+        action="store_true")
+    parser.add_argument("-j", help="report as JSON lines", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    games = invalid = 0
+    for report in validate_files(args.f, args.w, args.b):
+        games += 1
+        invalid += not report.valid()
+        if args.a or not report.valid():
+            print(json.dumps(report.summary()) if args.j else report)
+    seconds = time.perf_counter() - start
+    print(f"{games} games, {invalid} invalid, in {seconds:.2f}s "
+          f"({games / seconds:.0f} games/s)", file=sys.stderr)
+    sys.exit(1 if invalid else 0)
@@ -1,4 +1,48 @@
-from src.chess_server.engine import *
+import argparse
+import logging
 
-board = Board()
-print(board.display_board())
+import src.chess_server.server as Server
+from src.chess_server.clock import TimeControl
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chess Server")
+    parser.add_argument("-v", help="activate the verbose mode", action="store_true")
+    parser.add_argument("-i", help="IP address of the interface (default 127.0.0.1)",
+        default=Server.HOST)
+    parser.add_argument("-p", help="port for server listens on (default 2000)",
+        type=int, default=Server.PORT)
+    parser.add_argument("-s", help="port spectators connect to (default 2001)",
+        type=int, default=Server.SPECTATOR_PORT)
+    parser.add_argument("-w", help="number of worker processes games are sharded "
+        "over (default 1)", type=int, default=1)
+    parser.add_argument("-g", help="log games to this file and recover the games "
+        "in progress from it on startup (single process only)")
+    parser.add_argument("-m", help="MB of boards kept in memory per process before "
+        "idle games are spilled to disk (default no limit)", type=float)
+    parser.add_argument("-t", help="collect stats and serve them over HTTP on this "
+        "port for scrapers (default off)", type=int)
+    parser.add_argument("-a", help="port on 127.0.0.1 taking admin commands such as "
+        "profile (default off)", type=int)
+    parser.add_argument("-c", help="time control of every game as <minutes>+<increment "
+        "seconds>, eg. 5+3 (default untimed)")
+    parser.add_argument("-o", help="opening book files or directories of them, PGN "
+        "for names ending in .pgn, else one line of [from]-[to] moves per line", nargs="+")
+    parser.add_argument("-l", help="play a single local game over stdin/stdout",
+        action="store_true")
+    args = parser.parse_args()
+    if args.g and args.w > 1:
+        parser.error("-g needs a single process (-w 1)")
+    try:
+        time_control = TimeControl.parse(args.c) if args.c else None
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.v:
+        logging.basicConfig(level=logging.DEBUG)
+
+    if args.l:
+        Server.run_local()
+    else:
+        memory_budget = int(args.m * 1024 * 1024) if args.m else None
+        Server.run(args.i, args.p, args.w, args.s, args.g, memory_budget, args.t,
+                   args.a, time_control, args.o)
@@ -0,0 +1,517 @@
+#Bitboard representation of the board, interchangeable with engine.Board
+import logging
+from collections import Counter
+
+from src.chess_server.engine import WHITE, BLACK, CARDINALS, DIAGONALS, KNIGHT_MOVES
+from src.chess_server.engine import CASTLING_RIGHTS, CHECKMATE, STALEMATE
+from src.chess_server.engine import THREEFOLD_REPETITION, FIFTY_MOVE_RULE
+from src.chess_server.compact import (PackedHistory, PIECE_TYPES, SQUARES,
+    PROMOTION_SYMBOLS, format_squares, square_delta, parse_fen, format_fen)
+
+#piece symbols in order pawn, rook, knight, bishop, queen, king
+SYMBOLS = {WHITE: "PRCBQK", BLACK: "prcbqk"}
+#castling king move -> matching rook move
+CASTLING_ROOK_MOVES = {
+    ((5, 1), (7, 1)): ((8, 1), (6, 1)),
+    ((5, 1), (3, 1)): ((1, 1), (4, 1)),
+    ((5, 8), (7, 8)): ((8, 8), (6, 8)),
+    ((5, 8), (3, 8)): ((1, 8), (4, 8))
+}
+
+def square_index(pos):
+    """
+    Converts a position tuple (x, y) into a bit index 0-63 (a1 = 0, h8 = 63)
+    """
+    return (pos[1] - 1)*8 + pos[0] - 1
+
+def index_to_square(index):
+    """
+    Converts a bit index 0-63 back into a position tuple (x, y)
+    """
+    return (index % 8 + 1, index // 8 + 1)
+
+def _in_bounds(x, y):
+    return 1 <= x <= 8 and 1 <= y <= 8
+
+def _step_masks(steps):
+    """
+    Returns list of 64 masks, each one containing the squares reachable with
+    a single step from that square
+    """
+    masks = []
+    for index in range(64):
+        x, y = index_to_square(index)
+        mask = 0
+        for dx, dy in steps:
+            if _in_bounds(x + dx, y + dy):
+                mask |= 1 << square_index((x + dx, y + dy))
+        masks.append(mask)
+    return masks
+
+def _ray_masks(direction):
+    """
+    Returns list of 64 masks, each one containing every square from that
+    square to the edge of the board in a direction (excluding itself)
+    """
+    masks = []
+    for index in range(64):
+        x, y = index_to_square(index)
+        mask = 0
+        x, y = x + direction[0], y + direction[1]
+        while _in_bounds(x, y):
+            mask |= 1 << square_index((x, y))
+            x, y = x + direction[0], y + direction[1]
+        masks.append(mask)
+    return masks
+
+def _direction_rays(directions):
+    """
+    Returns tuple of (ray masks, increasing) for each direction, where
+    increasing is True if the bit index grows along the ray, meaning the
+    closest blocker is the lowest set bit.
+    """
+    return tuple((_ray_masks(d), d[1] > 0 or (d[1] == 0 and d[0] > 0))
+                 for d in directions)
+
+KNIGHT_MASKS = _step_masks(KNIGHT_MOVES)
+KING_MASKS = _step_masks(CARDINALS + DIAGONALS)
+PAWN_ATTACK_MASKS = {
+    WHITE: _step_masks(((1, 1), (-1, 1))),
+    BLACK: _step_masks(((1, -1), (-1, -1)))
+}
+CARDINAL_RAYS = _direction_rays(CARDINALS)
+DIAGONAL_RAYS = _direction_rays(DIAGONALS)
+#squares of the kings and rooks that start the game, cleared once moved
+START_UNMOVED = sum(1 << square_index(pos) for pos in
+    ((1, 1), (5, 1), (8, 1), (1, 8), (5, 8), (8, 8)))
+
+def slide(index, rays, occupied):
+    """
+    Returns mask of squares attacked from index along the given rays,
+    stopping at (and including) the first occupied square of each ray
+    """
+    attacks = 0
+    for masks, increasing in rays:
+        ray = masks[index]
+        blockers = ray & occupied
+        if blockers:
+            if increasing:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= masks[first]
+        attacks |= ray
+    return attacks
+
+class BitBoard:
+    def __init__(self):
+        logging.debug("BitBoard initialising")
+        self.reset_board()
+        self.last_moved_color = BLACK
+        self.en_passant = None #bit index of the square passed by a pawn
+        self.halfmove_clock = 0
+        self.move_history = PackedHistory()
+        self.outcome = None
+        self.position_counts = Counter([self.position_key()])
+        self.version = 0 #see Board.version
+        self._display = None
+        self.ply_offset = 0 #see Board.ply_offset
+
+    def reset_board(self):
+        """
+        Resets the board to the starting configuration, see Board.reset_board.
+
+        Each piece symbol maps to a 64 bit int (BitBoard.pieces), bit
+        (y - 1)*8 + (x - 1) being set when the piece occupies (x, y).
+        Occupancy of each color is kept alongside in BitBoard.occupied.
+        """
+        self.pieces = dict.fromkeys(SYMBOLS[WHITE] + SYMBOLS[BLACK], 0)
+        self.occupied = {WHITE: 0, BLACK: 0}
+        for x, symbol in zip(range(1, 9), "RCBQKBCR"):
+            self._place(symbol, (x, 1))
+            self._place("P", (x, 2))
+            self._place("p", (x, 7))
+            self._place(symbol.lower(), (x, 8))
+        self.unmoved = START_UNMOVED
+
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        Builds a BitBoard from a position in Forsyth-Edwards Notation, see
+        Board.from_fen
+        """
+        compact, ply_offset = parse_fen(fen)
+        board = cls.__new__(cls)
+        board.pieces = dict.fromkeys(SYMBOLS[WHITE] + SYMBOLS[BLACK], 0)
+        board.occupied = {WHITE: 0, BLACK: 0}
+        for index, code in enumerate(compact.squares):
+            if code:
+                board._place(PIECE_TYPES[code].symbol, SQUARES[index])
+        board.unmoved = 0
+        for right in compact.castling_rights():
+            for pos in CASTLING_RIGHTS[right]:
+                board.unmoved |= 1 << square_index(pos)
+        board.last_moved_color = BLACK if compact.white_to_move else WHITE
+        board.en_passant = compact.en_passant
+        board.halfmove_clock = compact.halfmove_clock
+        board.move_history = PackedHistory()
+        board.outcome = None
+        board.position_counts = Counter([board.position_key()])
+        board.version = 0
+        board._display = None
+        board.ply_offset = ply_offset
+        color = WHITE if board.last_moved_color == BLACK else BLACK
+        if not any(True for _ in board.legal_moves(color)):
+            board.outcome = CHECKMATE if board.king_in_check(color) else STALEMATE
+        elif board.halfmove_clock >= 100:
+            board.outcome = FIFTY_MOVE_RULE
+        return board
+
+    def to_fen(self):
+        """
+        Returns the position in Forsyth-Edwards Notation
+        """
+        return format_fen(self.square_symbols(), self.last_moved_color == BLACK,
+                          self.castling_rights(), self.en_passant, self.halfmove_clock,
+                          (self.ply_offset + len(self.move_history)) // 2 + 1)
+
+    def _place(self, symbol, pos):
+        bit = 1 << square_index(pos)
+        self.pieces[symbol] |= bit
+        self.occupied[WHITE if symbol.isupper() else BLACK] |= bit
+
+    def piece_at(self, pos):
+        """
+        Returns symbol of the piece on a position, or None if empty
+        """
+        bit = 1 << square_index(pos)
+        if not (self.occupied[WHITE] | self.occupied[BLACK]) & bit:
+            return None
+        for symbol, mask in self.pieces.items():
+            if mask & bit:
+                return symbol
+
+    def move_piece(self, from_pos, to_pos, promotion=None):
+        """
+        Moves piece if move is valid with piece + check rules, see
+        Board.move_piece. The position is a handful of ints, so it is saved
+        and restored directly when a move leaves the own king in check.
+
+        Returns:
+            True/False if piece was moved successfully
+        """
+        if self.outcome:
+            logging.debug("Game is over (%s)", self.outcome)
+            return False
+        symbol = self.piece_at(from_pos)
+        if not symbol:
+            logging.debug("No piece in selected position")
+            return False
+        color = WHITE if symbol.isupper() else BLACK
+        if color == self.last_moved_color:
+            logging.debug("Attempting to move wrong color")
+            return False
+        if not self.list_targets(from_pos) >> square_index(to_pos) & 1:
+            return False
+        logging.debug("Move from %s to %s in piece valid moves", from_pos, to_pos)
+        if self._castling_through_check(symbol, from_pos, to_pos):
+            logging.debug("Castling out of or through check")
+            return False
+        if promotion and promotion.upper() not in PROMOTION_SYMBOLS:
+            return False
+        saved, target, promoted = self._make_move(from_pos, to_pos, promotion)
+        if self.king_in_check(color):
+            logging.debug("Move places own king in check")
+            self._unmake_move(saved)
+            return False
+        check_enemy = self.king_in_check(saved[4])
+        if self.halfmove_clock == 0:
+            self.position_counts.clear()
+        position_key = self.position_key()
+        self.position_counts[position_key] += 1
+        if not any(True for _ in self.legal_moves(saved[4])):
+            self.outcome = CHECKMATE if check_enemy else STALEMATE
+        elif self.position_counts[position_key] >= 3:
+            self.outcome = THREEFOLD_REPETITION
+        elif self.halfmove_clock >= 100:
+            self.outcome = FIFTY_MOVE_RULE
+        self.move_history.append([
+            len(self.move_history) + 1,
+            from_pos,
+            symbol,
+            to_pos,
+            target,
+            check_enemy,
+            promoted,
+            self.outcome
+        ])
+        self.version += 1
+        return True
+
+    def position_key(self):
+        """
+        Returns a hashable key identifying the position for repetitions:
+        the piece masks, side to move, castling rights and capturable en
+        passant square (the same things Board.zobrist_hash covers)
+        """
+        en_passant = None
+        if self.en_passant is not None:
+            enemy_pawns = self.pieces["p" if self.last_moved_color == WHITE else "P"]
+            if PAWN_ATTACK_MASKS[self.last_moved_color][self.en_passant] & enemy_pawns:
+                en_passant = self.en_passant
+        return (tuple(self.pieces.values()), self.last_moved_color,
+                self.castling_rights(), en_passant)
+
+    def castling_rights(self):
+        """
+        Returns castling rights in FEN notation, see Board.castling_rights
+        """
+        rights = ""
+        for right, (king_pos, rook_pos) in CASTLING_RIGHTS.items():
+            mask = (1 << square_index(king_pos)) | (1 << square_index(rook_pos))
+            if self.unmoved & mask == mask:
+                rights += right
+        return rights
+
+    def legal_moves(self, color):
+        """
+        Generates every legal move of a color in the same format as
+        Board.legal_moves
+        """
+        for symbol in SYMBOLS[color]:
+            mask = self.pieces[symbol]
+            while mask:
+                low = mask & -mask
+                mask ^= low
+                from_pos = index_to_square(low.bit_length() - 1)
+                targets = self.list_targets(from_pos)
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    to_pos = index_to_square(target.bit_length() - 1)
+                    if self._castling_through_check(symbol, from_pos, to_pos):
+                        continue
+                    saved, _, promoted = self._make_move(from_pos, to_pos)
+                    legal = not self.king_in_check(color)
+                    self._unmake_move(saved)
+                    if not legal:
+                        continue
+                    if promoted:
+                        for promotion in PROMOTION_SYMBOLS:
+                            yield (from_pos, to_pos, promotion)
+                    else:
+                        yield (from_pos, to_pos, None)
+
+    def perft(self, depth):
+        """
+        Counts the positions reached by every sequence of legal moves of a
+        given length, see Board.perft
+        """
+        if depth == 0:
+            return 1
+        color = WHITE if self.last_moved_color == BLACK else BLACK
+        moves = list(self.legal_moves(color))
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            saved = self._make_move(*move)[0]
+            nodes += self.perft(depth - 1)
+            self._unmake_move(saved)
+        return nodes
+
+    def _make_move(self, from_pos, to_pos, promotion=None):
+        """
+        Carries out a move (with castling, en passant and promotion) in place,
+        regardless of the moves validity
+
+        Returns:
+            tuple of the saved state to pass to _unmake_move, the symbol of
+            the captured piece and the symbol of the promoted piece (if any)
+        """
+        saved = (dict(self.pieces), dict(self.occupied), self.unmoved,
+                 self.en_passant, self.last_moved_color, self.halfmove_clock)
+        symbol = self.piece_at(from_pos)
+        color = WHITE if symbol.isupper() else BLACK
+        target = self.piece_at(to_pos)
+        to_index = square_index(to_pos)
+        promoted = None
+        self._force_move_piece(from_pos, to_pos)
+        self.en_passant = None
+        self.halfmove_clock = 0 if target or symbol in "Pp" else self.halfmove_clock + 1
+        if symbol in "Kk" and (from_pos, to_pos) in CASTLING_ROOK_MOVES:
+            self._force_move_piece(*CASTLING_ROOK_MOVES[(from_pos, to_pos)])
+        elif symbol in "Pp":
+            if saved[3] == to_index and from_pos[0] != to_pos[0]:
+                target = "p" if color == WHITE else "P"
+                captured = 1 << square_index((to_pos[0], from_pos[1]))
+                self.pieces[target] ^= captured
+                self.occupied[BLACK if color == WHITE else WHITE] ^= captured
+            if to_pos[1] in (1, 8):
+                promoted = (promotion or "Q").upper()
+                promoted = promoted if color == WHITE else promoted.lower()
+                self.pieces[symbol] ^= 1 << to_index
+                self.pieces[promoted] |= 1 << to_index
+            elif abs(to_pos[1] - from_pos[1]) == 2:
+                self.en_passant = square_index((from_pos[0],
+                                               (from_pos[1] + to_pos[1]) // 2))
+        self.last_moved_color = color
+        return saved, target, promoted
+
+    def _unmake_move(self, saved):
+        """
+        Restores the state saved by _make_move
+        """
+        (self.pieces, self.occupied, self.unmoved,
+         self.en_passant, self.last_moved_color, self.halfmove_clock) = saved
+
+    def _force_move_piece(self, from_pos, to_pos):
+        """
+        Moves a piece regardless of the moves validity, removing any occupant
+        of the target position
+        """
+        from_bit = 1 << square_index(from_pos)
+        to_bit = 1 << square_index(to_pos)
+        for symbol, mask in self.pieces.items():
+            if mask & to_bit:
+                self.pieces[symbol] = mask ^ to_bit
+            if mask & from_bit:
+                moved = symbol
+        self.pieces[moved] ^= from_bit | to_bit
+        color = WHITE if moved.isupper() else BLACK
+        enemy = BLACK if color == WHITE else WHITE
+        self.occupied[color] ^= from_bit | to_bit
+        self.occupied[enemy] &= ~to_bit
+        self.unmoved &= ~(from_bit | to_bit)
+
+    def list_targets(self, pos):
+        """
+        Returns mask of squares the piece on pos can move to, not taking
+        check into account (same rules as the Piece.list_moves methods, plus
+        en passant captures)
+        """
+        symbol = self.piece_at(pos)
+        if not symbol:
+            return 0
+        index = square_index(pos)
+        color = WHITE if symbol.isupper() else BLACK
+        own = self.occupied[color]
+        enemy = self.occupied[BLACK if color == WHITE else WHITE]
+        occupied = own | enemy
+        kind = symbol.upper()
+        if kind == "P":
+            if self.en_passant is not None:
+                enemy |= 1 << self.en_passant
+            return self._pawn_targets(index, color, occupied, enemy)
+        if kind == "C":
+            return KNIGHT_MASKS[index] & ~own
+        if kind == "B":
+            return slide(index, DIAGONAL_RAYS, occupied) & ~own
+        if kind == "R":
+            return slide(index, CARDINAL_RAYS, occupied) & ~own
+        if kind == "Q":
+            return slide(index, CARDINAL_RAYS + DIAGONAL_RAYS, occupied) & ~own
+        return (KING_MASKS[index] & ~own) | self._castling_targets(index, occupied)
+
+    @staticmethod
+    def _pawn_targets(index, color, occupied, enemy):
+        targets = PAWN_ATTACK_MASKS[color][index] & enemy
+        step, starting_row = (8, 1) if color == WHITE else (-8, 6)
+        single = index + step
+        if 0 <= single < 64 and not occupied >> single & 1:
+            targets |= 1 << single
+            double = single + step
+            if index // 8 == starting_row and not occupied >> double & 1:
+                targets |= 1 << double
+        return targets
+
+    def _castling_targets(self, index, occupied):
+        """
+        Returns mask of castling targets for an unmoved king on index, which
+        require an unmoved rook in the corner and empty squares between
+        """
+        targets = 0
+        if not self.unmoved >> index & 1:
+            return targets
+        row = index - index % 8
+        if (self.unmoved >> row & 1 and
+            not occupied & (0b1110 << row)):
+            targets |= 1 << (row + 2)
+        if (self.unmoved >> (row + 7) & 1 and
+            not occupied & (0b1100000 << row)):
+            targets |= 1 << (row + 6)
+        return targets
+
+    def _castling_through_check(self, symbol, from_pos, to_pos):
+        """
+        Returns True if the move is castling out of check or across an
+        attacked square
+        """
+        if symbol not in "Kk" or (from_pos, to_pos) not in CASTLING_ROOK_MOVES:
+            return False
+        enemy = BLACK if symbol == "K" else WHITE
+        passed_pos = ((from_pos[0] + to_pos[0]) // 2, from_pos[1])
+        return (self.square_attacked(square_index(from_pos), enemy) or
+                self.square_attacked(square_index(passed_pos), enemy))
+
+    def king_in_check(self, color):
+        """
+        Returns True if a king of a certain color is in check
+        """
+        king = self.pieces[SYMBOLS[color][5]]
+        if not king:
+            return False
+        enemy = BLACK if color == WHITE else WHITE
+        return self.square_attacked(king.bit_length() - 1, enemy)
+
+    def square_attacked(self, index, by_color):
+        """
+        Returns True if any piece of by_color attacks the square index
+        """
+        pawn, rook, knight, bishop, queen, king = (
+            self.pieces[symbol] for symbol in SYMBOLS[by_color])
+        other = BLACK if by_color == WHITE else WHITE
+        if PAWN_ATTACK_MASKS[other][index] & pawn:
+            return True
+        if KNIGHT_MASKS[index] & knight or KING_MASKS[index] & king:
+            return True
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        if slide(index, CARDINAL_RAYS, occupied) & (rook | queen):
+            return True
+        if slide(index, DIAGONAL_RAYS, occupied) & (bishop | queen):
+            return True
+        return False
+
+    def display_board(self):
+        """
+        Creates a pretty board for display_board server command, rendered
+        once per version
+
+        Returns:
+            string of pretty board (19 lines)
+        """
+        if self._display is None or self._display[0] != self.version:
+            pretty_board = format_squares(self.square_symbols())
+            logging.debug("\n" + pretty_board)
+            self._display = (self.version, pretty_board)
+        return self._display[1]
+
+    def square_symbols(self):
+        """
+        Returns a string of the 64 square symbols, a1 first, " " if empty
+        """
+        squares = [" "]*64
+        for symbol, mask in self.pieces.items():
+            while mask:
+                low = mask & -mask
+                squares[low.bit_length() - 1] = symbol
+                mask ^= low
+        return "".join(squares)
+
+    def changed_since(self, version):
+        """
+        Returns the squares changed since an earlier version, see
+        Board.changed_since
+        """
+        return square_delta(self.square_symbols(), self.move_history,
+                            self.version - version)
@@ -0,0 +1,201 @@
+#Time controls: a chess clock per game, kept by the Game next to its board,
+#and a timer wheel shared by every game of a server that finds flag-fall.
+#A move cancels the mover's timer and sets one for the opponent, both O(1),
+#and one loop callback per tick fires the timers due, walking the one slot of
+#that tick, which holds about clocks / SLOTS timers.
+import math
+import re
+import time
+
+from src.chess_server.engine import WHITE, BLACK
+
+TICK = 0.05 #seconds per slot of the timer wheel, the precision of flag-fall
+SLOTS = 1024 #slots of the timer wheel, one turn is SLOTS * TICK seconds
+#<minutes>+<increment seconds>, eg. "5+3"
+TIME_CONTROL_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\+(\d+(?:\.\d+)?)$')
+
+
+class TimeControl:
+    """
+    Time per player for the game and Fischer increment added to a player's
+    clock after each of their moves, in seconds
+    """
+    __slots__ = ("base", "increment")
+
+    def __init__(self, base, increment=0):
+        self.base = base
+        self.increment = increment
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parses "<minutes>+<increment seconds>", eg. "5+3" or "1+0"
+
+        Raises:
+            ValueError if the text is not a time control
+        """
+        control = TIME_CONTROL_PATTERN.match(text)
+        if not control or float(control[1]) <= 0:
+            raise ValueError(f"Bad time control {text!r}, expected eg. 5+3")
+        return cls(float(control[1]) * 60, float(control[2]))
+
+    def __str__(self):
+        return f"{self.base / 60:g}+{self.increment:g}"
+
+
+class GameClock:
+    """
+    The time left of both players of a game, running for the side to move
+    since a point in time of the server's clock
+    """
+    __slots__ = ("remaining", "increment", "running", "since", "timer")
+
+    def __init__(self, time_control, now):
+        """
+        Arguments:
+            time_control: TimeControl of the game
+            now: time the clock of white starts running
+        """
+        self.remaining = {WHITE: time_control.base, BLACK: time_control.base}
+        self.increment = time_control.increment
+        self.running = WHITE
+        self.since = now
+        self.timer = None #flag-fall Timer of the running side
+
+    def left(self, color, now):
+        """
+        Returns the seconds a player has left, negative once their flag fell
+        """
+        if color == self.running:
+            return self.remaining[color] - (now - self.since)
+        return self.remaining[color]
+
+    def deadline(self):
+        """
+        Returns the time the flag of the running side falls
+        """
+        return self.since + self.remaining[self.running]
+
+    def press(self, now):
+        """
+        Stops the clock of the side that moved, adding the increment, and
+        starts the clock of the other side
+        """
+        color = self.running
+        self.remaining[color] = self.left(color, now) + self.increment
+        self.running = BLACK if color == WHITE else WHITE
+        self.since = now
+
+
+class Timer:
+    """
+    A callback set on a TimerWheel, firing when the wheel reaches its slot
+    with no rounds left
+    """
+    __slots__ = ("callback", "args", "slot", "rounds")
+
+    def __init__(self, callback, args, slot, rounds):
+        self.callback = callback
+        self.args = args
+        self.slot = slot
+        self.rounds = rounds #turns of the wheel to wait before firing
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel. Timers are put in the slot of the tick they are due
+    at, so setting and cancelling one is a dict insert and delete and each
+    tick only looks at one slot. Timers due in the same tick fire in the
+    order they were set. Timers more than a turn of the wheel away count
+    their rounds down as the wheel passes them. With a loop, one loop callback
+    per tick fires the timers, and only while timers are set; without one,
+    advance() is called by hand. Timers fire up to one tick late, never early.
+    """
+    def __init__(self, tick=TICK, slots=SLOTS, loop=None, clock=None):
+        """
+        Arguments:
+            tick: seconds per slot
+            slots: number of slots
+            loop: event loop driving the wheel, or None to call advance()
+            clock: function returning the time, if None the loop time or
+                time.monotonic without a loop
+        """
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)] #Timer -> None, in the order set
+        self.loop = loop
+        self.clock = clock or (loop.time if loop else time.monotonic)
+        self.origin = self.clock() #time of tick 0
+        self.ticks = 0 #last tick processed
+        self.count = 0
+        self.handle = None
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, when, callback, *args):
+        """
+        Sets a timer calling callback(*args) once the time reaches when
+
+        Returns:
+            Timer to cancel it with
+        """
+        if not self.count:
+            #skip the idle ticks, every slot is empty
+            self.ticks = max(self.ticks, int((self.clock() - self.origin) / self.tick))
+        due = max(math.ceil((when - self.origin) / self.tick), self.ticks + 1)
+        timer = Timer(callback, args, due % len(self.slots),
+                      (due - self.ticks - 1) // len(self.slots))
+        self.slots[timer.slot][timer] = None
+        self.count += 1
+        if self.handle is None and self.loop is not None:
+            self._arm()
+        return timer
+
+    def cancel(self, timer):
+        slot = self.slots[timer.slot]
+        if timer in slot:
+            del slot[timer]
+            self.count -= 1
+
+    def advance(self, now):
+        """
+        Processes the ticks up to now, calling the timers due
+
+        Returns:
+            number of timers fired
+        """
+        target = int((now - self.origin) / self.tick)
+        fired = 0
+        while self.ticks < target and self.count:
+            self.ticks += 1
+            slot = self.slots[self.ticks % len(self.slots)]
+            due = []
+            for timer in slot:
+                if timer.rounds:
+                    timer.rounds -= 1
+                else:
+                    due.append(timer)
+            for timer in due:
+                del slot[timer]
+            self.count -= len(due)
+            fired += len(due)
+            for timer in due:
+                timer.callback(*timer.args)
+        self.ticks = max(self.ticks, target)
+        return fired
+
+    def _arm(self):
+        self.handle = self.loop.call_at(self.origin + (self.ticks + 1) * self.tick,
+                                        self._on_tick)
+
+    def _on_tick(self):
+        self.advance(self.loop.time())
+        if self.count:
+            self._arm()
+        else:
+            self.handle = None
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
@@ -0,0 +1,582 @@
+#Compact storage of games, for hosting very many of them at once
+#positions are 64 bytes of piece codes pointing at shared piece descriptors
+#and move history is packed into 16 bit move codes plus a byte per move, with
+#a 37 byte snapshot of the position every SNAPSHOT_PLIES moves
+import re
+import struct
+from array import array
+
+#square index (a1 = 0, h8 = 63) <-> shared position tuple (x, y)
+SQUARES = tuple((index % 8 + 1, index // 8 + 1) for index in range(64))
+SQUARE_INDEX = {pos: index for index, pos in enumerate(SQUARES)}
+
+EMPTY = 0
+#pieces a pawn promotes to, single symbols so "in" matches whole ones, in the
+#order of their 1-based codes in packed moves
+PROMOTION_SYMBOLS = ("Q", "R", "B", "C")
+#castling rights in FEN order, each one bit of CompactBoard.castling
+CASTLING_ORDER = "KQkq"
+PAWN_CODES = (1, 7)
+KING_CODES = (6, 12)
+
+#squares, castling, white to move, en passant (NO_SQUARE if none),
+#halfmove clock, version and number of repetition hashes of a packed position
+POSITION = struct.Struct("<64sBBBHIB")
+NO_SQUARE = 255
+#squares as two piece codes per byte, castling, white to move, en passant
+#(NO_SQUARE if none) and halfmove clock of a history snapshot, all zero for
+#one not kept
+SNAPSHOT = struct.Struct("<32sBBBH")
+#moves between the snapshots of a history, any position of a game is rebuilt
+#from the one before it with fewer moves than this
+SNAPSHOT_PLIES = 16
+#position size and move count at the start of CompactBoard.to_bytes
+STORED_GAME = struct.Struct("<HI")
+#memory held by a CompactBoard in the starting position and its objects,
+#measured by bench_memory
+COMPACT_BYTES = 512
+
+#FEN of the starting position; FEN letters are the piece symbols except
+#N/n for knights, which are C/c here
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_LETTERS = str.maketrans("Cc", "Nn")
+FEN_PIECES = {"N": "C", "n": "c", **{symbol: symbol for symbol in "PRBQKprbqk"}}
+EMPTY_RUN = re.compile(" +")
+#castling right -> (king square index, rook square index)
+CASTLING_SQUARES = {"K": (4, 7), "Q": (4, 0), "k": (60, 63), "q": (60, 56)}
+
+#(x, y) steps of the pieces, for checking a FEN position is possible
+KNIGHT_STEPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_STEPS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+
+#pieces of the pretty board of the display_board server command
+BOARD_COLUMNS = "    a   b   c   d   e   f   g   h\n"
+BOARD_DIVIDER = "  --------------------------------\n"
+BOARD_ROW = "{} | {} | {} | {} | {} | {} | {} | {} | {}\n" + BOARD_DIVIDER
+
+
+class PieceType:
+    """
+    Flyweight descriptor shared by every piece of one kind and color
+    """
+    __slots__ = ("code", "symbol", "kind", "white")
+
+    def __init__(self, code, symbol):
+        self.code = code
+        self.symbol = symbol
+        self.kind = symbol.upper()
+        self.white = symbol.isupper()
+
+    def __repr__(self):
+        return f"PieceType({self.symbol!r})"
+
+#piece code -> descriptor, code 0 is an empty square
+PIECE_TYPES = (None,) + tuple(PieceType(code, symbol)
+                              for code, symbol in enumerate("PRCBQKprcbqk", 1))
+PIECE_CODES = {piece_type.symbol: piece_type.code for piece_type in PIECE_TYPES[1:]}
+#bytes.translate table from piece codes to symbols, " " for empty squares
+SYMBOL_TABLE = bytes([ord(" ")] + [ord(piece_type.symbol) for piece_type in
+                                   PIECE_TYPES[1:]]).ljust(256, b" ")
+
+
+def format_squares(symbols):
+    """
+    Formats the pretty board used by the display_board server command
+
+    Arguments:
+        symbols: string of the 64 square symbols, a1 first, " " if empty
+
+    Returns:
+        string of pretty board (19 lines)
+    """
+    return (BOARD_COLUMNS + BOARD_DIVIDER
+            + "".join(BOARD_ROW.format(y, *symbols[(y - 1)*8:y*8])
+                      for y in range(8, 0, -1))
+            + BOARD_COLUMNS)
+
+def square_delta(symbols, history, moves):
+    """
+    Returns the squares changed by the last moves of a game
+
+    Arguments:
+        symbols: string of the 64 square symbols now, a1 first
+        history: PackedHistory of the game
+        moves: number of moves played since the version the delta starts at
+
+    Returns:
+        dict of square index -> symbol (" " if empty) in index order, or None
+          if the history does not go back that far
+    """
+    if not 0 <= moves <= len(history):
+        return None
+    touched = history.touched_squares(len(history) - moves)
+    return {index: symbols[index] for index in sorted(touched)}
+
+
+def parse_fen(fen):
+    """
+    Parses a position in Forsyth-Edwards Notation. The halfmove clock and
+    fullmove number may be left out, as in EPD files.
+
+    Returns:
+        (CompactBoard with an empty history, plies played before the
+        position according to the fullmove number)
+
+    Raises:
+        ValueError if the FEN is malformed or the position impossible
+    """
+    fields = fen.split()
+    if not 4 <= len(fields) <= 6:
+        raise ValueError(f"FEN needs 4 to 6 fields: {fen!r}")
+    placement, side, castling, en_passant = fields[:4]
+    rows = placement.split("/")
+    if len(rows) != 8:
+        raise ValueError(f"FEN needs 8 rows: {fen!r}")
+    squares = bytearray(64)
+    for start, row in zip(range(56, -8, -8), rows):
+        x = 0
+        for char in row:
+            if char in "12345678":
+                x += int(char)
+            elif char in FEN_PIECES and x < 8:
+                squares[start + x] = PIECE_CODES[FEN_PIECES[char]]
+                x += 1
+            else:
+                raise ValueError(f"Bad FEN row {row!r}: {fen!r}")
+        if x != 8:
+            raise ValueError(f"Bad FEN row {row!r}: {fen!r}")
+    if squares.count(KING_CODES[0]) != 1 or squares.count(KING_CODES[1]) != 1:
+        raise ValueError(f"FEN needs one king of each color: {fen!r}")
+    if any(code in PAWN_CODES for code in squares[:8] + squares[56:]):
+        raise ValueError(f"FEN pawn on the first or last row: {fen!r}")
+    if side not in ("w", "b"):
+        raise ValueError(f"Bad FEN side to move {side!r}: {fen!r}")
+    #the king of the side that just moved cannot be left in check
+    waiting_king = squares.index(KING_CODES[side == "w"])
+    if _attacked(squares, waiting_king, side == "w"):
+        raise ValueError(f"FEN side not to move is in check: {fen!r}")
+    castling_bits = 0
+    for right in "" if castling == "-" else castling:
+        if right not in CASTLING_ORDER or castling_bits >> CASTLING_ORDER.index(right) & 1:
+            raise ValueError(f"Bad FEN castling rights {castling!r}: {fen!r}")
+        king, rook = CASTLING_SQUARES[right]
+        if (squares[king] != PIECE_CODES["K" if right.isupper() else "k"]
+                or squares[rook] != PIECE_CODES["R" if right.isupper() else "r"]):
+            raise ValueError(f"FEN castling right {right} without its king and rook: {fen!r}")
+        castling_bits |= 1 << CASTLING_ORDER.index(right)
+    en_passant_index = None
+    if en_passant != "-":
+        if not re.fullmatch(r"[a-h][36]", en_passant) or (en_passant[1] == "3") != (side == "b"):
+            raise ValueError(f"Bad FEN en passant square {en_passant!r}: {fen!r}")
+        en_passant_index = "abcdefgh".index(en_passant[0]) + (int(en_passant[1]) - 1) * 8
+        #the pawn that moved two rows stands in front of the square it passed
+        forward = 8 if side == "b" else -8
+        if (squares[en_passant_index] or squares[en_passant_index - forward]
+                or squares[en_passant_index + forward] != PAWN_CODES[side == "w"]):
+            raise ValueError(f"FEN en passant square {en_passant} without the pawn "
+                             f"that passed it: {fen!r}")
+    try:
+        halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError(f"Bad FEN move counters: {fen!r}") from None
+    if halfmove_clock < 0 or fullmove < 1:
+        raise ValueError(f"Bad FEN move counters: {fen!r}")
+    compact = CompactBoard(squares, castling_bits, side == "w", en_passant_index,
+                           halfmove_clock)
+    return compact, 2 * (fullmove - 1) + (side == "b")
+
+def _attacked(squares, index, white):
+    """
+    Returns True if a piece of one color attacks a square
+
+    Arguments:
+        squares: bytearray of the 64 piece codes, a1 first
+        index: square index
+        white: True to look for white attackers, False for black ones
+    """
+    base = 0 if white else 6
+    x, y = index % 8, index // 8
+    pawn_y = y - 1 if white else y + 1
+    for pawn_x in (x - 1, x + 1):
+        if 0 <= pawn_x < 8 and 0 <= pawn_y < 8 and squares[pawn_y*8 + pawn_x] == base + 1:
+            return True
+    orthogonal = KING_STEPS[::2]
+    diagonal = KING_STEPS[1::2]
+    for steps, codes, sliding in ((KNIGHT_STEPS, (base + 3,), False),
+                                  (KING_STEPS, (base + 6,), False),
+                                  (orthogonal, (base + 2, base + 5), True),
+                                  (diagonal, (base + 4, base + 5), True)):
+        for dx, dy in steps:
+            to_x, to_y = x + dx, y + dy
+            while 0 <= to_x < 8 and 0 <= to_y < 8:
+                code = squares[to_y*8 + to_x]
+                if code:
+                    if code in codes:
+                        return True
+                    break
+                if not sliding:
+                    break
+                to_x, to_y = to_x + dx, to_y + dy
+    return False
+
+def format_fen(symbols, white_to_move, castling_rights, en_passant,
+               halfmove_clock, fullmove):
+    """
+    Returns a position in Forsyth-Edwards Notation
+
+    Arguments:
+        symbols: string of the 64 square symbols, a1 first, " " if empty
+        castling_rights: eg. "KQkq", "" for none
+        en_passant: square index passed by a pawn moving two rows, or None
+    """
+    placement = "/".join(
+        EMPTY_RUN.sub(lambda run: str(len(run[0])), symbols[start:start + 8])
+        for start in range(56, -8, -8)).translate(FEN_LETTERS)
+    square = ("-" if en_passant is None else
+              "abcdefgh"[en_passant % 8] + str(en_passant // 8 + 1))
+    return (f"{placement} {'w' if white_to_move else 'b'} {castling_rights or '-'} "
+            f"{square} {halfmove_clock} {fullmove}")
+
+
+class PackedHistory:
+    """
+    Move history packed into an array of 16 bit move codes and a bytearray
+    with the moved and captured piece codes, 3 bytes per move instead of a
+    list of tuples and strings.
+
+    Reads and appends use the list form of Board.move_history entries:
+    [move number, from_pos, symbol, to_pos, captured symbol, check,
+     promoted symbol, outcome], so write_msg renders them as before.
+    A move code holds from index (bits 0-5), to index (bits 6-11), promotion
+    (bits 12-14, 1 + index in "QRBC") and check (bit 15).
+    Snapshots of the position after every SNAPSHOT_PLIES moves are kept by
+    the Board playing the game, so any position is rebuilt with a few moves
+    instead of replaying the game. A history without them, such as one
+    recovered from the game log, starts from the starting position.
+    """
+    __slots__ = ("moves", "pieces", "outcome", "snapshots")
+
+    def __init__(self, entries=()):
+        self.moves = array("H")
+        self.pieces = bytearray()
+        self.outcome = None #only the last move can end the game
+        #SNAPSHOT records, the one at index i after i * SNAPSHOT_PLIES moves
+        self.snapshots = bytearray()
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry):
+        _, from_pos, symbol, to_pos, captured, check, promoted, outcome = entry
+        promotion = PROMOTION_SYMBOLS.index(promoted.upper()) + 1 if promoted else 0
+        self.moves.append(SQUARE_INDEX[from_pos] | SQUARE_INDEX[to_pos] << 6
+                          | promotion << 12 | bool(check) << 15)
+        self.pieces.append(PIECE_CODES[symbol] | (PIECE_CODES[captured] << 4
+                                                  if captured else 0))
+        self.outcome = outcome
+
+    def copy(self, moves=None):
+        """
+        Returns a copy of the history, or of its first moves
+        """
+        if moves is None or moves == len(self.moves):
+            history = PackedHistory()
+            history.moves = array("H", self.moves)
+            history.pieces = bytearray(self.pieces)
+            history.outcome = self.outcome
+            history.snapshots = bytearray(self.snapshots)
+            return history
+        history = PackedHistory()
+        history.moves = self.moves[:moves]
+        history.pieces = self.pieces[:moves]
+        history.snapshots = self.snapshots[:(moves // SNAPSHOT_PLIES + 1) * SNAPSHOT.size]
+        return history
+
+    def pop(self):
+        entry = self[-1]
+        self.moves.pop()
+        del self.pieces[-1]
+        self.outcome = None
+        del self.snapshots[(len(self.moves) // SNAPSHOT_PLIES + 1) * SNAPSHOT.size:]
+        return entry
+
+    def add_snapshot(self, snapshot):
+        """
+        Keeps a CompactBoard.pack_snapshot of the position after the moves so
+        far, a multiple of SNAPSHOT_PLIES
+        """
+        start = len(self.moves) // SNAPSHOT_PLIES * SNAPSHOT.size
+        del self.snapshots[start:]
+        self.snapshots += bytes(start - len(self.snapshots)) + snapshot
+
+    def snapshot_before(self, ply):
+        """
+        Returns (moves, snapshot) of the last snapshot kept after at most ply
+        moves, (0, START_SNAPSHOT) if none is
+        """
+        for index in range(min(ply // SNAPSHOT_PLIES,
+                               len(self.snapshots) // SNAPSHOT.size - 1), -1, -1):
+            snapshot = self.snapshots[index * SNAPSHOT.size:(index + 1) * SNAPSHOT.size]
+            if any(snapshot):
+                return index * SNAPSHOT_PLIES, bytes(snapshot)
+        return 0, START_SNAPSHOT
+
+    def entry(self, index):
+        """
+        Unpacks the move at a non negative index into its list form
+        """
+        code = self.moves[index]
+        pieces = self.pieces[index]
+        piece_type = PIECE_TYPES[pieces & 15]
+        promoted = None
+        if code >> 12 & 7:
+            promoted = PROMOTION_SYMBOLS[(code >> 12 & 7) - 1]
+            if not piece_type.white:
+                promoted = promoted.lower()
+        captured = PIECE_TYPES[pieces >> 4]
+        return [
+            index + 1,
+            SQUARES[code & 63],
+            piece_type.symbol,
+            SQUARES[code >> 6 & 63],
+            captured.symbol if captured else None,
+            bool(code >> 15),
+            promoted,
+            self.outcome if index == len(self.moves) - 1 else None
+        ]
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.entry(i) for i in range(*index.indices(len(self.moves)))]
+        if index < 0:
+            index += len(self.moves)
+        if not 0 <= index < len(self.moves):
+            raise IndexError("move history index out of range")
+        return self.entry(index)
+
+    def __iter__(self):
+        return (self.entry(i) for i in range(len(self.moves)))
+
+    def __eq__(self, other):
+        if isinstance(other, PackedHistory):
+            return (self.moves == other.moves and self.pieces == other.pieces
+                    and self.outcome == other.outcome)
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"PackedHistory({list(self)!r})"
+
+    def nbytes(self):
+        """
+        Returns the bytes used by the packed moves and snapshots
+        """
+        return (self.moves.itemsize * len(self.moves) + len(self.pieces)
+                + len(self.snapshots))
+
+    def append_packed(self, code, pieces):
+        """
+        Appends a move already packed into its move code and piece byte
+        """
+        self.moves.append(code)
+        self.pieces.append(pieces)
+        self.outcome = None
+
+    def touched_squares(self, start):
+        """
+        Returns the set of square indices emptied or filled by the moves from
+        index start on: their from and to squares, the rook squares when
+        castling and, for pawn captures, the square a pawn taken en passant
+        would have stood on (unchanged at worst)
+        """
+        touched = set()
+        for code, pieces in zip(self.moves[start:], self.pieces[start:]):
+            from_index = code & 63
+            to_index = code >> 6 & 63
+            touched.add(from_index)
+            touched.add(to_index)
+            kind = pieces & 15
+            if kind in KING_CODES and abs(to_index - from_index) == 2:
+                if to_index > from_index:
+                    touched.update((to_index + 1, to_index - 1))
+                else:
+                    touched.update((to_index - 2, to_index + 1))
+            elif kind in PAWN_CODES and (to_index - from_index) % 8:
+                touched.add(from_index - from_index % 8 + to_index % 8)
+        return touched
+
+
+class CompactBoard:
+    """
+    A game stored in a 64 byte board of piece codes plus the state needed to
+    carry on playing it. Board.compact() and Board.from_compact() convert
+    between this and a playable Board.
+    """
+    __slots__ = ("squares", "castling", "white_to_move", "en_passant",
+                 "halfmove_clock", "outcome", "positions", "history", "version",
+                 "_display")
+
+    def __init__(self, squares, castling, white_to_move, en_passant=None,
+                 halfmove_clock=0, outcome=None, positions=(), history=None,
+                 version=0):
+        """
+        Arguments:
+            squares: 64 bytes of piece codes, a1 first
+            castling: castling rights as bits in "KQkq" order
+            white_to_move: True if white plays next
+            en_passant: square index passed by a pawn moving two rows, or None
+            halfmove_clock: moves since the last capture or pawn move
+            outcome: how the game ended, or None
+            positions: Zobrist hashes since the last capture or pawn move
+            history: PackedHistory of the game
+            version: Board.version, the number of changes to the position
+        """
+        self.squares = bytes(squares)
+        self.castling = castling
+        self.white_to_move = white_to_move
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.outcome = outcome
+        self.positions = array("Q", positions)
+        self.history = history if history is not None else PackedHistory()
+        self.version = version
+        #(version, pretty board), kept across Board.compact and from_compact
+        self._display = None
+
+    def copy(self):
+        """
+        Returns a copy with its own positions and history, to play on
+        """
+        copy = CompactBoard(self.squares, self.castling, self.white_to_move,
+                            self.en_passant, self.halfmove_clock, self.outcome,
+                            self.positions, self.history.copy(), self.version)
+        copy._display = self._display
+        return copy
+
+    def piece_at(self, pos):
+        """
+        Returns the PieceType on a position, or None if empty
+        """
+        return PIECE_TYPES[self.squares[SQUARE_INDEX[pos]]]
+
+    def castling_rights(self):
+        """
+        Returns the castling rights like Board.castling_rights, eg. "KQkq"
+        """
+        return "".join(right for bit, right in enumerate(CASTLING_ORDER)
+                       if self.castling >> bit & 1)
+
+    def pack_position(self):
+        """
+        Returns the position without the history or outcome as bytes, for
+        snapshots of games in progress
+        """
+        en_passant = NO_SQUARE if self.en_passant is None else self.en_passant
+        return POSITION.pack(self.squares, self.castling, self.white_to_move,
+                             en_passant, self.halfmove_clock, self.version,
+                             len(self.positions)) + self.positions.tobytes()
+
+    @classmethod
+    def unpack_position(cls, data, history):
+        """
+        Rebuilds a game from the bytes of pack_position and its history
+        """
+        (squares, castling, white_to_move, en_passant, halfmove_clock, version,
+         count) = POSITION.unpack_from(data)
+        positions = array("Q")
+        positions.frombytes(data[POSITION.size:POSITION.size + count * 8])
+        return cls(squares, castling, bool(white_to_move),
+                   None if en_passant == NO_SQUARE else en_passant,
+                   halfmove_clock, None, positions, history, version)
+
+    def pack_snapshot(self):
+        """
+        Returns the position as a SNAPSHOT record for PackedHistory.add_snapshot,
+        without the repetition hashes or version
+        """
+        squares = self.squares
+        en_passant = NO_SQUARE if self.en_passant is None else self.en_passant
+        return SNAPSHOT.pack(bytes(squares[index] | squares[index + 1] << 4
+                                   for index in range(0, 64, 2)),
+                             self.castling, self.white_to_move, en_passant,
+                             self.halfmove_clock)
+
+    @classmethod
+    def from_snapshot(cls, data, history):
+        """
+        Rebuilds a position from a SNAPSHOT record and the history after it
+        """
+        pairs, castling, white_to_move, en_passant, halfmove_clock = SNAPSHOT.unpack(data)
+        squares = bytearray(64)
+        squares[0::2] = bytes(pair & 15 for pair in pairs)
+        squares[1::2] = bytes(pair >> 4 for pair in pairs)
+        return cls(squares, castling, bool(white_to_move),
+                   None if en_passant == NO_SQUARE else en_passant,
+                   halfmove_clock, None, (), history)
+
+    def to_bytes(self):
+        """
+        Returns the position and packed move history of a game in progress
+        as bytes, for storing it on disk
+        """
+        position = self.pack_position()
+        history = self.history
+        return (STORED_GAME.pack(len(position), len(history)) + position
+                + history.moves.tobytes() + history.pieces + history.snapshots)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Rebuilds a game from the bytes of to_bytes
+        """
+        position_size, moves = STORED_GAME.unpack_from(data)
+        start = STORED_GAME.size + position_size
+        history = PackedHistory()
+        history.moves.frombytes(data[start:start + moves * 2])
+        history.pieces += data[start + moves * 2:start + moves * 3]
+        history.snapshots += data[start + moves * 3:]
+        return cls.unpack_position(data[STORED_GAME.size:start], history)
+
+    def nbytes(self):
+        """
+        Returns an estimate of the memory held by the game
+        """
+        return (COMPACT_BYTES + self.positions.itemsize * len(self.positions)
+                + self.history.nbytes())
+
+    def square_symbols(self):
+        """
+        Returns the 64 square symbols, a1 first, " " if empty
+        """
+        return self.squares.translate(SYMBOL_TABLE).decode()
+
+    def to_fen(self, ply_offset=0):
+        """
+        Returns the position in Forsyth-Edwards Notation, numbering moves
+        from the start of the history plus ply_offset plies
+        """
+        return format_fen(self.square_symbols(), self.white_to_move,
+                          self.castling_rights(), self.en_passant,
+                          self.halfmove_clock, (ply_offset + len(self.history)) // 2 + 1)
+
+    def display_board(self):
+        """
+        Renders the pretty board without rebuilding a playable Board, once
+        per version like Board.display_board
+        """
+        if self._display is None or self._display[0] != self.version:
+            self._display = (self.version, format_squares(self.square_symbols()))
+        return self._display[1]
+
+    def changed_since(self, version):
+        """
+        Returns the squares changed since an earlier version, see square_delta
+        """
+        return square_delta(self.square_symbols(), self.history,
+                            self.version - version)
+
+
+#snapshot of the starting position, where histories without one start
+START_SNAPSHOT = parse_fen(START_FEN)[0].pack_snapshot()
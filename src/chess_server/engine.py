@@ -1,19 +1,189 @@
 import logging
-from copy import deepcopy
+import random
+from collections import Counter, deque
+
+from src.chess_server.compact import (PackedHistory, CompactBoard, PIECE_TYPES,
+    PIECE_CODES, SQUARES, SQUARE_INDEX, CASTLING_ORDER, PROMOTION_SYMBOLS,
+    SNAPSHOT_PLIES, PAWN_CODES, KING_CODES, CASTLING_SQUARES, format_squares,
+    square_delta, parse_fen, format_fen)
+from src.chess_server.stats import STATS, CHECK, clock
+from src.chess_server.movecache import MOVE_CACHE, ILLEGAL
 
 WHITE="white"
 BLACK="black"
 CARDINALS = ((1, 0), (0, -1), (-1, 0), (0, 1))
 DIAGONALS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+KNIGHT_MOVES = ((1, 2), (2, 1), (2, -1), (1, -2),
+                (-1, -2), (-2, -1), (-2, 1), (-1, 2))
 PIECES = ["P", "R", "C", "B", "Q", "K"]
+CASTLING_MOVES = (
+    ((5, 1), (7, 1)),
+    ((5, 1), (3, 1)),
+    ((5, 8), (7, 8)),
+    ((5, 8), (3, 8))
+)
+#castling rights in FEN notation -> (king position, rook position)
+CASTLING_RIGHTS = {
+    "K": ((5, 1), (8, 1)),
+    "Q": ((5, 1), (1, 1)),
+    "k": ((5, 8), (8, 8)),
+    "q": ((5, 8), (1, 8))
+}
+#game outcomes, recorded in the move_history entry of the last move
+CHECKMATE = "checkmate"
+STALEMATE = "stalemate"
+THREEFOLD_REPETITION = "threefold repetition"
+FIFTY_MOVE_RULE = "fifty-move rule"
+#last moves of a Board whose MoveRecords are kept to take them back in place,
+#earlier ones are taken back from the snapshots of the move history
+TAKEBACK_PLIES = 4
+#Board state replaced when a takeback rebuilds the position
+POSITION_STATE = ("board", "attack_map", "_piece_attacks", "kings",
+                  "last_moved_color", "en_passant", "halfmove_clock",
+                  "zobrist_hash", "position_counts")
 #logging.basicConfig(level=logging.DEBUG)
 
+def _on_board(x, y):
+    return 1 <= x <= 8 and 1 <= y <= 8
+
+def _build_step_table(steps):
+    """
+    Returns dict mapping each position to a tuple of the positions a single
+    step away which are still on the board
+    """
+    return {(x, y): tuple((x + dx, y + dy) for dx, dy in steps
+                          if _on_board(x + dx, y + dy))
+            for x in range(1, 9) for y in range(1, 9)}
+
+def _build_ray_table():
+    """
+    Returns dict mapping each position to a dict of direction -> tuple of the
+    positions from there to the edge of the board, nearest first
+    """
+    rays = {}
+    for x in range(1, 9):
+        for y in range(1, 9):
+            rays[(x, y)] = {}
+            for dx, dy in CARDINALS + DIAGONALS:
+                ray = []
+                ray_x, ray_y = x + dx, y + dy
+                while _on_board(ray_x, ray_y):
+                    ray.append((ray_x, ray_y))
+                    ray_x, ray_y = ray_x + dx, ray_y + dy
+                rays[(x, y)][(dx, dy)] = tuple(ray)
+    return rays
+
+#lookup tables used by the pieces instead of stepping over the board
+KNIGHT_TARGETS = _build_step_table(KNIGHT_MOVES)
+KING_TARGETS = _build_step_table(CARDINALS + DIAGONALS)
+PAWN_ATTACKS = {
+    WHITE: _build_step_table(((1, 1), (-1, 1))),
+    BLACK: _build_step_table(((1, -1), (-1, -1)))
+}
+RAYS = _build_ray_table()
+
+def _build_zobrist_keys(seed=1893):
+    """
+    Returns random 64 bit keys for Zobrist hashing: a dict of piece symbol ->
+    position -> key, the key for black to move, a dict of castling right ->
+    key and a dict of en passant column -> key. Seeded so hashes are the
+    same in every process.
+    """
+    rng = random.Random(seed)
+    piece_keys = {symbol: {(x, y): rng.getrandbits(64)
+                           for x in range(1, 9) for y in range(1, 9)}
+                  for symbol in "PRCBQKprcbqk"}
+    black_key = rng.getrandbits(64)
+    castling_keys = {right: rng.getrandbits(64) for right in CASTLING_RIGHTS}
+    en_passant_keys = {x: rng.getrandbits(64) for x in range(1, 9)}
+    return piece_keys, black_key, castling_keys, en_passant_keys
+
+(ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE,
+ ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT) = _build_zobrist_keys()
+#piece code -> square index -> key of ZOBRIST_PIECES, for positions stored as
+#square codes
+ZOBRIST_SQUARES = ((0,) * 64,) + tuple(
+    tuple(ZOBRIST_PIECES[piece_type.symbol][pos] for pos in SQUARES)
+    for piece_type in PIECE_TYPES[1:])
+
+def _squares_hash(squares, castling, white_to_move, en_passant):
+    """
+    Returns the Zobrist hash of a position stored as square codes, the same
+    as Board.compute_hash
+    """
+    zobrist_hash = 0
+    for index, code in enumerate(squares):
+        if code:
+            zobrist_hash ^= ZOBRIST_SQUARES[code][index]
+    if not white_to_move:
+        zobrist_hash ^= ZOBRIST_BLACK_TO_MOVE
+    for bit, right in enumerate(CASTLING_ORDER):
+        if castling >> bit & 1:
+            zobrist_hash ^= ZOBRIST_CASTLING[right]
+    return zobrist_hash ^ _en_passant_hash(squares, white_to_move, en_passant)
+
+def _en_passant_hash(squares, white_to_move, en_passant):
+    """
+    Returns the key of the en passant column if a pawn of the side to move
+    could take en passant, as Board._en_passant_key, 0 otherwise
+    """
+    if en_passant is None:
+        return 0
+    #pawns taking en passant stand on the row the passing pawn moved to
+    row = en_passant - 8 if white_to_move else en_passant + 8
+    pawn = PAWN_CODES[0 if white_to_move else 1]
+    column = en_passant % 8
+    if ((column > 0 and squares[row - 1] == pawn)
+            or (column < 7 and squares[row + 1] == pawn)):
+        return ZOBRIST_EN_PASSANT[column + 1]
+    return 0
+
+class MoveRecord:
+    """
+    Reversible record of a move carried out by Board._make_move
+    """
+    __slots__ = ("from_pos", "to_pos", "piece", "captured", "captured_pos",
+                 "had_moved", "rook_move", "rook_had_moved", "promoted",
+                 "en_passant", "last_moved_color", "halfmove_clock",
+                 "zobrist_hash", "positions")
+
+    def __init__(self, from_pos, to_pos, piece, captured, had_moved):
+        self.from_pos = from_pos
+        self.to_pos = to_pos
+        self.piece = piece
+        self.captured = captured
+        self.captured_pos = to_pos #differs from to_pos for en passant
+        self.had_moved = had_moved #None for pieces without has_moved
+        self.rook_move = None #(from, to) of the rook when castling
+        self.rook_had_moved = None
+        self.promoted = None #piece replacing a pawn on the last row
+        self.en_passant = None #Board.en_passant before the move
+        self.last_moved_color = None #Board.last_moved_color before the move
+        self.halfmove_clock = None #Board.halfmove_clock before the move
+        self.zobrist_hash = None #Board.zobrist_hash before the move
+        #Board.position_counts before a capture or pawn move replaced it
+        self.positions = None
+
 class Board:
     def __init__(self):
         logging.debug("Board initialising")
         self.reset_board()
         self.last_moved_color = BLACK
-        self.move_history = []
+        self.en_passant = None #square passed by a pawn moving two rows
+        self.halfmove_clock = 0 #moves since the last capture or pawn move
+        self.move_history = PackedHistory()
+        self.outcome = None
+        self.zobrist_hash = self.compute_hash()
+        #positions since the last capture or pawn move, which cannot repeat
+        #anything before it
+        self.position_counts = Counter([self.zobrist_hash])
+        #bumped by every move, keys the display_board cache and board deltas
+        self.version = 0
+        self._display = None #(version, pretty board)
+        #plies played before the history starts, from the move number of a FEN
+        self.ply_offset = 0
+        #MoveRecords of the last moves played on this Board, for takeback
+        self.takebacks = deque(maxlen=TAKEBACK_PLIES)
 
     def reset_board(self):
         """
@@ -51,111 +221,795 @@ class Board:
             self.board[(x, 2)] = Pawn(self.board, WHITE, (x, 2))
             self.board[(x, 7)] = Pawn(self.board, BLACK, (x, 7))
             self.board[(x, 8)] = piece(self.board, BLACK, (x, 8))
+        self._rebuild_attack_maps()
+
+    def _rebuild_attack_maps(self):
+        """
+        Builds the attack maps from scratch for the pieces in Board.board.
+        Board.attack_map[color] maps every square attacked by that color to
+        the set of pieces attacking it; it is then kept up to date by
+        _force_move_piece and _place_piece as pieces move.
+        """
+        self.attack_map = {WHITE: {}, BLACK: {}}
+        self._piece_attacks = {}
+        self.kings = {}
+        for piece in self.board.values():
+            if piece.symbol in ("K", "k"):
+                self.kings[piece.color] = piece
+            self._add_attacks(piece)
+
+    def _add_attacks(self, piece):
+        squares = piece.list_attacks()
+        self._piece_attacks[piece] = squares
+        color_map = self.attack_map[piece.color]
+        for square in squares:
+            if square in color_map:
+                color_map[square].add(piece)
+            else:
+                color_map[square] = {piece}
+
+    def _remove_attacks(self, piece):
+        color_map = self.attack_map[piece.color]
+        for square in self._piece_attacks.pop(piece):
+            attackers = color_map[square]
+            attackers.discard(piece)
+            if not attackers:
+                del color_map[square]
 
-    def move_piece(self, from_pos, to_pos):
+    def _update_sliding_attacks(self, pos):
+        """
+        Recomputes the attacks of the sliding pieces that reach pos, after
+        pos has been emptied or filled
+        """
+        for color_map in self.attack_map.values():
+            attackers = color_map.get(pos)
+            if attackers:
+                for piece in [p for p in attackers if p.sliding]:
+                    self._remove_attacks(piece)
+                    self._add_attacks(piece)
+
+    def move_piece(self, from_pos, to_pos, promotion=None):
         """
         Moves piece if move is valid with piece + check rules
-        Does this by copying the board, and checking if carrying out the move
-        results in a valid configuration, replacing the board with the copy
-        and adding to self.move_history if true, and reverting if not.
+        Does this by applying the move to the board in place, and checking
+        if carrying out the move results in a valid configuration, adding to
+        self.move_history if true, and undoing the move if not.
+        The result of the checks, including whether the move gives check and
+        leaves the opponent a legal move, is kept in MOVE_CACHE by position
+        hash and move, so a move already checked in the same position in any
+        game is only played.
 
         Arguments:
             from_pos: tuple in form (x, y) where x is current column of the 
                 piece and y is the current row of the piece, both int 1-8
             to_pos: tuple in form (x, y) where x is desired column of the
                 piece and y is the desired row of the piece, both int 1-8
+            promotion: symbol of the piece a pawn reaching the last row is
+                promoted to, one of "Q", "R", "B", "C" (default queen)
 
         Returns:
             True/False if piece was moved successfully
 
         """
-        if not self.board.get(from_pos):
+        if self.outcome:
+            logging.debug("Game is over (%s)", self.outcome)
+            return False
+        piece = self.board.get(from_pos)
+        if not piece:
             logging.debug("No piece in selected position")
             return False
-        if self.board[from_pos].color == self.last_moved_color:
+        if piece.color == self.last_moved_color:
             logging.debug("Attempting to move wrong color")
             return False
-        if self.board[from_pos].verify_move(to_pos):
-            logging.debug(f"Move from {from_pos} to {to_pos} in piece valid moves")
+        key = (self.zobrist_hash, from_pos, to_pos, promotion)
+        cached = MOVE_CACHE.get(key)
+        if cached is ILLEGAL:
+            logging.debug("Move from %s to %s cached as illegal", from_pos, to_pos)
+            return False
+        if cached is not None:
+            record = self._make_move(from_pos, to_pos, promotion)
+            if self.zobrist_hash != cached[0]:
+                #another position with the same hash, validate from scratch
+                self._unmake_move(record)
+                cached = None
+        if cached is None:
+            if not self._pseudo_legal(piece, from_pos, to_pos, promotion):
+                MOVE_CACHE.put(key, ILLEGAL)
+                return False
             #going to try move and revert if puts king in check
-            Board_copy = deepcopy(self)
-            if self._move_not_castling(from_pos, to_pos):
-                Board_copy._force_move_piece(from_pos, to_pos)
+            record = self._make_move(from_pos, to_pos, promotion)
+        timed = STATS.enabled
+        if timed:
+            began = clock()
+        if cached is None:
+            if self.king_in_check(piece.color):
+                logging.debug("Move places own king in check")
+                self._unmake_move(record)
+                MOVE_CACHE.put(key, ILLEGAL)
+                return False
+            logging.debug("Move does not place own king in check")
+            check_enemy = self.king_in_check(record.last_moved_color)
+            has_reply = self.has_legal_move(record.last_moved_color)
+            MOVE_CACHE.put(key, (self.zobrist_hash, check_enemy, has_reply))
+        else:
+            _, check_enemy, has_reply = cached
+        if self.halfmove_clock == 0:
+            record.positions = self.position_counts
+            self.position_counts = Counter()
+        self.position_counts[self.zobrist_hash] += 1
+        if not has_reply:
+            self.outcome = CHECKMATE if check_enemy else STALEMATE
+        else:
+            self.outcome = self.draw_outcome()
+        if timed:
+            STATS.observe(CHECK, clock() - began)
+        self.add_to_history(record, check_enemy, self.outcome)
+        self.takebacks.append(record)
+        self.version += 1
+        return True
+
+    def takeback(self):
+        """
+        Takes back the last move, undoing its MoveRecord if it is one of the
+        last TAKEBACK_PLIES moves played on this Board, or else rebuilding the
+        position from the snapshot before it. The version jumps by more than
+        the moves played, so deltas from earlier versions give the full board.
+
+        Returns:
+            True/False if a move was taken back
+        """
+        history = self.move_history
+        plies = len(history)
+        if not plies:
+            return False
+        if self.takebacks:
+            record = self.takebacks.pop()
+            if record.positions is not None:
+                self.position_counts = record.positions
+            elif self.position_counts[self.zobrist_hash] > 1:
+                self.position_counts[self.zobrist_hash] -= 1
             else:
-                Board_copy._force_castling(from_pos, to_pos)
-            Board_copy.last_moved_color = Board_copy.board[to_pos].color
-            if not Board_copy.king_in_check(Board_copy.last_moved_color):
-                logging.debug(f"Move does not place own king in check")
-                check_enemy = Board_copy.king_in_check(self.last_moved_color)
-                self.add_to_history(from_pos, to_pos, check_enemy)
-                self.board = Board_copy.board
-                self.last_moved_color = Board_copy.last_moved_color
+                del self.position_counts[self.zobrist_hash]
+            self._unmake_move(record)
+            history.pop()
+        else:
+            history.pop()
+            board = self._replay(history, plies - 1)
+            for name in POSITION_STATE:
+                setattr(self, name, getattr(board, name))
+        self.outcome = None
+        self.version += plies + 1
+        return True
+
+    def position_at(self, ply):
+        """
+        Returns a new Board of the game after its first ply moves, rebuilt
+        from the snapshot of the move history before it
+
+        Raises:
+            IndexError if the history has fewer moves
+        """
+        if not 0 <= ply <= len(self.move_history):
+            raise IndexError("ply out of range of the move history")
+        board = self._replay(self.move_history.copy(ply), ply)
+        board.version = ply
+        return board
+
+    def _replay(self, history, ply):
+        """
+        Builds a Board after the first ply moves of history from the last
+        snapshot before them, or before the positions that still count for
+        repetitions. The moves since are carried out on the 64 square codes
+        with the Zobrist hash kept up to date, and the Board is only built
+        once, at the end.
+        """
+        start, snapshot = history.snapshot_before(ply)
+        compact = CompactBoard.from_snapshot(snapshot, history)
+        if compact.halfmove_clock and start:
+            start, snapshot = history.snapshot_before(max(start - compact.halfmove_clock, 0))
+            compact = CompactBoard.from_snapshot(snapshot, history)
+        squares = bytearray(compact.squares)
+        castling = compact.castling
+        white_to_move = compact.white_to_move
+        en_passant = compact.en_passant
+        halfmove_clock = compact.halfmove_clock
+        zobrist_hash = _squares_hash(squares, castling, white_to_move, en_passant)
+        positions = [zobrist_hash]
+        for code, pieces in zip(history.moves[start:ply], history.pieces[start:ply]):
+            from_index = code & 63
+            to_index = code >> 6 & 63
+            kind = placed = pieces & 15
+            promotion = code >> 12 & 7
+            zobrist_hash ^= (ZOBRIST_SQUARES[kind][from_index] ^ ZOBRIST_BLACK_TO_MOVE
+                             ^ _en_passant_hash(squares, white_to_move, en_passant))
+            squares[from_index] = 0
+            if pieces >> 4:
+                #a pawn taken en passant is beside the empty square moved to
+                captured_index = (to_index if squares[to_index] else
+                                  from_index - from_index % 8 + to_index % 8)
+                zobrist_hash ^= ZOBRIST_SQUARES[squares[captured_index]][captured_index]
+                squares[captured_index] = 0
+            if promotion:
+                symbol = PROMOTION_SYMBOLS[promotion - 1]
+                placed = PIECE_CODES[symbol if PIECE_TYPES[kind].white else symbol.lower()]
+            squares[to_index] = placed
+            zobrist_hash ^= ZOBRIST_SQUARES[placed][to_index]
+            if kind in KING_CODES and abs(to_index - from_index) == 2:
+                rook_from, rook_to = ((to_index + 1, to_index - 1) if to_index > from_index
+                                      else (to_index - 2, to_index + 1))
+                rook = squares[rook_from]
+                squares[rook_from] = 0
+                squares[rook_to] = rook
+                zobrist_hash ^= ZOBRIST_SQUARES[rook][rook_from] ^ ZOBRIST_SQUARES[rook][rook_to]
+            if castling:
+                for bit, right in enumerate(CASTLING_ORDER):
+                    unmoved = CASTLING_SQUARES[right]
+                    if castling >> bit & 1 and (from_index in unmoved or to_index in unmoved):
+                        castling &= ~(1 << bit)
+                        zobrist_hash ^= ZOBRIST_CASTLING[right]
+            en_passant = None
+            halfmove_clock += 1
+            if kind in PAWN_CODES or pieces >> 4:
+                halfmove_clock = 0
+                positions = []
+                if kind in PAWN_CODES and abs(to_index - from_index) == 16:
+                    en_passant = (from_index + to_index) // 2
+            white_to_move = not white_to_move
+            zobrist_hash ^= _en_passant_hash(squares, white_to_move, en_passant)
+            positions.append(zobrist_hash)
+        board = Board.from_compact(CompactBoard(
+            squares, castling, white_to_move, en_passant, halfmove_clock,
+            history.outcome if ply == len(history) else None, positions, history))
+        board.ply_offset = self.ply_offset
+        return board
+
+    def _pseudo_legal(self, piece, from_pos, to_pos, promotion):
+        """
+        Returns True if a move follows the rules of the piece, does not
+        castle out of or through check and promotes to a valid piece, not
+        taking check of the own king after the move into account
+        """
+        if not (piece.verify_move(to_pos) or self._en_passant_move(piece, to_pos)):
+            logging.debug("Move from %s to %s not in piece valid moves", from_pos, to_pos)
+            return False
+        if (not self._move_not_castling(from_pos, to_pos) and
+            self._castling_through_check(from_pos, to_pos)):
+            logging.debug("Castling out of or through check")
+            return False
+        if promotion and promotion.upper() not in PROMOTIONS:
+            logging.debug("Cannot promote to %s", promotion)
+            return False
+        logging.debug("Move from %s to %s in piece valid moves", from_pos, to_pos)
+        return True
+
+    def has_legal_move(self, color):
+        """
+        Returns True as soon as one legal move is found for a color, trying
+        the cheapest candidates first: king moves, then (when in check)
+        captures of a single checking piece and blocks of its line, and
+        otherwise the moves of the remaining pieces. In double check only
+        king moves are possible. Moves of pieces that no enemy sliding piece
+        attacks cannot be pinned, so they are accepted without being played.
+        """
+        king = self.kings.get(color)
+        if not king or self.board.get(king.pos) is not king:
+            return any(True for _ in self.legal_moves(color))
+        for to_pos in king.step_targets(KING_TARGETS[king.pos]):
+            if self._legal_after_move(king.pos, to_pos, color):
                 return True
-            logging.debug(f"Move places own king in check")
+        enemy = BLACK if color == WHITE else WHITE
+        checkers = self.attackers_of(king.pos, enemy)
+        if len(checkers) > 1:
             return False
+        if checkers:
+            checker = checkers.pop()
+            for piece in self.attackers_of(checker.pos, color):
+                if piece is not king and self._unpinned_move_legal(
+                        piece.pos, checker.pos, color, enemy):
+                    return True
+            for to_pos in self._check_line(king.pos, checker):
+                for from_pos in self._pieces_reaching(to_pos, color):
+                    if self._unpinned_move_legal(from_pos, to_pos, color, enemy):
+                        return True
+            pawn_pos = (self.en_passant[0], checker.pos[1]) if self.en_passant else None
+            return checker.pos == pawn_pos and any(
+                self._legal_after_move(pos, self.en_passant, color)
+                for pos in self._pieces_reaching(self.en_passant, color))
+        for piece in [p for p in self.board.values() if p.color == color]:
+            if piece is king:
+                continue
+            from_pos = piece.pos
+            to_positions = piece.list_moves()
+            if to_positions and not self._maybe_pinned(piece, enemy):
+                return True
+            if self._en_passant_move(piece, self.en_passant):
+                to_positions.add(self.en_passant)
+            for to_pos in to_positions:
+                if self._legal_after_move(from_pos, to_pos, color):
+                    return True
+        return False
+
+    def _maybe_pinned(self, piece, enemy):
+        """
+        Returns True if an enemy sliding piece attacks the piece, which is
+        the only way moving it could uncover a check on its own king
+        """
+        return any(attacker.sliding
+                   for attacker in self.attack_map[enemy].get(piece.pos, ()))
+
+    def _unpinned_move_legal(self, from_pos, to_pos, color, enemy):
+        """
+        Returns True if a move that takes or blocks the only checking piece
+        is legal, only playing it when the piece might be pinned or the move
+        takes en passant (which also empties the taken pawn's position)
+        """
+        piece = self.board[from_pos]
+        if not self._maybe_pinned(piece, enemy) and not self._en_passant_move(piece, to_pos):
+            return True
+        return self._legal_after_move(from_pos, to_pos, color)
+
+    def _legal_after_move(self, from_pos, to_pos, color):
+        """
+        Returns True if a pseudo legal move does not leave the own king in
+        check (castling is not covered)
+        """
+        record = self._make_move(from_pos, to_pos)
+        legal = not self.king_in_check(color)
+        self._unmake_move(record)
+        return legal
+
+    @staticmethod
+    def _check_line(king_pos, checker):
+        """
+        Returns tuple of the empty positions between a king and a sliding
+        piece checking it, where the check can be blocked
+        """
+        if not checker.sliding:
+            return ()
+        dx = checker.pos[0] - king_pos[0]
+        dy = checker.pos[1] - king_pos[1]
+        direction = ((dx > 0) - (dx < 0), (dy > 0) - (dy < 0))
+        ray = RAYS[king_pos][direction]
+        return ray[:ray.index(checker.pos)]
+
+    def _pieces_reaching(self, pos, color):
+        """
+        Returns list of positions of pieces of a color that could move to
+        pos, not taking check into account. Pawns are found by their pushes
+        when pos is empty (or en passant capture), other pieces by the
+        attack map.
+        """
+        from_positions = [piece.pos for piece in self.attackers_of(pos, color)
+                          if piece.symbol not in ("P", "p", "K", "k")]
+        pawn = "P" if color == WHITE else "p"
+        step = -1 if color == WHITE else 1
+        behind = self.board.get((pos[0], pos[1] + step))
+        if behind and behind.symbol == pawn:
+            from_positions.append(behind.pos)
+        elif not behind and pos[1] == (4 if color == WHITE else 5):
+            start = self.board.get((pos[0], pos[1] + 2*step))
+            if start and start.symbol == pawn:
+                from_positions.append(start.pos)
+        if pos == self.en_passant:
+            for pawn_pos in PAWN_ATTACKS[BLACK if color == WHITE else WHITE][pos]:
+                occupant = self.board.get(pawn_pos)
+                if occupant and occupant.symbol == pawn:
+                    from_positions.append(pawn_pos)
+        return from_positions
+
+    def compact(self):
+        """
+        Returns the game as a CompactBoard, a few hundred bytes instead of the
+        pieces and attack maps of a playable Board. The move history is
+        shared, not copied.
+        """
+        squares = bytearray(64)
+        for pos, piece in self.board.items():
+            squares[SQUARE_INDEX[pos]] = PIECE_CODES[piece.symbol]
+        rights = self.castling_rights()
+        castling = sum(1 << bit for bit, right in enumerate(CASTLING_ORDER)
+                       if right in rights)
+        compact = CompactBoard(
+            squares, castling, self.last_moved_color == BLACK,
+            SQUARE_INDEX[self.en_passant] if self.en_passant else None,
+            self.halfmove_clock, self.outcome,
+            self.position_counts.elements(), self.move_history, self.version)
+        compact._display = self._display
+        return compact
+
+    @classmethod
+    def from_compact(cls, compact):
+        """
+        Builds a playable Board from a CompactBoard
+        """
+        board = cls.__new__(cls)
+        board.board = {}
+        for index, code in enumerate(compact.squares):
+            if code:
+                piece_type = PIECE_TYPES[code]
+                color = WHITE if piece_type.white else BLACK
+                piece = PIECE_CLASSES[piece_type.kind](board.board, color, SQUARES[index])
+                if hasattr(piece, "has_moved"):
+                    #castling rights tell which kings and rooks are unmoved
+                    piece.has_moved = True
+                board.board[SQUARES[index]] = piece
+        for bit, right in enumerate(CASTLING_ORDER):
+            if compact.castling >> bit & 1:
+                for pos in CASTLING_RIGHTS[right]:
+                    board.board[pos].has_moved = False
+        board._rebuild_attack_maps()
+        board.last_moved_color = BLACK if compact.white_to_move else WHITE
+        board.en_passant = (SQUARES[compact.en_passant]
+                            if compact.en_passant is not None else None)
+        board.halfmove_clock = compact.halfmove_clock
+        board.move_history = compact.history
+        board.outcome = compact.outcome
+        board.zobrist_hash = board.compute_hash()
+        board.position_counts = Counter(compact.positions)
+        board.version = compact.version
+        board._display = compact._display
+        board.ply_offset = 0
+        board.takebacks = deque(maxlen=TAKEBACK_PLIES)
+        return board
+
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        Builds a playable Board from a position in Forsyth-Edwards Notation,
+        without playing any moves. Kings and rooks without a castling right
+        count as moved. A position without legal moves or past the fifty-move
+        rule is over.
+
+        Raises:
+            ValueError if the FEN is malformed or the position impossible
+        """
+        compact, ply_offset = parse_fen(fen)
+        board = cls.from_compact(compact)
+        board.position_counts = Counter([board.zobrist_hash])
+        board.ply_offset = ply_offset
+        board.move_history.add_snapshot(compact.pack_snapshot())
+        color = WHITE if board.last_moved_color == BLACK else BLACK
+        if not board.has_legal_move(color):
+            board.outcome = CHECKMATE if board.king_in_check(color) else STALEMATE
+        elif board.halfmove_clock >= 100:
+            board.outcome = FIFTY_MOVE_RULE
+        return board
+
+    def to_fen(self):
+        """
+        Returns the position in Forsyth-Edwards Notation
+        """
+        return format_fen(
+            self.square_symbols(), self.last_moved_color == BLACK,
+            self.castling_rights(),
+            SQUARE_INDEX[self.en_passant] if self.en_passant else None,
+            self.halfmove_clock, (self.ply_offset + len(self.move_history)) // 2 + 1)
+
+    def draw_outcome(self):
+        """
+        Returns THREEFOLD_REPETITION if the current position has occurred
+        three times, FIFTY_MOVE_RULE if there have been fifty moves by each
+        player without a capture or pawn move, and None otherwise
+        """
+        if self.position_counts[self.zobrist_hash] >= 3:
+            return THREEFOLD_REPETITION
+        if self.halfmove_clock >= 100:
+            return FIFTY_MOVE_RULE
+        return None
+
+    def compute_hash(self):
+        """
+        Computes the Zobrist hash of the position from scratch: the XOR of
+        the keys of every piece on its position, the side to move, the
+        castling rights and the column of a capturable en passant square.
+        Board.zobrist_hash holds the same value, updated move by move.
+        """
+        zobrist_hash = 0
+        for pos, piece in self.board.items():
+            zobrist_hash ^= ZOBRIST_PIECES[piece.symbol][pos]
+        if self.last_moved_color == WHITE:
+            zobrist_hash ^= ZOBRIST_BLACK_TO_MOVE
+        for right in self.castling_rights():
+            zobrist_hash ^= ZOBRIST_CASTLING[right]
+        return zobrist_hash ^ self._en_passant_key()
+
+    def castling_rights(self):
+        """
+        Returns castling rights in FEN notation (eg. "KQkq"), a right being
+        kept while neither the king nor that rook has moved
+        """
+        rights = ""
+        for right, (king_pos, rook_pos) in CASTLING_RIGHTS.items():
+            king = self.board.get(king_pos)
+            rook = self.board.get(rook_pos)
+            if (king and rook and king.symbol == ("K" if right.isupper() else "k")
+                and rook.symbol == ("R" if right.isupper() else "r")
+                and not king.has_moved and not rook.has_moved):
+                rights += right
+        return rights
+
+    def _en_passant_key(self):
+        """
+        Returns the Zobrist key of the en passant column if a pawn of the
+        side to move could take en passant, 0 otherwise
+        """
+        if not self.en_passant:
+            return 0
+        enemy_pawn = "p" if self.last_moved_color == WHITE else "P"
+        for pos in PAWN_ATTACKS[self.last_moved_color][self.en_passant]:
+            occupant = self.board.get(pos)
+            if occupant and occupant.symbol == enemy_pawn:
+                return ZOBRIST_EN_PASSANT[self.en_passant[0]]
+        return 0
+
+    def legal_moves(self, color):
+        """
+        Generates every legal move of a color, taking check into account.
+        The board must not be changed before the generator is exhausted.
+
+        Returns:
+            generator of (from_pos, to_pos, promotion) tuples, where promotion
+            is None, or one of "Q", "R", "B", "C" for pawns reaching the
+            last row (one tuple each)
+        """
+        for piece in [p for p in self.board.values() if p.color == color]:
+            from_pos = piece.pos
+            to_positions = piece.list_moves()
+            if self._en_passant_move(piece, self.en_passant):
+                to_positions.add(self.en_passant)
+            for to_pos in to_positions:
+                if (not self._move_not_castling(from_pos, to_pos) and
+                    self._castling_through_check(from_pos, to_pos)):
+                    continue
+                record = self._make_move(from_pos, to_pos)
+                legal = not self.king_in_check(color)
+                self._unmake_move(record)
+                if not legal:
+                    continue
+                if record.promoted:
+                    for symbol in PROMOTIONS:
+                        yield (from_pos, to_pos, symbol)
+                else:
+                    yield (from_pos, to_pos, None)
+
+    def perft(self, depth):
+        """
+        Counts the positions reached by every sequence of legal moves of a
+        given length from the current position, with the side to move
+        starting. Used to verify and benchmark move generation.
+
+        Returns:
+            int number of positions at the given depth
+        """
+        if depth == 0:
+            return 1
+        color = WHITE if self.last_moved_color == BLACK else BLACK
+        moves = list(self.legal_moves(color))
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            record = self._make_move(*move)
+            nodes += self.perft(depth - 1)
+            self._unmake_move(record)
+        return nodes
+
+    def _make_move(self, from_pos, to_pos, promotion=None):
+        """
+        Carries out a move (including the rook move when castling, the
+        capture when taking en passant and the promotion of a pawn on the
+        last row) in place, regardless of the moves validity
+
+        Returns:
+            MoveRecord holding what _unmake_move needs to revert the move
+        """
+        piece = self.board[from_pos]
+        record = MoveRecord(from_pos, to_pos, piece, self.board.get(to_pos),
+                            getattr(piece, "has_moved", None))
+        record.en_passant = self.en_passant
+        record.last_moved_color = self.last_moved_color
+        record.halfmove_clock = self.halfmove_clock
+        record.zobrist_hash = self.zobrist_hash
+        #castling rights can only change when an unmoved king or rook moves
+        #or is taken
+        rights_may_change = (record.had_moved is False or
+            getattr(record.captured, "has_moved", None) is False)
+        if rights_may_change:
+            for right in self.castling_rights():
+                self.zobrist_hash ^= ZOBRIST_CASTLING[right]
+        self.zobrist_hash ^= self._en_passant_key()
+        if self._en_passant_move(piece, to_pos):
+            record.captured_pos = (to_pos[0], from_pos[1])
+            record.captured = self._remove_piece(record.captured_pos)
+            self._force_move_piece(from_pos, to_pos)
+        elif self._move_not_castling(from_pos, to_pos):
+            self._force_move_piece(from_pos, to_pos)
+        else:
+            record.rook_move = self._castling_rook_move(to_pos)
+            record.rook_had_moved = self.board[record.rook_move[0]].has_moved
+            self._force_castling(from_pos, to_pos)
+        self.en_passant = None
+        self.halfmove_clock += 1
+        if piece.symbol in ("P", "p"):
+            self.halfmove_clock = 0
+            if to_pos[1] in (1, 8):
+                record.promoted = self._promote(to_pos, promotion)
+            elif abs(to_pos[1] - from_pos[1]) == 2:
+                self.en_passant = (from_pos[0], (from_pos[1] + to_pos[1]) // 2)
+        if record.captured:
+            self.halfmove_clock = 0
+        self.last_moved_color = piece.color
+        if rights_may_change:
+            for right in self.castling_rights():
+                self.zobrist_hash ^= ZOBRIST_CASTLING[right]
+        self.zobrist_hash ^= ZOBRIST_BLACK_TO_MOVE ^ self._en_passant_key()
+        return record
+
+    def _unmake_move(self, record):
+        """
+        Reverts a move carried out by _make_move, restoring captured pieces,
+        promoted pawns, has_moved flags and the side to move
+        """
+        if record.promoted:
+            self._remove_piece(record.to_pos)
+            self._place_piece(record.piece, record.to_pos)
+        if record.rook_move:
+            rook_from_pos, rook_to_pos = record.rook_move
+            self._force_move_piece(rook_to_pos, rook_from_pos)
+            self.board[rook_from_pos].has_moved = record.rook_had_moved
+        self._force_move_piece(record.to_pos, record.from_pos)
+        if record.had_moved is not None:
+            record.piece.has_moved = record.had_moved
+        if record.captured:
+            self._place_piece(record.captured, record.captured_pos)
+        self.en_passant = record.en_passant
+        self.last_moved_color = record.last_moved_color
+        self.halfmove_clock = record.halfmove_clock
+        self.zobrist_hash = record.zobrist_hash
+
+    def _en_passant_move(self, piece, to_pos):
+        """
+        Returns True if moving piece to to_pos takes a pawn en passant
+        """
+        return (to_pos is not None and to_pos == self.en_passant and
+                piece.symbol in ("P", "p") and
+                to_pos in PAWN_ATTACKS[piece.color][piece.pos])
+
+    def _promote(self, pos, promotion):
+        """
+        Replaces the pawn on pos with a new piece of the same color
+
+        Arguments:
+            promotion: symbol of the new piece (default queen)
+
+        Returns:
+            new piece
+        """
+        pawn = self._remove_piece(pos)
+        piece = PROMOTIONS[(promotion or "Q").upper()](self.board, pawn.color, pos)
+        if hasattr(piece, "has_moved"):
+            piece.has_moved = True #promoted rooks cannot castle
+        self._place_piece(piece, pos)
+        return piece
 
     def _force_move_piece(self, from_pos, to_pos):
         """
-        Moves a piece regardless of the moves validity
+        Moves a piece regardless of the moves validity, updating the attack
+        maps of the moved piece, any captured piece, and the sliding pieces
+        whose lines pass through from_pos or to_pos
+        """
+        piece = self.board.pop(from_pos)
+        captured = self.board.get(to_pos)
+        piece_keys = ZOBRIST_PIECES[piece.symbol]
+        self.zobrist_hash ^= piece_keys[from_pos] ^ piece_keys[to_pos]
+        if captured:
+            self.zobrist_hash ^= ZOBRIST_PIECES[captured.symbol][to_pos]
+            self._remove_attacks(captured)
+        self.board[to_pos] = piece
+        piece.pos = to_pos
+        if piece.symbol in ('K', 'k', 'R', 'r'):
+            piece.has_moved = True
+        self._remove_attacks(piece)
+        self._add_attacks(piece)
+        self._update_sliding_attacks(from_pos)
+        if not captured:
+            self._update_sliding_attacks(to_pos)
+
+    def _place_piece(self, piece, pos):
+        """
+        Puts a piece on an empty position, updating the attack maps
+        """
+        piece.pos = pos
+        self.board[pos] = piece
+        self.zobrist_hash ^= ZOBRIST_PIECES[piece.symbol][pos]
+        if piece.symbol in ("K", "k"):
+            self.kings[piece.color] = piece
+        self._update_sliding_attacks(pos)
+        self._add_attacks(piece)
+
+    def _remove_piece(self, pos):
+        """
+        Takes the piece on pos off the board, updating the attack maps
+
+        Returns:
+            removed piece
         """
-        self.board[to_pos] = self.board[from_pos]
-        self.board[from_pos].pos = to_pos
-        if self.board[to_pos].symbol in ('K', 'k', 'R', 'r'):
-            self.board[to_pos].has_moved = True
-        del self.board[from_pos]
+        piece = self.board.pop(pos)
+        self.zobrist_hash ^= ZOBRIST_PIECES[piece.symbol][pos]
+        self._remove_attacks(piece)
+        self._update_sliding_attacks(pos)
+        return piece
 
     def _move_not_castling(self, from_pos, to_pos):
         """
         Returns true if move not castling
         """
-        castling_moves = [
-            ((5, 1), (7, 1)),
-            ((5, 1), (3, 1)),
-            ((5, 8), (7, 8)),
-            ((5, 8), (3, 8))
-        ]
         if self.board[from_pos].symbol in ('K', 'k'):
-            if (from_pos, to_pos) in castling_moves:
+            if (from_pos, to_pos) in CASTLING_MOVES:
                 return False
         return True
 
-    def _force_castling(self, from_pos, to_pos):
+    @staticmethod
+    def _castling_rook_move(to_pos):
         """
-        Completes castling regardless of move validity
+        Returns (from, to) positions of the rook for a castling king move
         """
         from_rook_pos = (8 if to_pos[0] == 7 else 1, to_pos[1])
         to_rook_pos = (6 if to_pos[0] == 7 else 4, to_pos[1])
+        return from_rook_pos, to_rook_pos
+
+    def _force_castling(self, from_pos, to_pos):
+        """
+        Completes castling regardless of move validity
+        """
+        from_rook_pos, to_rook_pos = self._castling_rook_move(to_pos)
         self._force_move_piece(from_pos, to_pos) #moves king
         self._force_move_piece(from_rook_pos, to_rook_pos)
 
-    def add_to_history(self, from_pos, to_pos, check_enemy_king):
+    def _castling_through_check(self, from_pos, to_pos):
+        """
+        Returns True if the king would castle out of check or across an
+        attacked square (the target square is covered by the usual check test)
+        """
+        color = self.board[from_pos].color
+        passed_pos = ((from_pos[0] + to_pos[0]) // 2, from_pos[1])
+        return (self._position_in_check(from_pos, color) or
+                self._position_in_check(passed_pos, color))
+
+    def add_to_history(self, record, check_enemy_king, outcome=None):
         """
-        Adds to move_history, appends:
+        Adds a MoveRecord to move_history, appends:
             move number (from 1)
             original position tuple,
             select piece symbol,
             target position tuple,
             target position occupant (if any),
-            Bool whether enemy king is put in check
+            Bool whether enemy king is put in check,
+            symbol of the piece a pawn is promoted to (if any),
+            outcome if the move ends the game (if any)
+        and a snapshot of the position every SNAPSHOT_PLIES moves
         """
         self.move_history.append([
             len(self.move_history) + 1,
-            from_pos,
-            self.board[from_pos].symbol,
-            to_pos,
-            self.board[to_pos].symbol if self.board.get(to_pos) else None,
-            check_enemy_king
+            record.from_pos,
+            record.piece.symbol,
+            record.to_pos,
+            record.captured.symbol if record.captured else None,
+            check_enemy_king,
+            record.promoted.symbol if record.promoted else None,
+            outcome
         ])
+        if len(self.move_history) % SNAPSHOT_PLIES == 0:
+            self.move_history.add_snapshot(self.compact().pack_snapshot())
 
     def king_in_check(self, color):
         """
         Returns True if a king of a certain color is in check
         """
-        if color == WHITE:
-            king_pos = self.find_piece("K")
-        if color == BLACK:
-            king_pos = self.find_piece("k")
-        return self._position_in_check(king_pos, color)
+        king = self.kings.get(color)
+        if not king or self.board.get(king.pos) is not king:
+            return False
+        return self._position_in_check(king.pos, color)
 
     def find_piece(self, symbol):
         """
@@ -169,60 +1023,51 @@ class Board:
         """
         Return True if a position would be in check for a king of a certain color
         """
-        for piece in self.board.values():
-            if color == WHITE:
-                if piece.color == BLACK:
-                    if piece.verify_move(pos):
-                        return True
-            if color == BLACK:
-                if piece.color == WHITE:
-                    if piece.verify_move(pos):
-                        return True
-        return False
+        enemy = BLACK if color == WHITE else WHITE
+        return pos in self.attack_map[enemy]
+
+    def attackers_of(self, pos, color):
+        """
+        Returns set of pieces of a certain color attacking a position
+        """
+        return set(self.attack_map[color].get(pos, ()))
 
     def display_board(self):
         """
-        Creates a pretty board for display_board server command
+        Creates a pretty board for display_board server command, rendered
+        once per version
 
         Returns:
             string of pretty board (19 lines)
         """
-        board_symbol_list = self._create_board_symbol_list()
-        col_str = "    a   b   c   d   e   f   g   h\n"
-        row_divider = "  --------------------------------\n"
-        row_template = "{} | {} | {} | {} | {} | {} | {} | {} | {}\n"
-        pretty_board = col_str + row_divider
-        for row in board_symbol_list:
-            pretty_board += row_template.format(*row)
-            pretty_board += row_divider
-        pretty_board += col_str
-        logging.debug("\n" + pretty_board)
-        return pretty_board
-        
+        if self._display is None or self._display[0] != self.version:
+            pretty_board = format_squares(self.square_symbols())
+            logging.debug("\n" + pretty_board)
+            self._display = (self.version, pretty_board)
+        return self._display[1]
 
-    def _create_board_symbol_list(self):
+    def square_symbols(self):
         """
-        Creates list of lists, with each item being a space, to represent
-        no piece, or the piece's symbol.
-
-        Returns:
-            list (8x9), inside 8 lists consisting of rows, descending
-              inside each sublist there is the row num and 8 symbols, ascending
-              eg. rows[0][1] = occupant of a8, if any
+        Returns a string of the 64 square symbols, a1 first, " " if empty
+        """
+        squares = [" "]*64
+        for pos, piece in self.board.items():
+            squares[SQUARE_INDEX[pos]] = piece.symbol
+        return "".join(squares)
 
+    def changed_since(self, version):
         """
-        rows = []
-        for y in range(8,0,-1):
-            row = [y]
-            for x in range(1,9):
-                if self.board.get((x, y)):
-                    row.append(self.board[(x,y)].symbol)
-                else:
-                    row.append(" ")
-            rows.append(row)
-        return rows
+        Returns the squares changed since an earlier Board.version, as a dict
+        of square index -> symbol (" " if empty), or None if the version is
+        not in the move history
+        """
+        return square_delta(self.square_symbols(), self.move_history,
+                            self.version - version)
 
 class Piece:
+    __slots__ = ("board", "color", "pos", "symbol")
+    sliding = False #True if attacks can be blocked by pieces in between
+
     def __init__(self, board, color, pos):
         self.board = board
         self.color = color
@@ -271,14 +1116,39 @@ class Piece:
                 and either empty or containing the first enemy piece
         """
         valid_moves = set()
-        pos = (self.pos[0] + direction[0], self.pos[1] + direction[1])
-        while self.empty_square(pos):
-            valid_moves.add(pos)
-            pos = (pos[0] + direction[0], pos[1] + direction[1])
-        if self.verify_square(pos):
+        for pos in RAYS[self.pos][direction]:
+            occupant = self.board.get(pos)
+            if occupant:
+                if occupant.color != self.color:
+                    valid_moves.add(pos)
+                break
             valid_moves.add(pos)
         return valid_moves
 
+    def scan_attacks(self, direction):
+        """
+        Finds attacked squares in a direction, which unlike scan_direction
+        includes the first piece of either color
+
+        Returns:
+            set of pos tuples (x, y) in a direction up to the first piece
+        """
+        attacks = set()
+        for pos in RAYS[self.pos][direction]:
+            attacks.add(pos)
+            if pos in self.board:
+                break
+        return attacks
+
+    def step_targets(self, targets):
+        """
+        Returns set of the positions from a lookup table entry (eg.
+        KNIGHT_TARGETS[pos]) that are empty or contain an enemy piece
+        """
+        board = self.board
+        return {pos for pos in targets
+                if pos not in board or board[pos].color != self.color}
+
     @staticmethod
     def _in_bounds(pos):
         """
@@ -289,6 +1159,7 @@ class Piece:
         return True
 
 class Pawn(Piece):
+    __slots__ = ()
     def __init__(self, board, color, pos):
         super().__init__(board, color, pos)
         if color == WHITE:
@@ -314,16 +1185,20 @@ class Pawn(Piece):
                 if not self.board.get(move_pos):
                     valid_moves.add(move_pos)
 
-        take_pos_tuple = ((self.pos[0] + 1, self.pos[1] + color_direction),
-                          (self.pos[0] - 1, self.pos[1] + color_direction))
-        for take_pos in take_pos_tuple:
+        for take_pos in PAWN_ATTACKS[self.color][self.pos]:
             if self.board.get(take_pos):
                 if self.board[take_pos].color != self.color:
                     valid_moves.add(take_pos)
 
         return valid_moves
 
+    def list_attacks(self):
+        return set(PAWN_ATTACKS[self.color][self.pos])
+
 class Rook(Piece):
+    __slots__ = ("has_moved",)
+    sliding = True
+
     def __init__(self, board, color, pos):
         super().__init__(board, color, pos)
         self.has_moved = False
@@ -338,7 +1213,14 @@ class Rook(Piece):
             valid_moves.update(self.scan_direction(direction))
         return valid_moves
 
+    def list_attacks(self):
+        attacks = set()
+        for direction in CARDINALS:
+            attacks.update(self.scan_attacks(direction))
+        return attacks
+
 class Knight(Piece):
+    __slots__ = ()
     def __init__(self, board, color, pos):
         super().__init__(board, color, pos)
         if color == WHITE:
@@ -347,18 +1229,15 @@ class Knight(Piece):
             self.symbol = "c"
 
     def list_moves(self):
-        valid_moves = set()
-        knight_moves = [
-                (1, 2), (2, 1), (2, -1), (1, -2),
-                (-1, -2), (-2, -1), (-2, 1), (-1, 2)
-                ]
-        for move in knight_moves:
-            target_pos = (self.pos[0] + move[0], self.pos[1] + move[1])
-            if self.verify_square(target_pos):
-                valid_moves.add(target_pos)
-        return valid_moves
+        return self.step_targets(KNIGHT_TARGETS[self.pos])
+
+    def list_attacks(self):
+        return set(KNIGHT_TARGETS[self.pos])
 
 class Bishop(Piece):
+    __slots__ = ()
+    sliding = True
+
     def __init__(self, board, color, pos):
         super().__init__(board, color, pos)
         if color == WHITE:
@@ -372,7 +1251,16 @@ class Bishop(Piece):
             valid_moves.update(self.scan_direction(direction))
         return valid_moves
 
+    def list_attacks(self):
+        attacks = set()
+        for direction in DIAGONALS:
+            attacks.update(self.scan_attacks(direction))
+        return attacks
+
 class Queen(Piece):
+    __slots__ = ()
+    sliding = True
+
     def __init__(self, board, color, pos):
         super().__init__(board, color, pos)
         if color == WHITE:
@@ -386,7 +1274,14 @@ class Queen(Piece):
             valid_moves.update(self.scan_direction(direction))
         return valid_moves
 
+    def list_attacks(self):
+        attacks = set()
+        for direction in (CARDINALS + DIAGONALS):
+            attacks.update(self.scan_attacks(direction))
+        return attacks
+
 class King(Piece):
+    __slots__ = ("has_moved",)
     def __init__(self, board, color, pos):
         super().__init__(board, color, pos)
         self.has_moved = False
@@ -396,14 +1291,13 @@ class King(Piece):
             self.symbol = "k"
 
     def list_moves(self):
-        valid_moves = set()
+        valid_moves = self.step_targets(KING_TARGETS[self.pos])
         valid_moves.update(self.list_castling_moves())
-        for direction in (CARDINALS + DIAGONALS):
-            new_pos = (self.pos[0] + direction[0], self.pos[1] + direction[1])
-            if self.verify_square(new_pos):
-                valid_moves.add(new_pos)
         return valid_moves
 
+    def list_attacks(self):
+        return set(KING_TARGETS[self.pos])
+
     def list_castling_moves(self):
         castling_moves = set()
         if not self.has_moved:
@@ -413,7 +1307,7 @@ class King(Piece):
                 not self.board.get((4, self.pos[1])) and
                 self.board.get(corner_pos)):
                 if self.board[corner_pos].symbol in ("R", "r"):
-                    if not self.board.get(self.pos[0], 1).has_moved:
+                    if not self.board[corner_pos].has_moved:
                         castling_moves.add((3, self.pos[1]))
             corner_pos = (8, self.pos[1])
             if (not self.board.get((7, self.pos[1])) and
@@ -422,4 +1316,62 @@ class King(Piece):
                 if self.board[corner_pos].symbol in ("R", "r"):
                     if not self.board.get(corner_pos).has_moved:
                         castling_moves.add((7, self.pos[1]))
-        return castling_moves
\ No newline at end of file
+        return castling_moves
+
+PROMOTIONS = {"Q": Queen, "R": Rook, "B": Bishop, "C": Knight}
+PIECE_CLASSES = {"P": Pawn, "K": King, **PROMOTIONS}
+
+def create_board(representation="dict"):
+    """
+    Creates a board in the starting configuration, using the selected
+    internal representation. Both representations share the same
+    move_piece, king_in_check and display_board API so they can be
+    compared against each other.
+
+    Arguments:
+        representation: "dict" for Board (positions mapped to Piece objects)
+            or "bitboard" for BitBoard (one 64 bit int per piece type)
+
+    Returns:
+        new board object
+    """
+    if representation == "dict":
+        return Board()
+    if representation == "bitboard":
+        from src.chess_server.bitboard import BitBoard
+        return BitBoard()
+    raise ValueError(f"Unknown board representation: {representation}")
+
+def load_fens(lines, representation="dict"):
+    """
+    Builds boards from lines of FEN, such as a FEN or EPD file, each set up
+    directly rather than by replaying moves. Blank lines and lines starting
+    with # are skipped, as is anything after a ";" (EPD operations).
+
+    Arguments:
+        lines: iterable of lines, eg. an open file
+        representation: board representation, as for create_board
+
+    Returns:
+        list of boards
+
+    Raises:
+        ValueError naming the line of a malformed FEN
+    """
+    if representation == "dict":
+        from_fen = Board.from_fen
+    elif representation == "bitboard":
+        from src.chess_server.bitboard import BitBoard
+        from_fen = BitBoard.from_fen
+    else:
+        raise ValueError(f"Unknown board representation: {representation}")
+    boards = []
+    for number, line in enumerate(lines, 1):
+        fen = line.split(";", 1)[0].strip()
+        if not fen or fen.startswith("#"):
+            continue
+        try:
+            boards.append(from_fen(fen))
+        except ValueError as error:
+            raise ValueError(f"line {number}: {error}") from None
+    return boards
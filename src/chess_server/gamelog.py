@@ -0,0 +1,219 @@
+#Durable log of the games in progress, so a restarted server carries on
+#playing them. Every accepted move is appended as a small binary record and
+#records are synced to disk in batches. A snapshot of the position every
+#SNAPSHOT_EVERY moves of a game lets recovery replay only the moves after it.
+import logging
+import mmap
+import os
+import struct
+
+from src.chess_server.compact import (CompactBoard, PackedHistory, SQUARES,
+    PROMOTION_SYMBOLS)
+from src.chess_server.engine import Board
+
+#record kinds
+GAME_STARTED = 1
+MOVE = 2
+SNAPSHOT = 3
+GAME_ENDED = 4
+
+HEADER = struct.Struct("<BIH") #kind, game id, payload length
+MOVE_RECORD = struct.Struct("<HB") #move code and piece byte, as in PackedHistory
+SNAPSHOT_EVERY = 16 #moves of a game between snapshots of its position
+SYNC_INTERVAL = 0.05 #seconds between batched writes and fsyncs
+
+
+class RecoveredGame:
+    """
+    What the log holds about one game: its packed moves and the last
+    snapshot of its position, taken after snapshot_moves moves
+    """
+    __slots__ = ("moves", "pieces", "snapshot", "snapshot_moves")
+
+    def __init__(self):
+        self.moves = []
+        self.pieces = bytearray()
+        self.snapshot = None
+        self.snapshot_moves = 0
+
+    def compact(self):
+        """
+        Rebuilds the game, replaying only the moves after the snapshot
+
+        Returns:
+            CompactBoard of the game, or None if the log does not replay
+        """
+        history = PackedHistory()
+        for code, pieces in zip(self.moves[:self.snapshot_moves], self.pieces):
+            history.append_packed(code, pieces)
+        if self.snapshot is None:
+            board = Board()
+            board.move_history = history
+        else:
+            compact = CompactBoard.unpack_position(self.snapshot, history)
+            if self.snapshot_moves == len(self.moves):
+                return compact
+            board = Board.from_compact(compact)
+        for code in self.moves[self.snapshot_moves:]:
+            promotion = code >> 12 & 7
+            if not board.move_piece(SQUARES[code & 63], SQUARES[code >> 6 & 63],
+                                    PROMOTION_SYMBOLS[promotion - 1] if promotion else None):
+                logging.warning("Logged move %s does not replay", code)
+                return None
+        return board.compact()
+
+
+class GameLog:
+    """
+    Append only file of game records: GAME_STARTED, MOVE with the packed move
+    code, SNAPSHOT with CompactBoard.pack_position and GAME_ENDED, each behind
+    a 7 byte header. Records are buffered and written with one fsync per batch,
+    so a crash loses at most the moves since the last sync.
+    """
+    def __init__(self, path, snapshot_every=SNAPSHOT_EVERY):
+        """
+        Arguments:
+            path: file of the log, created if missing
+            snapshot_every: moves of a game between snapshots, 0 for none
+        """
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.pending = bytearray()
+        self.bytes_written = 0
+        self.file = None
+
+    def recover(self):
+        """
+        Reads back the games in progress and starts a fresh log holding only
+        them, each ending with a snapshot so the next recovery replays nothing
+
+        Returns:
+            dict of game id -> CompactBoard
+        """
+        games = {}
+        for game_id, recovered in read_log(self.path).items():
+            compact = recovered.compact()
+            if compact is not None and compact.outcome is None:
+                games[game_id] = compact
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as temp:
+            for game_id, compact in games.items():
+                temp.write(game_records(game_id, compact))
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "ab")
+        logging.info("Recovered %s games from %s", len(games), self.path)
+        return games
+
+    def game_started(self, game_id):
+        self._append(GAME_STARTED, game_id)
+
+    def moved(self, game_id, board):
+        """
+        Logs the last move of a Board or CompactBoard, and a snapshot every
+        snapshot_every moves of a game still in progress (snapshots leave out
+        the outcome)
+        """
+        compact = isinstance(board, CompactBoard)
+        history = board.history if compact else board.move_history
+        self._append(MOVE, game_id, MOVE_RECORD.pack(history.moves[-1],
+                                                     history.pieces[-1]))
+        if (self.snapshot_every and len(history) % self.snapshot_every == 0
+                and board.outcome is None):
+            position = board if compact else board.compact()
+            self._append(SNAPSHOT, game_id, position.pack_position())
+
+    def game_ended(self, game_id):
+        self._append(GAME_ENDED, game_id)
+
+    def _append(self, kind, game_id, payload=b""):
+        self.pending += HEADER.pack(kind, game_id, len(payload))
+        self.pending += payload
+
+    def take(self):
+        """
+        Returns the records appended since the last call, to be written
+        """
+        data = bytes(self.pending)
+        self.pending.clear()
+        return data
+
+    def write(self, data):
+        """
+        Writes records and waits for them to reach the disk, blocking
+        """
+        if data:
+            if self.file is None:
+                self.file = open(self.path, "ab")
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.bytes_written += len(data)
+
+    def sync(self):
+        self.write(self.take())
+
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_log(path):
+    """
+    Scans a log through mmap, stopping at a record torn by a crash
+
+    Returns:
+        dict of game id -> RecoveredGame for the games not ended
+    """
+    games = {}
+    try:
+        log_file = open(path, "rb")
+    except FileNotFoundError:
+        return games
+    with log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        if not size:
+            return games
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            offset = 0
+            while offset + HEADER.size <= size:
+                kind, game_id, length = HEADER.unpack_from(log, offset)
+                start = offset + HEADER.size
+                offset = start + length
+                if offset > size:
+                    logging.warning("Ignoring torn record at the end of %s", path)
+                    break
+                if kind == GAME_STARTED:
+                    games[game_id] = RecoveredGame()
+                    continue
+                game = games.get(game_id)
+                if game is None:
+                    continue
+                if kind == MOVE:
+                    code, pieces = MOVE_RECORD.unpack_from(log, start)
+                    game.moves.append(code)
+                    game.pieces.append(pieces)
+                elif kind == SNAPSHOT:
+                    game.snapshot = log[start:offset]
+                    game.snapshot_moves = len(game.moves)
+                elif kind == GAME_ENDED:
+                    del games[game_id]
+    return games
+
+def game_records(game_id, compact):
+    """
+    Returns the records that start a game, replay its moves and snapshot it
+    """
+    records = bytearray(HEADER.pack(GAME_STARTED, game_id, 0))
+    move_header = HEADER.pack(MOVE, game_id, MOVE_RECORD.size)
+    history = compact.history
+    for code, pieces in zip(history.moves, history.pieces):
+        records += move_header
+        records += MOVE_RECORD.pack(code, pieces)
+    position = compact.pack_position()
+    records += HEADER.pack(SNAPSHOT, game_id, len(position))
+    records += position
+    return records
@@ -0,0 +1,208 @@
+#Reads game files: the games replayed by the load generator and checked by
+#the batch validator, and the lines of the opening book. Two formats are
+#read: our own, one [from]-[to] move per line as typed to the server with an
+#optional =Q/R/B/N promotion, and PGN, whose SAN moves are resolved against
+#the legal moves of the position. load_games replays every game on a Board
+#while reading, so a file that does not play fails there rather than under
+#load; game_sources streams games unchecked.
+import os
+import re
+
+from src.chess_server.engine import Board, WHITE, BLACK
+from src.chess_server.parser import square_to_tuple
+
+#[from]-[to], optionally promoting, eg. "e7-e8=N"; blank lines and # comments skipped
+MOVE_LINE = re.compile(r'^([a-h][1-8])-([a-h][1-8])(?:=([QRBN]))?$')
+SAN_PATTERN = re.compile(
+    r'^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?[+#]?[!?]*$')
+CASTLING_PATTERN = re.compile(r'^(O-O-O|O-O|0-0-0|0-0)[+#]?[!?]*$')
+#PGN tokens: comments, tags, variation brackets, NAGs, results, move numbers, moves
+PGN_TOKEN = re.compile(r'\{[^}]*\}|;[^\n]*|\[[^\]]*\]|[()]|\$\d+'
+                       r'|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s(){};\[\]$]+')
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+PIECE_SYMBOLS = {"K": "K", "Q": "Q", "R": "R", "B": "B", "N": "C"} #SAN -> engine
+
+
+class GameFileError(ValueError):
+    pass
+
+
+def parse_move(line):
+    """
+    Returns the (from_pos, to_pos, promotion) move of a line of our own
+    format, promotion None or an engine symbol ("Q", "R", "B", "C"), or
+    None if the line is not a move
+    """
+    squares = MOVE_LINE.match(line)
+    if squares:
+        return (square_to_tuple(squares[1]), square_to_tuple(squares[2]),
+                squares[3] and PIECE_SYMBOLS[squares[3]])
+
+def move_lines(lines):
+    """
+    Yields the lines of our own format holding a move, without comments
+    """
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if line:
+            yield line
+
+def read_moves(text, name="game"):
+    """
+    Reads a game in our own format
+
+    Returns:
+        list of (from_pos, to_pos, promotion) tuples as returned by parse_move
+    """
+    board = Board()
+    moves = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        move = parse_move(line)
+        if move is None:
+            raise GameFileError(f"{name}:{number}: not a move: {line!r}")
+        play(board, move, f"{name}:{number}")
+        moves.append(move)
+    return moves
+
+def pgn_games(lines):
+    """
+    Splits PGN into games without reading more than one game ahead, so
+    archives of any size stream through in constant memory. Tags, comments,
+    NAGs, variations and move numbers are dropped.
+
+    Returns:
+        generator of games, each a list of SAN moves
+    """
+    section = []
+    in_tags = False
+    for line in lines:
+        tag = line.startswith("[")
+        if tag and not in_tags and section:
+            yield from _section_games(section)
+            section = []
+        in_tags = tag or (in_tags and not line.strip())
+        section.append(line)
+    yield from _section_games(section)
+
+def _section_games(section):
+    moves, depth = [], 0
+    for token in PGN_TOKEN.findall("\n".join(section)):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif depth or token[0] in "{;[$" or token[0].isdigit() and token.endswith("."):
+            continue
+        elif token in RESULTS:
+            if moves:
+                yield moves
+            moves = []
+        else:
+            moves.append(token)
+    if moves:
+        yield moves
+
+def read_pgn(text, name="pgn"):
+    """
+    Reads every game of a PGN file
+
+    Returns:
+        list of games, each a list of moves as returned by read_moves
+    """
+    games = []
+    for number, sans in enumerate(pgn_games(text.splitlines()), 1):
+        board, moves = Board(), []
+        for san in sans:
+            label = f"{name}: game {number}, move {san}"
+            move = resolve_san(board, san, label)
+            play(board, move, label)
+            moves.append(move)
+        games.append(moves)
+    return games
+
+def resolve_san(board, san, label="move"):
+    """
+    Returns the (from_pos, to_pos, promotion) move a SAN move stands for in
+    the position of board, the side to move being the one that did not move
+    last
+    """
+    color = WHITE if board.last_moved_color == BLACK else BLACK
+    row = 1 if color == WHITE else 8
+    castling = CASTLING_PATTERN.match(san)
+    if castling:
+        to_x = 3 if castling[1] in ("O-O-O", "0-0-0") else 7
+        return ((5, row), (to_x, row), None)
+    parts = SAN_PATTERN.match(san)
+    if not parts:
+        raise GameFileError(f"{label}: not a SAN move")
+    piece, from_file, from_rank, to_square, promotion = parts.groups()
+    symbol = PIECE_SYMBOLS[piece] if piece else "P"
+    to_pos = square_to_tuple(to_square)
+    promotion = promotion and PIECE_SYMBOLS[promotion]
+    candidates = {
+        (from_pos, to_pos, promotion) for from_pos, to, promoted in board.legal_moves(color)
+        if to == to_pos and promoted == promotion
+        and board.board[from_pos].symbol.upper() == symbol
+        and (from_file is None or from_pos[0] == "abcdefgh".index(from_file) + 1)
+        and (from_rank is None or from_pos[1] == int(from_rank))}
+    if len(candidates) != 1:
+        raise GameFileError(f"{label}: {'ambiguous' if candidates else 'illegal'}")
+    return candidates.pop()
+
+def play(board, move, label="move"):
+    if board.outcome:
+        raise GameFileError(f"{label}: the game is already over")
+    if not board.move_piece(*move):
+        raise GameFileError(f"{label}: illegal move")
+
+def game_files(paths):
+    """
+    Yields the files of paths, directories read file by file in name order
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            yield from game_files(sorted(os.path.join(path, name)
+                                         for name in os.listdir(path)
+                                         if not name.startswith(".")))
+        else:
+            yield path
+
+def is_pgn(path):
+    return path.lower().endswith(".pgn")
+
+def game_sources(paths):
+    """
+    Streams the games of files without checking them, one PGN game at a time
+
+    Returns:
+        generator of (name, moves, san) tuples: moves are the SAN moves of a
+        PGN game when san is True, else the move lines of our own format
+    """
+    for path in game_files(paths):
+        with open(path) as game_file:
+            if is_pgn(path):
+                for number, sans in enumerate(pgn_games(game_file), 1):
+                    yield f"{path}#{number}", sans, True
+            else:
+                yield path, list(move_lines(game_file)), False
+
+def load_games(paths):
+    """
+    Reads game files, PGN for names ending in .pgn and our own format
+    otherwise. Directories are read file by file in name order.
+
+    Returns:
+        list of games, each a list of moves as returned by read_moves
+    """
+    games = []
+    for path in game_files(paths):
+        with open(path) as game_file:
+            text = game_file.read()
+        if is_pgn(path):
+            games += read_pgn(text, path)
+        else:
+            games.append(read_moves(text, path))
+    return [game for game in games if game]
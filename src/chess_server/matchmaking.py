@@ -0,0 +1,134 @@
+#Matchmaking: clients waiting for a game, queued by time control and rating.
+#Each time control has its own pool, and a pool keeps a FIFO queue per
+#bucket of RATING_BUCKET rating points (plus one for unrated clients), so a
+#client is paired by looking at the few buckets within RATING_RANGE of its
+#own instead of scanning everyone waiting. Clients that leave are only
+#marked, and dropped when they reach the front of their queue. Queues and
+#pools are deleted once nobody waits in them, as time control keys come
+#from the clients.
+from collections import deque
+
+RATING_BUCKET = 50 #rating points per bucket
+RATING_RANGE = 200 #most rating difference between the buckets of a pair
+
+
+class Seek:
+    """
+    A client waiting for a game, with its rating (None if unrated) and the
+    key of its time control
+    """
+    __slots__ = ("client", "rating", "time_control", "active")
+
+    def __init__(self, client, rating, time_control):
+        self.client = client
+        self.rating = rating
+        self.time_control = time_control
+        self.active = True #False once paired or cancelled
+
+
+class Matchmaker:
+    """
+    Pairs waiting clients with the same time control: unrated clients in
+    arrival order, rated ones with the client in the nearest rating bucket
+    within range. Clients only wait while nobody in range does, so a queue
+    holds at most one client that is still waiting, behind any that left.
+    """
+    def __init__(self, rating_range=RATING_RANGE, bucket_width=RATING_BUCKET,
+                 alive=None):
+        """
+        Arguments:
+            rating_range: most rating difference, rounded to whole buckets
+            bucket_width: rating points per bucket
+            alive: function telling if a waiting client is still connected,
+                clients found gone are dropped instead of paired
+        """
+        self.bucket_width = bucket_width
+        #buckets to look at either side, nearest first
+        span = rating_range // bucket_width
+        self.offsets = [0] + [sign * step for step in range(1, span + 1)
+                              for sign in (-1, 1)]
+        self.alive = alive or (lambda client: True)
+        self.pools = {} #time control key -> bucket (None if unrated) -> deque
+        self.seeks = {} #client -> active Seek
+
+    def __len__(self):
+        return len(self.seeks)
+
+    def __contains__(self, client):
+        return client in self.seeks
+
+    def seek(self, client, rating=None, time_control=None):
+        """
+        Pairs a client with a waiting one or queues it, replacing any seek
+        the client already had
+
+        Arguments:
+            rating: int rating, None to play any unrated client
+            time_control: hashable key of the time control, eg. "5+3"
+
+        Returns:
+            the waiting client it is paired with, None if it is queued
+        """
+        self.cancel(client)
+        bucket = None if rating is None else rating // self.bucket_width
+        match = self._take(time_control, bucket)
+        if match is not None:
+            return match.client
+        seek = Seek(client, rating, time_control)
+        pool = self.pools.get(time_control)
+        if pool is None:
+            pool = self.pools[time_control] = {}
+        queue = pool.get(bucket)
+        if queue is None:
+            queue = pool[bucket] = deque()
+        queue.append(seek)
+        self.seeks[client] = seek
+        return None
+
+    def cancel(self, client):
+        """
+        Takes a client out of the queue, if it is waiting
+        """
+        seek = self.seeks.pop(client, None)
+        if seek is None:
+            return
+        seek.active = False
+        pool = self.pools[seek.time_control]
+        bucket = None if seek.rating is None else seek.rating // self.bucket_width
+        if not any(other.active for other in pool[bucket]):
+            self._drop(seek.time_control, pool, bucket)
+
+    def _drop(self, time_control, pool, bucket):
+        """
+        Deletes the queue of a bucket, and its pool if it was the last one
+        """
+        del pool[bucket]
+        if not pool:
+            del self.pools[time_control]
+
+    def _take(self, time_control, bucket):
+        """
+        Removes and returns the Seek to pair with from the buckets nearest
+        bucket, or None
+        """
+        pool = self.pools.get(time_control)
+        if pool is None:
+            return None
+        for offset in (0,) if bucket is None else self.offsets:
+            key = bucket if bucket is None else bucket + offset
+            queue = pool.get(key)
+            while queue:
+                seek = queue.popleft()
+                if not seek.active:
+                    continue
+                del self.seeks[seek.client]
+                seek.active = False
+                if self.alive(seek.client):
+                    if not queue:
+                        self._drop(time_control, pool, key)
+                    return seek
+            if queue is not None:
+                self._drop(time_control, pool, key)
+                if not pool:
+                    return None
+        return None
@@ -0,0 +1,62 @@
+#Legality cache shared by every Board of a process. Openings and common
+#lines reach the same positions in thousands of games, and validating a move
+#there (piece rules, castling through check, own king in check) and finding
+#whether it gives check or leaves the opponent without a move gives the same
+#answer every time. Entries are keyed by the Zobrist hash of the position,
+#which covers the side to move, castling rights and a capturable en passant
+#square, plus the move, and the least recently used entry is evicted first.
+from collections import OrderedDict
+
+MOVE_CACHE_SIZE = 65536 #entries, a few hundred bytes each
+ILLEGAL = False #cached result of an illegal move
+
+
+class MoveCache:
+    """
+    Bounded LRU map of (position hash, from_pos, to_pos, promotion) to
+    ILLEGAL or (hash of the resulting position, gives check, opponent has a
+    legal move), counting hits and misses
+    """
+    def __init__(self, size=MOVE_CACHE_SIZE):
+        """
+        Arguments:
+            size: most entries kept, 0 turns the cache off
+        """
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the cached result of a move, None if not cached
+        """
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        if not self.size:
+            return
+        self.entries[key] = result
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def resize(self, size):
+        self.size = size
+        while len(self.entries) > size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+
+MOVE_CACHE = MoveCache()
@@ -0,0 +1,132 @@
+#Opening book: a tree of the opening lines of a PGN or move list file, so the
+#moves of games that follow a known opening are accepted without building a
+#Board. Each position of the book holds a snapshot of the game at that point,
+#shared by every game there, and the replies to the move leading to it,
+#encoded once for each protocol. A game leaves the book at its first move
+#that is not in it and is validated as usual from then on.
+#Loading only splits the file into moves: a position is played out and its
+#snapshot and replies built the first time a game reaches the one before it.
+import logging
+
+from src.chess_server.games import (GameFileError, game_files, is_pgn, move_lines,
+    parse_move, pgn_games, resolve_san)
+from src.chess_server.engine import Board
+from src.chess_server.protocol import TEXT, BINARY
+
+BOOK_PLIES = 20 #plies of each line kept in the book
+
+
+class OpeningNode:
+    """
+    A position of the opening book: the CompactBoard snapshot of the game
+    there and, for every position but the start, the move leading to it as a
+    move_history entry with its replies and spectator updates per protocol
+    """
+    __slots__ = ("snapshot", "move", "replies", "updates", "lines", "children")
+
+    def __init__(self, snapshot, lines, move=None):
+        """
+        Arguments:
+            snapshot: CompactBoard of the position, never played on
+            lines: dict of move -> dict of the moves after it, SAN strings
+                or (from_pos, to_pos, promotion) tuples
+            move: move_history entry of the move leading here
+        """
+        self.snapshot = snapshot
+        self.move = move
+        self.lines = lines
+        self.children = None #move -> OpeningNode, built on first use
+        if move is not None:
+            #(own, opponent) replies, and spectator updates
+            self.replies = {protocol: (protocol.move(move, own=True),
+                                       protocol.move(move, own=False))
+                            for protocol in (TEXT, BINARY)}
+            self.updates = {protocol: protocol.update(move, snapshot)
+                            for protocol in (TEXT, BINARY)}
+
+    def child(self, move):
+        """
+        Returns the OpeningNode a (from_pos, to_pos, promotion) move leads
+        to, or None if the move leaves the book
+        """
+        if self.children is None:
+            self.children = self._expand()
+        if move[2] == "Q":
+            move = (move[0], move[1], None)
+        return self.children.get(move)
+
+    def _expand(self):
+        children = {}
+        for token, lines in self.lines.items():
+            board = Board.from_compact(self.snapshot.copy())
+            try:
+                move = resolve_san(board, token) if isinstance(token, str) else token
+            except GameFileError as error:
+                logging.warning("Opening book move dropped: %s", error)
+                continue
+            if not board.move_piece(*move):
+                logging.warning("Opening book move dropped: %s is illegal", token)
+                continue
+            if board.outcome:
+                continue #games ending in the book are ended the usual way
+            key = (move[0], move[1], None if move[2] == "Q" else move[2])
+            if key in children:
+                #the same move written another way, eg. "Nf3" and "g1-f3"
+                _merge(children[key].lines, lines)
+            else:
+                children[key] = OpeningNode(board.compact(), lines,
+                                            board.move_history[-1])
+        self.lines = None
+        return children
+
+def _merge(lines, other):
+    for move, after in other.items():
+        if move in lines:
+            _merge(lines[move], after)
+        else:
+            lines[move] = after
+
+
+class OpeningBook:
+    """
+    Tree of opening lines, each a sequence of moves from the start position
+    """
+    def __init__(self, lines, plies=BOOK_PLIES):
+        """
+        Arguments:
+            lines: iterable of lines, each a list of SAN strings or
+                (from_pos, to_pos, promotion) tuples
+            plies: moves of each line kept
+        """
+        tree = {}
+        self.line_count = 0
+        for line in lines:
+            branch = tree
+            for move in line[:plies]:
+                branch = branch.setdefault(move, {})
+            self.line_count += 1
+        self.root = OpeningNode(Board().compact(), tree)
+
+    @classmethod
+    def from_files(cls, paths, plies=BOOK_PLIES):
+        """
+        Reads the lines of files and directories of them: every game of the
+        PGN files (names ending in .pgn), and every line of the others, as
+        [from]-[to] moves separated by spaces
+
+        Raises:
+            GameFileError if a line holds something other than moves
+        """
+        return cls(_file_lines(paths), plies)
+
+def _file_lines(paths):
+    for path in game_files(paths):
+        with open(path) as book_file:
+            if is_pgn(path):
+                yield from pgn_games(book_file)
+                continue
+            for number, text in enumerate(move_lines(book_file), 1):
+                line = [parse_move(token) for token in text.split()]
+                if None in line:
+                    raise GameFileError(f"{path}: line {number}: not a line of moves")
+                yield line
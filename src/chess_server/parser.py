@@ -2,21 +2,29 @@
 #and move history into response messages
 import re
 
+DISPLAY_BOARD = "display_board"
+MOVE_PATTERN = re.compile(r'^([a-h][1-8])-([a-h][1-8])$')
+
 def valid_msg(msg):
-    if msg == "display_board":
-        return True
-    pattern = r'^([a-h][1-8])-([a-h][1-8])$'
-    if re.search(pattern, msg):
-        return True
-    return False
+    return parse_msg(msg) is not None
 
 def msg_to_move(msg):
-    pattern = r'^([a-h][1-8])-([a-h][1-8])$'
-    squares = re.search(pattern, msg)
+    squares = MOVE_PATTERN.match(msg)
     if squares:
         return (square_to_tuple(squares[1]),
                 square_to_tuple(squares[2]))
 
+def parse_msg(msg):
+    """
+    Validates and converts a message with a single regex match
+
+    Returns:
+        DISPLAY_BOARD, a move tuple (from_pos, to_pos) or None if invalid
+    """
+    if msg == DISPLAY_BOARD:
+        return DISPLAY_BOARD
+    return msg_to_move(msg)
+
 def write_msg(move):
     """
     Returns message string based on move from move_history
@@ -27,6 +35,8 @@ def write_msg(move):
     case_dest = tuple_to_square(move[3])
     target = symbol_to_name(move[4]) if move[4] else ""
     check = ". Check" if move[5] else ""
+    if move[6]:
+        check = f" and promotes to {symbol_to_name(move[6])}{check}"
 
     if castling_check(piece, case_src, case_dest):
         msg = f"{X}. {piece} does a {castling_type} "\
@@ -36,6 +46,10 @@ def write_msg(move):
               f"on {case_dest}{check}"
     else:
         msg = f"{X}. {piece} moves from {case_src} to {case_dest}{check}"
+    if move[7] == "checkmate":
+        msg += f". Checkmate, {piece.split()[0]} wins"
+    elif move[7]:
+        msg += f". Draw by {move[7]}"
     return msg
 
 def symbol_to_name(symbol):
@@ -0,0 +1,149 @@
+#Profiling of chosen games on a live server, started from the admin port
+#deterministic: cProfile around the requests of the games, written as pstats
+#sampling: a thread sampling the stack while one of the games is being served,
+#written as collapsed stacks ("frame;frame;frame count") for flame graphs
+import asyncio
+import cProfile
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.001 #seconds between stack samples
+#profile <game id>[,<game id>...] <count> moves|seconds [sampling]
+PROFILE_PATTERN = re.compile(
+    r'^profile (\d{1,9}(?:,\d{1,9})*) (\d+(?:\.\d+)?) (moves|seconds)( sampling)?$')
+ROOT_FUNCTION = "handle_request" #samples are cut to the frames from here down
+
+
+def parse_profile_command(msg):
+    """
+    Returns (game ids, moves, seconds, sampling) of a profile command, one
+    of moves and seconds None, or None if the command is invalid
+    """
+    command = PROFILE_PATTERN.match(msg)
+    if not command:
+        return None
+    game_ids = [int(game_id) for game_id in command[1].split(",")]
+    count = float(command[2])
+    if command[3] == "moves":
+        return game_ids, int(count), None, bool(command[4])
+    return game_ids, None, count, bool(command[4])
+
+def frame_name(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class GameProfiler:
+    """
+    Profiles the requests of some games until a number of their moves have
+    been played or a time window has passed. Requests of other games run
+    without the profiler.
+    """
+    def __init__(self, game_ids, moves=None, seconds=None, sampling=False,
+                 report_dir=None, interval=SAMPLE_INTERVAL):
+        """
+        Arguments:
+            game_ids: ids of the games to profile
+            moves: stop after this many moves of the games, or None
+            seconds: stop after this many seconds, or None
+            sampling: sample stacks instead of tracing every call
+            report_dir: directory of the report, the temp directory if None
+            interval: seconds between samples when sampling
+        """
+        self.game_ids = set(game_ids)
+        self.moves_left = moves
+        self.seconds = seconds
+        self.sampling = sampling
+        self.report_dir = report_dir or tempfile.gettempdir()
+        self.interval = interval
+        self.profile = None if sampling else cProfile.Profile()
+        self.stacks = Counter()
+        self.serving = False #True while a request of the games is handled
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.thread_id = None
+        self.done = None
+        self.report_path = None
+
+    def start(self):
+        """
+        Starts profiling from the event loop thread
+
+        Returns:
+            future set to the report path once the profile is written
+        """
+        loop = asyncio.get_running_loop()
+        self.done = loop.create_future()
+        self.thread_id = threading.get_ident()
+        if self.sampling:
+            self.sampler = threading.Thread(target=self._sample, daemon=True,
+                                            name="chess-profiler")
+            self.sampler.start()
+        if self.seconds is not None:
+            loop.call_later(self.seconds, self.finish)
+        return self.done
+
+    def covers(self, game):
+        return game is not None and game.game_id in self.game_ids
+
+    def run(self, function, *args):
+        """
+        Calls function(*args) under the profiler
+        """
+        if self.profile is not None:
+            return self.profile.runcall(function, *args)
+        self.serving = True
+        try:
+            return function(*args)
+        finally:
+            self.serving = False
+
+    def moved(self):
+        """
+        Counts a move of one of the games, finishing after the last one
+        """
+        if self.moves_left is not None:
+            self.moves_left -= 1
+            if self.moves_left <= 0:
+                asyncio.get_running_loop().call_soon(self.finish)
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            if not self.serving:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                if frame.f_code.co_name == ROOT_FUNCTION:
+                    self.stacks[";".join(map(frame_name, reversed(stack)))] += 1
+                    break
+                frame = frame.f_back
+
+    def finish(self):
+        """
+        Stops profiling and writes the report, once
+        """
+        if self.done is None or self.done.done():
+            return
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        name = "-".join(map(str, sorted(self.game_ids)))
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        if self.profile is not None:
+            self.report_path = os.path.join(self.report_dir,
+                                            f"chess-profile-{name}-{stamp}.pstats")
+            self.profile.dump_stats(self.report_path)
+        else:
+            self.report_path = os.path.join(self.report_dir,
+                                            f"chess-profile-{name}-{stamp}.collapsed")
+            with open(self.report_path, "w") as report:
+                for stack, count in self.stacks.most_common():
+                    report.write(f"{stack} {count}\n")
+        self.done.set_result(self.report_path)
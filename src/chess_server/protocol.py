@@ -0,0 +1,331 @@
+#Wire protocols spoken by the server, chosen per connection
+#text: newline terminated messages such as "e2-e4", English replies
+#binary: 2 byte request frames and 4 byte reply frames with status codes
+import re
+import struct
+
+from src.chess_server.parser import DISPLAY_BOARD, parse_msg, write_msg, tuple_to_square
+from src.chess_server.bitboard import square_index, index_to_square
+from src.chess_server.compact import SQUARES
+
+SWITCH_TO_BINARY = "binary" #text message that turns on the binary protocol
+SHOW_STATS = "stats" #text message asking for the server stats
+SHOW_CLOCK = "clock" #text message asking for the time left of both players
+WATCH = "watch" #text message "watch <game id>" subscribes to a game
+WATCH_PATTERN = re.compile(r'^watch (\d{1,9})$')
+#text message "resume <game id> <white|black>" takes a seat of a recovered game
+RESUME = "resume"
+RESUME_PATTERN = re.compile(r'^resume (\d{1,9}) (white|black)$')
+#text message "seek [<rating>] [<minutes>+<increment>]" asks for a game
+SEEK = "seek"
+SEEK_PATTERN = re.compile(r'^seek(?: (\d{1,4}))?(?: (\d+(?:\.\d+)?\+\d+(?:\.\d+)?))?$')
+#text message "delta <version>" asks for the squares changed since a version
+DELTA = "delta"
+DELTA_PATTERN = re.compile(r'^delta (\d{1,9})$')
+INCOMPLETE = object() #returned when the buffer does not hold a whole request
+
+#reply status codes
+OK = 0 #own move was played
+OPPONENT_MOVED = 1
+INVALID_MOVE = 2
+NOT_YOUR_TURN = 3
+WAITING = 4
+INVALID_REQUEST = 5
+BOARD = 6
+GAME_STARTED = 7
+OPPONENT_LEFT = 8
+BINARY_ON = 9
+WATCHING = 10
+NO_SUCH_GAME = 11
+PLAYER_LEFT = 12
+SPECTATOR = 13
+BOARD_DELTA = 14
+STATS_REPLY = 15
+TIME_OUT = 16 #a flag fell, a is 1 if black lost on time
+CLOCK_REPLY = 17 #followed by the milliseconds left of white and black
+
+STATUS_TEXT = {
+    INVALID_MOVE: "Invalid Move",
+    NOT_YOUR_TURN: "Not your turn",
+    WAITING: "Waiting for an opponent",
+    INVALID_REQUEST: "Invalid request",
+    OPPONENT_LEFT: "Opponent disconnected",
+    BINARY_ON: "OK binary",
+    NO_SUCH_GAME: "No such game",
+    PLAYER_LEFT: "Player disconnected",
+    SPECTATOR: "Spectators cannot move",
+}
+
+#binary request frames are (from, to) bytes: bits 0-5 of each hold a square
+#index (a1 = 0, h8 = 63), bits 6-7 of the to byte the promotion, 0 for queen
+COMMAND = 0xFF #from byte of a command frame, its to byte picks the command
+COMMANDS = {0: DISPLAY_BOARD, 2: SHOW_STATS, 3: SHOW_CLOCK}
+DELTA_COMMAND = 1 #followed by the 16 bit version the client has, big endian
+REQUEST_PROMOTIONS = (None, "R", "B", "C")
+
+#flags byte of a move reply: bit 0 capture, bit 1 check,
+#bits 2-4 promotion (1 + index in "QRBC"), bits 5-7 outcome
+PROMOTION_CODES = {None: 0, "Q": 1, "R": 2, "B": 3, "C": 4}
+OUTCOME_CODES = {None: 0, "checkmate": 1, "stalemate": 2,
+                 "threefold repetition": 3, "fifty-move rule": 4}
+FRAME = struct.Struct("4B")
+CLOCK_TIMES = struct.Struct(">II") #milliseconds left of white and black
+GAME_ID = struct.Struct(">I") #after GAME_STARTED and WATCHING frames
+
+
+class TextProtocol:
+    """
+    Newline terminated text messages, for people typing at a terminal
+    """
+    name = "text"
+    shared_move_reply = True #both players get the same reply to a move
+
+    @staticmethod
+    def next_request(buffer, start):
+        """
+        Reads the request starting at start in buffer
+
+        Returns:
+            (request, end): the request is INCOMPLETE if buffer holds no whole
+              request, None if invalid, otherwise DISPLAY_BOARD, SHOW_STATS,
+              SHOW_CLOCK, SWITCH_TO_BINARY, (WATCH, game id), (RESUME, game id, color),
+              (SEEK, rating, time control text), rating and time control None
+              if not given, (DELTA, version) or a move tuple (from_pos, to_pos,
+              promotion)
+        """
+        end = buffer.find(b"\n", start)
+        if end == -1:
+            return INCOMPLETE, start
+        msg = buffer[start:end].decode(errors="replace").strip()
+        if msg == SWITCH_TO_BINARY or msg == SHOW_STATS or msg == SHOW_CLOCK:
+            return msg, end + 1
+        if msg.startswith(WATCH):
+            watch = WATCH_PATTERN.match(msg)
+            return (WATCH, int(watch[1])) if watch else None, end + 1
+        if msg.startswith(RESUME):
+            resume = RESUME_PATTERN.match(msg)
+            return (RESUME, int(resume[1]), resume[2]) if resume else None, end + 1
+        if msg.startswith(SEEK):
+            seek = SEEK_PATTERN.match(msg)
+            if not seek:
+                return None, end + 1
+            return (SEEK, seek[1] and int(seek[1]), seek[2]), end + 1
+        if msg.startswith(DELTA):
+            delta = DELTA_PATTERN.match(msg)
+            return (DELTA, int(delta[1])) if delta else None, end + 1
+        request = parse_msg(msg)
+        if request is None or request == DISPLAY_BOARD:
+            return request, end + 1
+        return request + (None,), end + 1
+
+    @staticmethod
+    def status(code):
+        return STATUS_TEXT[code].encode() + b"\n"
+
+    @staticmethod
+    def game_started(game_id, color_name, board):
+        return (f"Game {game_id} started, you play {color_name}\n"
+                f"{board.display_board()}\n").encode()
+
+    @staticmethod
+    def resumed(game_id, color_name, board):
+        return (f"Game {game_id} resumed, you play {color_name}\n"
+                f"{board.display_board()}\n").encode()
+
+    @staticmethod
+    def move(move, own):
+        return write_msg(move).encode() + b"\n"
+
+    @staticmethod
+    def board(board):
+        return board.display_board().encode() + b"\n"
+
+    @staticmethod
+    def delta(board, version):
+        """
+        Returns the squares changed since the client's version as
+        "Delta <version> e2=- e4=P" ("-" for empty), or "Board <version>"
+        and the whole board if the version is not known
+        """
+        changed = board.changed_since(version)
+        if changed is None:
+            return f"Board {board.version}\n{board.display_board()}\n".encode()
+        squares = "".join(f" {tuple_to_square(SQUARES[index])}="
+                          f"{'-' if symbol == ' ' else symbol}"
+                          for index, symbol in changed.items())
+        return f"Delta {board.version}{squares}\n".encode()
+
+    @staticmethod
+    def stats(text):
+        return text.encode()
+
+    @staticmethod
+    def clock(white, black):
+        return f"Clock white {white:.1f} black {black:.1f}\n".encode()
+
+    @staticmethod
+    def time_out(color_name):
+        return f"Time out, {color_name} loses\n".encode()
+
+    @staticmethod
+    def watching(game_id, board):
+        return f"Watching game {game_id}\n{board.display_board()}\n".encode()
+
+    @staticmethod
+    def update(move, board):
+        """
+        Returns what spectators get after a move: the move and the new board
+        """
+        return f"{write_msg(move)}\n{board.display_board()}\n".encode()
+
+    @staticmethod
+    def resync(board):
+        #every update already holds the whole board
+        return b""
+
+
+class BinaryProtocol:
+    """
+    Fixed size frames for programs. Requests can be pipelined, every reply is
+    a 4 byte frame (status, a, b, c) and a board reply is followed by 64 bytes.
+    Board and delta frames carry the low 16 bits of Board.version in b and c.
+    """
+    name = "binary"
+    shared_move_reply = False
+
+    @staticmethod
+    def next_request(buffer, start):
+        end = start + 2
+        if len(buffer) < end:
+            return INCOMPLETE, start
+        from_byte, to_byte = buffer[start], buffer[start + 1]
+        if from_byte == COMMAND and to_byte == DELTA_COMMAND:
+            if len(buffer) < end + 2:
+                return INCOMPLETE, start
+            return (DELTA, buffer[end] << 8 | buffer[end + 1]), end + 2
+        if from_byte == COMMAND:
+            return COMMANDS.get(to_byte), end
+        if from_byte > 63:
+            return None, end
+        return (index_to_square(from_byte), index_to_square(to_byte & 63),
+                REQUEST_PROMOTIONS[to_byte >> 6]), end
+
+    @staticmethod
+    def status(code):
+        return FRAME.pack(code, 0, 0, 0)
+
+    @staticmethod
+    def game_started(game_id, color_name, board):
+        """
+        Returns a GAME_STARTED frame with 1 in a for black, followed by the
+        game id as a 32 bit big endian int
+        """
+        return (FRAME.pack(GAME_STARTED, color_name == "black", 0, 0)
+                + GAME_ID.pack(game_id))
+
+    @staticmethod
+    def resumed(game_id, color_name, board):
+        return (BinaryProtocol.game_started(game_id, color_name, board)
+                + BinaryProtocol.board(board))
+
+    @staticmethod
+    def move(move, own):
+        promotion = move[6] and move[6].upper()
+        flags = (bool(move[4]) | move[5] << 1 | PROMOTION_CODES[promotion] << 2
+                 | OUTCOME_CODES[move[7]] << 5)
+        return FRAME.pack(OK if own else OPPONENT_MOVED, square_index(move[1]),
+                          square_index(move[3]), flags)
+
+    @staticmethod
+    def board(board):
+        return (FRAME.pack(BOARD, 0, board.version >> 8 & 255, board.version & 255)
+                + board.square_symbols().encode())
+
+    @staticmethod
+    def delta(board, version):
+        """
+        Returns a BOARD_DELTA frame with the number of changed squares in a,
+        followed by a (square index, symbol) byte pair per square, or the
+        whole board when that is no smaller or the version is not known
+        """
+        #the client only has the low 16 bits, take the latest matching version
+        version = board.version - ((board.version - version) & 0xFFFF)
+        changed = board.changed_since(version)
+        if changed is None or len(changed) * 2 >= 64:
+            return BinaryProtocol.board(board)
+        squares = bytearray()
+        for index, symbol in changed.items():
+            squares += bytes((index, ord(symbol)))
+        return (FRAME.pack(BOARD_DELTA, len(changed), board.version >> 8 & 255,
+                           board.version & 255) + squares)
+
+    @staticmethod
+    def stats(text):
+        """
+        Returns a STATS_REPLY frame with the 24 bit length of the text in a,
+        b and c, followed by the text
+        """
+        data = text.encode()
+        return FRAME.pack(STATS_REPLY, len(data) >> 16 & 255, len(data) >> 8 & 255,
+                          len(data) & 255) + data
+
+    @staticmethod
+    def clock(white, black):
+        """
+        Returns a CLOCK_REPLY frame followed by the milliseconds left of white
+        and black as 32 bit big endian ints
+        """
+        return FRAME.pack(CLOCK_REPLY, 0, 0, 0) + CLOCK_TIMES.pack(
+            max(0, round(white * 1000)), max(0, round(black * 1000)))
+
+    @staticmethod
+    def time_out(color_name):
+        return FRAME.pack(TIME_OUT, color_name == "black", 0, 0)
+
+    @staticmethod
+    def watching(game_id, board):
+        return (FRAME.pack(WATCHING, 0, 0, 0) + GAME_ID.pack(game_id)
+                + BinaryProtocol.board(board))
+
+    @staticmethod
+    def update(move, board):
+        return BinaryProtocol.move(move, own=False)
+
+    @staticmethod
+    def resync(board):
+        """
+        Returns the board sent before the next update to a spectator that
+        missed updates while it was behind
+        """
+        return BinaryProtocol.board(board)
+
+
+def encode_request(from_pos, to_pos, promotion=None):
+    """
+    Builds a binary request frame for a move, for clients
+    """
+    return bytes((square_index(from_pos),
+                  square_index(to_pos) | REQUEST_PROMOTIONS.index(
+                      None if promotion == "Q" else promotion) << 6))
+
+def encode_delta_request(version):
+    """
+    Builds a binary request frame for the squares changed since a version
+    """
+    return bytes((COMMAND, DELTA_COMMAND, version >> 8 & 255, version & 255))
+
+def decode_move_flags(flags):
+    """
+    Splits the flags byte of a move reply, for clients
+
+    Returns:
+        (captured, check, promotion symbol or None, outcome or None)
+    """
+    promotion = {code: symbol for symbol, code in PROMOTION_CODES.items()}
+    outcome = {code: name for name, code in OUTCOME_CODES.items()}
+    return (bool(flags & 1), bool(flags & 2), promotion[flags >> 2 & 7],
+            outcome[flags >> 5])
+
+
+TEXT = TextProtocol()
+BINARY = BinaryProtocol()
@@ -0,0 +1,166 @@
+#Registry of the games hosted by a server, parking the boards of idle games
+#and keeping the games held in memory within a budget by spilling the least
+#recently used idle games to disk
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+from src.chess_server.compact import CompactBoard
+from src.chess_server.stats import STATS
+
+#memory held by a playable Board without its history, measured by bench_memory
+BOARD_BYTES = 30 * 1024
+#seconds without requests before the board of a game is parked, rebuilding a
+#Board costs about as much as a move so games in play keep theirs
+PARK_AFTER = 30
+
+
+def resident_bytes(game):
+    """
+    Returns an estimate of the memory held by the board of a game
+    """
+    position = game.position()
+    if position is None:
+        return 0
+    if isinstance(position, CompactBoard):
+        return position.nbytes()
+    return BOARD_BYTES + position.move_history.nbytes()
+
+
+class GameRegistry:
+    """
+    Maps game ids to games like a dict. Games without a request for
+    park_after seconds are parked, checked on every touch(). With a memory
+    budget, the boards of the least recently used games are written to a
+    spill directory, a few hundred bytes each, once the boards in memory add
+    up to more than the budget. A spilled game is read back by touch() on
+    its next request.
+    """
+    def __init__(self, memory_budget=None, spill_dir=None, park_after=None,
+                 clock=time.monotonic):
+        """
+        Arguments:
+            memory_budget: bytes of boards to keep in memory, None for no limit
+            spill_dir: directory of spilled games, a temporary one if None
+            park_after: seconds without requests before a game is parked,
+                None to leave parking to the caller
+            clock: function returning the time in seconds
+        """
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.park_after = park_after
+        self.clock = clock
+        #game id -> time of the last touch of the games not spilled, least
+        #recent first, only kept with park_after
+        self.last_used = OrderedDict()
+        self.temporary_dir = None
+        self.games = {}
+        #game id -> estimated bytes of the games in memory, least recent first
+        self.resident = OrderedDict()
+        self.resident_bytes = 0
+        self.spills = 0
+        self.reloads = 0
+
+    def __getitem__(self, game_id):
+        return self.games[game_id]
+
+    def get(self, game_id, default=None):
+        return self.games.get(game_id, default)
+
+    def __contains__(self, game_id):
+        return game_id in self.games
+
+    def __len__(self):
+        return len(self.games)
+
+    def __iter__(self):
+        return iter(self.games)
+
+    def __setitem__(self, game_id, game):
+        self.games[game_id] = game
+        self.touch(game)
+
+    def __delitem__(self, game_id):
+        game = self.games.pop(game_id)
+        self.resident_bytes -= self.resident.pop(game_id, 0)
+        self.last_used.pop(game_id, None)
+        if game.spilled():
+            os.remove(self._path(game_id))
+
+    def touch(self, game):
+        """
+        Marks a game as the most recently used, reading it back if it was
+        spilled, parks the games left idle and spills other games if that
+        takes memory over the budget
+        """
+        game_id = game.game_id
+        if game_id not in self.games:
+            return #the game has ended
+        if game.spilled():
+            with open(self._path(game_id), "rb") as spill_file:
+                game.compact_board = CompactBoard.from_bytes(spill_file.read())
+            os.remove(self._path(game_id))
+            self.reloads += 1
+            if STATS.enabled:
+                STATS.count("games_reloaded")
+        size = resident_bytes(game)
+        self.resident_bytes += size - self.resident.pop(game_id, 0)
+        self.resident[game_id] = size
+        if self.park_after is not None:
+            self.last_used.pop(game_id, None)
+            now = self.clock()
+            self.last_used[game_id] = now
+            self._park_idle(now)
+        if self.memory_budget is not None:
+            self._spill_over_budget()
+
+    def _park_idle(self, now):
+        """
+        Parks the games not touched for park_after seconds
+        """
+        idle_since = now - self.park_after
+        while self.last_used:
+            game_id, used = next(iter(self.last_used.items()))
+            if used > idle_since:
+                break
+            del self.last_used[game_id]
+            game = self.games[game_id]
+            game.park()
+            size = resident_bytes(game)
+            self.resident_bytes += size - self.resident[game_id]
+            self.resident[game_id] = size
+
+    def _spill_over_budget(self):
+        """
+        Spills the least recently used games, never the most recent one,
+        until the games in memory fit in the budget
+        """
+        while self.resident_bytes > self.memory_budget and len(self.resident) > 1:
+            game_id, size = self.resident.popitem(last=False)
+            self.resident_bytes -= size
+            game = self.games[game_id]
+            self.last_used.pop(game_id, None)
+            game.park()
+            with open(self._path(game_id), "wb") as spill_file:
+                spill_file.write(game.compact_board.to_bytes())
+            game.compact_board = None
+            self.spills += 1
+            if STATS.enabled:
+                STATS.count("games_spilled")
+
+    def _path(self, game_id):
+        if self.spill_dir is None:
+            self.temporary_dir = self.spill_dir = tempfile.mkdtemp(prefix="chess-games-")
+            logging.info("Spilling idle games to %s", self.spill_dir)
+        return os.path.join(self.spill_dir, f"{game_id}.game")
+
+    def close(self):
+        """
+        Deletes the spill directory if the registry made it
+        """
+        if self.temporary_dir is not None:
+            shutil.rmtree(self.temporary_dir, ignore_errors=True)
+            self.temporary_dir = None
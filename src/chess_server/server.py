@@ -1,40 +1,799 @@
-#argument parser
-#server that takes in commands
-#runs move commands on board
-import argparse
+#server that takes in commands from connected clients
+#pairs clients into games and runs their move commands on the board
+import asyncio
 import logging
-import socket
-import sys
-
-from src.chess_server.parser import valid_msg, msg_to_move, write_msg
-from src.chess_server.engine import Board
-
-
-parser = argparse.ArgumentParser(description="Chess Server")
-parser.add_argument("-v", help="activate the verbose mode", action="store_true")
-parser.add_argument("-i", help="IP address of the interface (default 127.0.0.1)",
-    default="127.0.0.1")
-parser.add_argument("-p", help="port for server listens on (default 2000)",
-    type=int, default=2000)
-args = parser.parse_args()
-
-HOST = args.i
-PORT = args.p
-if args.v:
-    logging.basicConfig(level=logging.DEBUG)
-
-def run():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen()
-        conn, addr = s.accept()
-        with conn:
-            print('Connected by', addr)
+
+from src.chess_server.parser import DISPLAY_BOARD, valid_msg, msg_to_move, write_msg
+from src.chess_server.engine import Board, WHITE, BLACK
+from src.chess_server.gamelog import GameLog, SYNC_INTERVAL
+from src.chess_server.registry import GameRegistry, PARK_AFTER
+from src.chess_server.profiling import GameProfiler, parse_profile_command
+from src.chess_server.stats import STATS, PARSE, MOVE, REPLY, WRITE, DRAIN, clock
+from src.chess_server.clock import GameClock, TimeControl, TimerWheel
+from src.chess_server.matchmaking import Matchmaker
+from src.chess_server.movecache import MOVE_CACHE
+from src.chess_server.openings import OpeningBook
+from src.chess_server.protocol import (TEXT, BINARY, INCOMPLETE, SWITCH_TO_BINARY,
+    SHOW_STATS, SHOW_CLOCK, WATCH, RESUME, SEEK, DELTA, INVALID_MOVE, NOT_YOUR_TURN, WAITING, INVALID_REQUEST, OPPONENT_LEFT,
+    BINARY_ON, NO_SUCH_GAME, PLAYER_LEFT, SPECTATOR)
+
+HOST = "127.0.0.1"
+ADMIN_HOST = "127.0.0.1" #the admin port only listens locally
+PORT = 2000
+SPECTATOR_PORT = 2001
+BACKLOG = 4096 #pending connections the kernel queues for accept
+MAX_LINE = 1024 #longer requests close the connection
+READ_SIZE = 64 * 1024 #bytes read at once, pipelined requests are answered together
+MAX_WRITE_BUFFER = 64 * 1024 #unsent bytes before a client is dropped as too slow
+SPECTATOR_BUFFER = 16 * 1024 #unsent bytes above which spectators skip updates
+WRITE_TIMEOUT = 10 #seconds to wait for a client to read its own replies
+
+
+class Player:
+    """
+    A connected client, waiting for an opponent, playing one color of a game
+    or watching one (color None)
+    """
+    __slots__ = ("reader", "writer", "color", "game", "protocol", "behind")
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.color = None
+        self.game = None
+        self.protocol = TEXT
+        self.behind = False #a spectator that skipped updates
+
+    def send(self, data):
+        """
+        Queues data for the client without waiting for it to be sent, so
+        a move is never held up by its opponent's connection. A client that
+        lets more than MAX_WRITE_BUFFER bytes pile up is disconnected.
+
+        Arguments:
+            data: bytes encoded by the player's protocol
+
+        Returns:
+            False if the client is gone or was dropped
+        """
+        if self.writer.is_closing():
+            return False
+        self.writer.write(data)
+        if STATS.enabled:
+            STATS.count("bytes_sent", amount=len(data))
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            logging.info("Dropping slow client %s", self.peer())
+            self.writer.transport.abort()
+            return False
+        return True
+
+    def peer(self):
+        return self.writer.get_extra_info("peername")
+
+
+class Game:
+    """
+    A board shared by two paired players and watched by any number of
+    spectators. Once idle the game can be parked as a CompactBoard, a few
+    hundred bytes instead of tens of KB, and an idle parked game can be
+    spilled to disk by the GameRegistry. A game recovered from the game log
+    starts parked with both seats empty (None) until its players resume.
+    Under a time control the GameClock is kept here, next to the board, and
+    stays in memory while the board is parked or spilled. A game following
+    the opening book stays parked on the shared snapshot of its book position
+    until its first move out of the book.
+    """
+    __slots__ = ("game_id", "_board", "compact_board", "spectators", "players",
+                 "clock", "book")
+
+    def __init__(self, game_id, white, black, compact_board=None, book=None):
+        self.game_id = game_id
+        self.book = book #OpeningNode of the position while in the opening book
+        if book is not None:
+            compact_board = book.snapshot
+        self._board = Board() if compact_board is None else None
+        self.compact_board = compact_board
+        self.spectators = set()
+        self.players = {WHITE: None, BLACK: None}
+        self.clock = None #GameClock, None for untimed games
+        for color, player in ((WHITE, white), (BLACK, black)):
+            if player is not None:
+                self.seat(player, color)
+
+    def seat(self, player, color):
+        self.players[color] = player
+        player.color = color
+        player.game = self
+
+    @property
+    def board(self):
+        """
+        The playable Board, rebuilt from the compact form if the game is parked
+        """
+        if self._board is None:
+            compact = self.compact_board
+            if self.book is not None:
+                #the snapshot is shared by every game at this book position
+                compact = compact.copy()
+                self.book = None
+            self._board = Board.from_compact(compact)
+            self.compact_board = None
+        return self._board
+
+    def park(self):
+        if self._board is not None:
+            self.compact_board = self._board.compact()
+            self._board = None
+
+    def spilled(self):
+        return self._board is None and self.compact_board is None
+
+    def position(self):
+        """
+        Returns the position to display without unparking the game: the
+        CompactBoard if parked, otherwise the Board (None if spilled)
+        """
+        if self._board is None:
+            return self.compact_board
+        return self._board
+
+    def opponent(self, player):
+        return self.players[BLACK if player.color == WHITE else WHITE]
+
+    def to_move(self):
+        if self._board is None:
+            return WHITE if self.compact_board.white_to_move else BLACK
+        return WHITE if self._board.last_moved_color == BLACK else BLACK
+
+    def outcome(self):
+        if self.spilled():
+            return None #only games in progress are spilled
+        if self._board is None:
+            return self.compact_board.outcome
+        return self._board.outcome
+
+    def broadcast(self, move, updates=None):
+        """
+        Sends a move and the new board to every spectator. Each protocol's
+        update is encoded once and the same bytes are queued on every socket.
+        A spectator with more than SPECTATOR_BUFFER bytes unsent skips updates
+        instead of buffering them, and gets the board to catch up from once
+        it has drained.
+
+        Arguments:
+            updates: dict of protocol -> update already encoded, if any
+        """
+        board = self.position()
+        encoded = dict(updates) if updates else {}
+        resyncs = {}
+        for spectator in self.spectators:
+            writer = spectator.writer
+            if writer.is_closing():
+                continue
+            if writer.transport.get_write_buffer_size() > SPECTATOR_BUFFER:
+                spectator.behind = True
+                continue
+            protocol = spectator.protocol
+            if spectator.behind:
+                spectator.behind = False
+                if protocol not in resyncs:
+                    resyncs[protocol] = protocol.resync(board)
+                writer.write(resyncs[protocol])
+            data = encoded.get(protocol)
+            if data is None:
+                data = encoded[protocol] = protocol.update(move, board)
+            writer.write(data)
+
+    def close_spectators(self, status=None):
+        for spectator in self.spectators:
+            if status is not None:
+                spectator.send(spectator.protocol.status(status))
+            spectator.writer.close()
+        self.spectators.clear()
+
+
+class GameServer:
+    """
+    Hosts any number of concurrent games on one event loop. Clients are paired
+    in the order they connect, the first of each pair playing white.
+    """
+    def __init__(self, park_games=True, game_log=None, memory_budget=None,
+                 spill_dir=None, profile_dir=None, time_control=None, opening_book=None):
+        """
+        Arguments:
+            park_games: keep games idle for PARK_AFTER seconds compact,
+              trading about 60us on their next move for a fraction of the
+              memory
+            game_log: GameLog every game is recorded in, or None
+            memory_budget: bytes of boards to keep in memory before idle
+              games are spilled to disk, None for no limit
+            spill_dir: directory of spilled games, a temporary one if None
+            profile_dir: directory of profile reports, the temp directory if None
+            time_control: TimeControl of new games, None for untimed games
+            opening_book: OpeningBook whose moves are accepted without
+              validation, or None
+        """
+        self.park_games = park_games
+        self.profile_dir = profile_dir
+        self.profiler = None #GameProfiler started from the admin port
+        self.game_log = game_log
+        self.games = GameRegistry(memory_budget, spill_dir,
+                                  PARK_AFTER if park_games else None)
+        self.matchmaker = Matchmaker(alive=connected)
+        self.games_started = 0
+        self.time_control = time_control
+        self.timers = None #TimerWheel of every game clock, made on first use
+        self.opening_book = opening_book
+
+    def restore_games(self):
+        """
+        Recovers the games in progress from the game log, parked until their
+        players send "resume <game id> <color>" on the spectator port.
+        Recovered games are untimed.
+        """
+        for game_id, compact in self.game_log.recover().items():
+            self.games[game_id] = Game(game_id, None, None, compact)
+        self.games_started = max(self.games, default=self.games_started)
+
+    async def sync_log(self, interval=SYNC_INTERVAL):
+        """
+        Writes the records logged since the last batch and fsyncs them, off
+        the event loop, every interval seconds
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            data = self.game_log.take()
+            if data:
+                await loop.run_in_executor(None, self.game_log.write, data)
+
+    async def start(self, host=HOST, port=PORT):
+        """
+        Starts listening, returns the asyncio server
+        """
+        return await asyncio.start_server(self.handle_client, host, port,
+            backlog=BACKLOG, reuse_address=True)
+
+    async def handle_client(self, reader, writer):
+        player = Player(reader, writer)
+        logging.info("Connected by %s", player.peer())
+        self.join(player)
+        await self.serve_player(player)
+
+    async def handle_spectator(self, reader, writer):
+        """
+        Serves a connection to the spectator port, where clients do not get
+        paired and send "watch <game id>" to follow a game
+        """
+        await self.serve_player(Player(reader, writer))
+
+    async def adopt_spectator(self, sock):
+        """
+        Serves a spectator socket accepted by another process
+        """
+        reader, writer = await asyncio.open_connection(sock=sock)
+        await self.handle_spectator(reader, writer)
+
+    async def adopt_game(self, game_id, white_sock, black_sock, time_control=None):
+        """
+        Starts a game on two sockets accepted and paired by another process
+
+        Arguments:
+            game_id: id given to the game by the dispatcher
+            white_sock, black_sock: connected sockets of the two players
+            time_control: TimeControl of the game, None for the server's
+        """
+        players = []
+        for sock in (white_sock, black_sock):
+            reader, writer = await asyncio.open_connection(sock=sock)
+            players.append(Player(reader, writer))
+        self.start_game(game_id, *players, time_control)
+        await asyncio.gather(*(self.serve_player(player) for player in players))
+
+    async def serve_player(self, player):
+        """
+        Answers a player's requests until it disconnects or its game ends.
+        Every request already received is answered before replies are sent,
+        so pipelined requests cost one write.
+        """
+        reader, writer = player.reader, player.writer
+        buffer = b""
+        if STATS.enabled:
+            STATS.count("connections")
+        try:
             while True:
-                data = conn.recv(1024)
+                data = await reader.read(READ_SIZE)
                 if not data:
+                    #the client closed or half-closed its side, replies still go out
+                    break
+                timed = STATS.enabled
+                if timed:
+                    STATS.count("bytes_received", amount=len(data))
+                buffer += data
+                if player.game:
+                    self.games.touch(player.game)
+                replies = []
+                start = 0
+                while not (player.game and player.game.outcome()):
+                    if timed:
+                        began = clock()
+                    #the protocol is looked up each time as a request can switch it
+                    request, start = player.protocol.next_request(buffer, start)
+                    if request is INCOMPLETE:
+                        break
+                    if timed:
+                        STATS.observe(PARSE, clock() - began)
+                        STATS.count("requests", request_kind(request))
+                    profiler = self.profiler
+                    if profiler is not None and profiler.covers(player.game):
+                        replies.append(profiler.run(self.handle_request, player, request))
+                    else:
+                        replies.append(self.handle_request(player, request))
+                buffer = buffer[start:]
+                if len(buffer) > MAX_LINE:
+                    raise ValueError("request too long")
+                if timed:
+                    began = clock()
+                player.send(b"".join(replies))
+                if timed:
+                    STATS.observe(WRITE, clock() - began)
+                if player.game:
+                    #the board may have been rebuilt, its size changed
+                    self.games.touch(player.game)
+                if timed:
+                    began = clock()
+                await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+                if timed:
+                    STATS.observe(DRAIN, clock() - began)
+                if player.game and player.game.outcome():
                     break
-                conn.sendall(data)
+        except (ConnectionError, ValueError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.leave(player)
+            writer.close()
+        logging.info("Disconnected %s", player.peer())
+
+    def handle_request(self, player, request):
+        """
+        Runs one decoded request from a player and returns the encoded reply.
+        A successful move is also sent to the opponent in its own protocol.
+        """
+        protocol = player.protocol
+        if request is None:
+            return protocol.status(INVALID_REQUEST)
+        if request == SWITCH_TO_BINARY:
+            player.protocol = BINARY
+            return protocol.status(BINARY_ON)
+        if request == SHOW_STATS:
+            return protocol.stats(self.stats_text())
+        game = player.game
+        if request[0] == WATCH:
+            return self.watch(player, request[1])
+        if request[0] == RESUME:
+            return self.resume(player, *request[1:])
+        if request[0] == SEEK:
+            if game is not None:
+                return protocol.status(INVALID_REQUEST)
+            try:
+                time_control = request[2] and TimeControl.parse(request[2])
+            except ValueError:
+                return protocol.status(INVALID_REQUEST)
+            return self.seek(player, request[1], time_control)
+        if game is None:
+            return protocol.status(WAITING)
+        if request == DISPLAY_BOARD:
+            return protocol.board(game.position())
+        if request[0] == DELTA:
+            return protocol.delta(game.position(), request[1])
+        if request == SHOW_CLOCK:
+            return self.show_clock(player, game)
+        if player.color is None:
+            return protocol.status(SPECTATOR)
+        if game.to_move() != player.color:
+            return protocol.status(NOT_YOUR_TURN)
+        if game.clock is not None and game.clock.left(player.color, self.timers.clock()) <= 0:
+            #the flag fell since the last tick of the timer wheel
+            self.flag_fell(game)
+            return b""
+        if game.book is not None:
+            reply = self.play_book_move(player, game, request)
+            if reply is not None:
+                return reply
+        board = game.board
+        timed = STATS.enabled
+        if timed:
+            began = clock()
+        moved = board.move_piece(*request)
+        if timed:
+            STATS.observe(MOVE, clock() - began)
+        if not moved:
+            return protocol.status(INVALID_MOVE)
+        self.record_move(game, board)
+        if timed:
+            began = clock()
+        move = board.move_history[-1]
+        reply = protocol.move(move, own=True)
+        opponent = game.opponent(player)
+        if opponent is None:
+            pass #a recovered game whose other player has not resumed yet
+        elif opponent.protocol is protocol and protocol.shared_move_reply:
+            opponent.send(reply)
+        else:
+            opponent.send(opponent.protocol.move(move, own=False))
+        game.broadcast(move)
+        if timed:
+            STATS.observe(REPLY, clock() - began)
+        if board.outcome:
+            self.end_game(game)
+            if opponent is not None:
+                opponent.writer.close()
+            game.close_spectators()
+        return reply
+
+    def record_move(self, game, position):
+        """
+        Logs a move played on a Board or CompactBoard, hands the clock over
+        and counts it for the profiler
+        """
+        if self.game_log:
+            self.game_log.moved(game.game_id, position)
+        if game.clock is not None and not position.outcome:
+            game.clock.press(self.timers.clock())
+            self.set_flag_timer(game)
+        if self.profiler is not None and self.profiler.covers(game):
+            self.profiler.moved()
+
+    def play_book_move(self, player, game, move):
+        """
+        Plays a move that stays in the opening book without a Board: the game
+        moves on to the snapshot of the next book position and the replies
+        are the ones built with it
+
+        Returns:
+            the reply to the player, None if the move leaves the book
+        """
+        node = game.book.child(move)
+        if node is None:
+            return None
+        game.book = node
+        game.compact_board = node.snapshot
+        if STATS.enabled:
+            STATS.count("book_moves")
+        self.record_move(game, node.snapshot)
+        opponent = game.opponent(player)
+        if opponent is not None:
+            opponent.send(node.replies[opponent.protocol][1])
+        game.broadcast(node.move, node.updates)
+        return node.replies[player.protocol][0]
+
+    def stats_text(self):
+        """
+        Returns the collected stats and the state of the server in the
+        Prometheus text format, followed by "# EOF"
+        """
+        gauges = {
+            "games": len(self.games),
+            "board_bytes": self.games.resident_bytes,
+            "stats_enabled": int(STATS.enabled),
+            "move_cache_entries": len(MOVE_CACHE),
+        }
+        totals = {("move_cache_lookups", 'result="hit"'): MOVE_CACHE.hits,
+                  ("move_cache_lookups", 'result="miss"'): MOVE_CACHE.misses}
+        return STATS.render(gauges, totals) + "# EOF\n"
+
+    async def handle_stats(self, reader, writer):
+        """
+        Answers a request to the stats port with the stats over HTTP, for
+        scrapers such as Prometheus
+        """
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), WRITE_TIMEOUT)
+            body = self.stats_text().encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_admin(self, reader, writer):
+        """
+        Answers commands on the admin port, one per line:
+            profile <game id>[,<game id>...] <count> moves|seconds [sampling]
+              profiles the games until count of their moves were played or
+              count seconds passed, then replies with the path of the report
+            profile stop
+              ends the running profile early
+        """
+        try:
+            while True:
+                msg = (await reader.readline()).decode(errors="replace").strip()
+                if not msg:
+                    break
+                if msg == "profile stop":
+                    if self.profiler is not None:
+                        self.profiler.finish()
+                    continue
+                command = parse_profile_command(msg)
+                if command is None:
+                    writer.write(TEXT.status(INVALID_REQUEST))
+                    continue
+                if self.profiler is not None:
+                    writer.write(b"Already profiling\n")
+                    continue
+                game_ids, moves, seconds, sampling = command
+                self.profiler = GameProfiler(game_ids, moves, seconds, sampling,
+                                             self.profile_dir)
+                done = self.profiler.start()
+                writer.write(f"Profiling games {','.join(map(str, game_ids))}\n".encode())
+                await writer.drain()
+                try:
+                    path = await done
+                finally:
+                    self.profiler = None
+                writer.write(f"Profile written to {path}\n".encode())
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def watch(self, player, game_id):
+        """
+        Subscribes a client that is not in a game to the updates of a game
+        """
+        if player.game is not None:
+            return player.protocol.status(INVALID_REQUEST)
+        game = self.games.get(game_id)
+        if game is None:
+            return player.protocol.status(NO_SUCH_GAME)
+        self.matchmaker.cancel(player)
+        self.games.touch(game)
+        player.game = game
+        game.spectators.add(player)
+        return player.protocol.watching(game_id, game.position())
+
+    def resume(self, player, game_id, color):
+        """
+        Seats a client that is not in a game as a player of a recovered game
+        whose seat for that color is empty
+        """
+        if player.game is not None:
+            return player.protocol.status(INVALID_REQUEST)
+        game = self.games.get(game_id)
+        if game is None:
+            return player.protocol.status(NO_SUCH_GAME)
+        if game.players[color] is not None:
+            return player.protocol.status(INVALID_REQUEST)
+        self.matchmaker.cancel(player)
+        self.games.touch(game)
+        game.seat(player, color)
+        return player.protocol.resumed(game_id, color, game.position())
+
+    def join(self, player):
+        """
+        Queues a client connecting to the player port, unrated and with the
+        server's time control
+        """
+        player.send(self.seek(player))
+
+    def seek(self, player, rating=None, time_control=None):
+        """
+        Pairs a client that is not in a game with a waiting client of the same
+        time control and, if rated, a close rating, or makes it wait. The
+        client that waited plays white.
+
+        Arguments:
+            rating: int rating, None to play any unrated client
+            time_control: TimeControl, None for the server's
+
+        Returns:
+            the reply to the client, empty if the game started
+        """
+        time_control = time_control or self.time_control
+        opponent = self.matchmaker.seek(player, rating,
+                                        time_control and str(time_control))
+        if opponent is None:
+            return player.protocol.status(WAITING)
+        self.games_started += 1
+        self.start_game(self.games_started, opponent, player, time_control)
+        return b""
+
+    def start_game(self, game_id, white, black, time_control=None):
+        """
+        Starts a game between two clients, under time_control or if None the
+        server's time control
+        """
+        book = self.opening_book.root if self.opening_book else None
+        game = Game(game_id, white, black, book=book)
+        self.games[game_id] = game
+        time_control = time_control or self.time_control
+        if time_control is not None:
+            if self.timers is None:
+                self.timers = TimerWheel(loop=asyncio.get_running_loop())
+            game.clock = GameClock(time_control, self.timers.clock())
+            self.set_flag_timer(game)
+        if STATS.enabled:
+            STATS.count("games_started")
+        if self.game_log:
+            self.game_log.game_started(game_id)
+        for color, name in ((WHITE, "white"), (BLACK, "black")):
+            player = game.players[color]
+            player.send(player.protocol.game_started(game_id, name, game.position()))
+
+    def leave(self, player):
+        self.matchmaker.cancel(player)
+        game = player.game
+        if game is not None and player.color is None:
+            game.spectators.discard(player)
+        elif game is not None and game.game_id in self.games:
+            self.end_game(game)
+            opponent = game.opponent(player)
+            if opponent is not None:
+                opponent.send(opponent.protocol.status(OPPONENT_LEFT))
+                opponent.writer.close()
+            game.close_spectators(PLAYER_LEFT)
+
+    def end_game(self, game):
+        del self.games[game.game_id]
+        if game.clock is not None and game.clock.timer is not None:
+            self.timers.cancel(game.clock.timer)
+            game.clock.timer = None
+        if STATS.enabled:
+            STATS.count("games_ended")
+        if self.game_log:
+            self.game_log.game_ended(game.game_id)
+
+    def set_flag_timer(self, game):
+        """
+        Sets the flag-fall timer of the side to move, replacing the timer of
+        the side that just moved
+        """
+        clock = game.clock
+        if clock.timer is not None:
+            self.timers.cancel(clock.timer)
+        clock.timer = self.timers.schedule(clock.deadline(), self.flag_fell, game)
+
+    def flag_fell(self, game):
+        """
+        Ends a game lost on time by the side to move, telling the players and
+        spectators
+        """
+        if self.games.get(game.game_id) is not game:
+            return
+        game.clock.timer = None
+        loser = game.clock.running
+        self.end_game(game)
+        if STATS.enabled:
+            STATS.count("flags_fallen")
+        for player in [*game.players.values(), *game.spectators]:
+            if player is not None:
+                player.send(player.protocol.time_out(loser))
+                player.writer.close()
+        game.spectators.clear()
+
+    def show_clock(self, player, game):
+        """
+        Returns the time left of both players of a game, an invalid request
+        for untimed games
+        """
+        if game.clock is None:
+            return player.protocol.status(INVALID_REQUEST)
+        now = self.timers.clock()
+        return player.protocol.clock(game.clock.left(WHITE, now),
+                                     game.clock.left(BLACK, now))
+
+
+def connected(player):
+    return not player.writer.is_closing()
+
+def request_kind(request):
+    """
+    Returns the Prometheus label of the kind of a decoded request
+    """
+    if request is None:
+        return 'kind="invalid"'
+    if isinstance(request, str):
+        return f'kind="{request}"'
+    if isinstance(request[0], str):
+        return f'kind="{request[0]}"'
+    return 'kind="move"'
+
+def raise_open_file_limit():
+    """
+    Raises the soft limit on open files to the hard limit so one process can
+    hold tens of thousands of sockets
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            logging.warning("Could not raise open file limit above %s", soft)
+            return
+    logging.debug("Open file limit %s", hard)
+
+def load_book(paths):
+    """
+    Returns the OpeningBook of files and directories, None without paths
+    """
+    if not paths:
+        return None
+    book = OpeningBook.from_files(paths)
+    logging.info("Opening book of %s lines", book.line_count)
+    return book
+
+async def serve(host=HOST, port=PORT, spectator_port=SPECTATOR_PORT, log_path=None,
+                memory_budget=None, stats_port=None, admin_port=None, time_control=None,
+                book_paths=None):
+    game_server = GameServer(game_log=GameLog(log_path) if log_path else None,
+                             memory_budget=memory_budget, time_control=time_control,
+                             opening_book=load_book(book_paths))
+    if log_path:
+        game_server.restore_games()
+        sync = asyncio.ensure_future(game_server.sync_log())
+    server = await game_server.start(host, port)
+    spectator_server = await asyncio.start_server(game_server.handle_spectator,
+        host, spectator_port, backlog=BACKLOG, reuse_address=True)
+    servers = [server, spectator_server]
+    if stats_port is not None:
+        STATS.enable()
+        servers.append(await asyncio.start_server(game_server.handle_stats,
+            host, stats_port, reuse_address=True))
+        logging.info("Serving stats on %s:%s", host, stats_port)
+    if admin_port is not None:
+        servers.append(await asyncio.start_server(game_server.handle_admin,
+            ADMIN_HOST, admin_port, reuse_address=True))
+        logging.info("Admin commands on %s:%s", ADMIN_HOST, admin_port)
+    logging.info("Listening on %s:%s, spectators on %s", host, port, spectator_port)
+    try:
+        await asyncio.gather(*(listener.serve_forever() for listener in servers))
+    finally:
+        if game_server.game_log:
+            game_server.game_log.close()
+        game_server.games.close()
+
+def run(host=HOST, port=PORT, workers=1, spectator_port=SPECTATOR_PORT, log_path=None,
+        memory_budget=None, stats_port=None, admin_port=None, time_control=None,
+        book_paths=None):
+    """
+    Runs the server until interrupted, on one process or sharded over workers.
+    With log_path the games are logged to that file and recovered on startup,
+    which needs a single process. memory_budget is the bytes of boards each
+    process keeps in memory before spilling idle games to disk. stats_port
+    turns on stats collection and serves them on that port; with workers each
+    worker collects its own, answered by the stats command, and the port is
+    not served. admin_port takes profiling commands on localhost, with a
+    single process. time_control is the TimeControl of every game, None for
+    untimed games. book_paths are the files of the opening book, read by each
+    process.
+    """
+    raise_open_file_limit()
+    if workers > 1 and log_path:
+        raise ValueError("the game log needs a single process")
+    if workers > 1:
+        from src.chess_server.sharding import Dispatcher
+        if stats_port is not None:
+            logging.warning("The stats port needs a single process, use the stats command")
+        if admin_port is not None:
+            logging.warning("The admin port needs a single process")
+        dispatcher = Dispatcher(workers, memory_budget, stats_port is not None,
+                                time_control, book_paths)
+        main = dispatcher.serve(host, port, spectator_port)
+    else:
+        main = serve(host, port, spectator_port, log_path, memory_budget, stats_port,
+                     admin_port, time_control, book_paths)
+    try:
+        asyncio.run(main)
+    except KeyboardInterrupt:
+        pass
 
 def run_local():
     board = Board()
@@ -49,6 +808,8 @@ def run_local():
             move = msg_to_move(msg)
             reply = move_piece(board, move)
             send_reply(reply)
+            if board.outcome:
+                break
 
 def get_msg():
     return input()
@@ -62,7 +823,3 @@ def move_piece(board, move):
         return write_msg(board.move_history[-1])
     else:
         return "Invalid Move"
-
-if __name__ == "__main__":
-    #run_local()
-    run()
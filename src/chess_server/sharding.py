@@ -0,0 +1,357 @@
+#runs games on several worker processes so engine work uses every core
+#a dispatcher accepts and pairs connections, then passes both sockets of a
+#game to the worker that owns the game id on a consistent hash ring.
+#Spectators are passed to the worker owning the game they ask to watch, and
+#clients sending a seek there are paired by the dispatcher like players.
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import socket
+
+from src.chess_server.server import (GameServer, BACKLOG, HOST, PORT,
+    SPECTATOR_PORT, MAX_LINE, load_book)
+from src.chess_server.protocol import (TEXT, WAITING, WATCH, SEEK, INVALID_REQUEST,
+    OPPONENT_LEFT)
+from src.chess_server.clock import TimeControl
+from src.chess_server.matchmaking import Matchmaker
+from src.chess_server.stats import STATS
+
+REPLICAS = 100 #points each worker owns on the hash ring
+HANDOFF_SIZE = 32 #bytes read per handoff message: game id and time control
+MONITOR_INTERVAL = 0.5 #seconds between checks for crashed workers
+SPECTATOR_HANDOFF = b"spectator" #handoff message of a spectator socket
+FIRST_LINE_TIMEOUT = 10 #seconds a spectator has to send its watch or seek request
+HANDOFF_TIMEOUT = 5 #seconds a handoff waits for room on a worker channel
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping game ids to workers. Every worker owns many
+    points on the ring, so games spread evenly and adding or removing a worker
+    only moves the games of the points it gains or loses.
+    """
+    def __init__(self, nodes=(), replicas=REPLICAS):
+        self.replicas = replicas
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = _ring_hash(f"{node}:{replica}")
+            i = bisect.bisect(self.points, point)
+            self.points.insert(i, point)
+            self.owners.insert(i, node)
+
+    def remove(self, node):
+        kept = [(p, o) for p, o in zip(self.points, self.owners) if o != node]
+        self.points = [p for p, _ in kept]
+        self.owners = [o for _, o in kept]
+
+    def lookup(self, key):
+        """
+        Returns the node owning key, the first point clockwise of its hash
+        """
+        i = bisect.bisect(self.points, _ring_hash(str(key)))
+        return self.owners[i % len(self.points)]
+
+
+def worker_main(channel, memory_budget=None, collect_stats=False, time_control=None,
+                book_paths=None):
+    """
+    Entry point of a worker process, plays the games handed over on channel
+    """
+    STATS.enable(collect_stats)
+    try:
+        asyncio.run(_worker(channel, memory_budget, time_control, book_paths))
+    except KeyboardInterrupt:
+        pass
+
+async def _worker(channel, memory_budget, time_control, book_paths):
+    loop = asyncio.get_running_loop()
+    game_server = GameServer(memory_budget=memory_budget, time_control=time_control,
+                             opening_book=load_book(book_paths))
+    tasks = set()
+    closed = loop.create_future()
+    channel.setblocking(False)
+
+    def receive_game():
+        try:
+            msg, fds, _, _ = socket.recv_fds(channel, HANDOFF_SIZE, 2)
+        except BlockingIOError:
+            return
+        if not msg:
+            #the dispatcher is gone
+            loop.remove_reader(channel.fileno())
+            closed.set_result(None)
+            return
+        if msg == SPECTATOR_HANDOFF:
+            serve = game_server.adopt_spectator(socket.socket(fileno=fds[0]))
+        else:
+            white, black = (socket.socket(fileno=fd) for fd in fds)
+            game_id, _, time_control = msg.decode().partition(" ")
+            serve = game_server.adopt_game(
+                int(game_id), white, black,
+                TimeControl.parse(time_control) if time_control else None)
+        task = loop.create_task(serve)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    loop.add_reader(channel.fileno(), receive_game)
+    try:
+        await closed
+    finally:
+        game_server.games.close()
+
+
+class Dispatcher:
+    """
+    Accepts connections, pairs them into games in arrival order and hands each
+    game to the worker process that owns it. A crashed worker only takes its
+    own games down and is restarted in the same place on the ring.
+    """
+    def __init__(self, workers, memory_budget=None, collect_stats=False,
+                 time_control=None, book_paths=None):
+        """
+        Arguments:
+            workers: number of worker processes
+            memory_budget: bytes of boards each worker keeps in memory
+            collect_stats: turn on stats collection in the workers
+            time_control: TimeControl of new games, None for untimed games
+            book_paths: files of the opening book, read by every worker
+        """
+        self.memory_budget = memory_budget
+        self.collect_stats = collect_stats
+        self.time_control = time_control
+        self.book_paths = book_paths
+        self.ring = HashRing(range(workers))
+        self.workers = {}
+        self.matchmaker = Matchmaker(alive=_waiting_alive)
+        self.games_started = 0
+        self.routing = set() #spectators waiting to be routed
+        self.context = multiprocessing.get_context("spawn")
+        for index in range(workers):
+            self.spawn(index)
+
+    def spawn(self, index):
+        channel, worker_channel = socket.socketpair(socket.AF_UNIX,
+                                                    socket.SOCK_SEQPACKET)
+        process = self.context.Process(
+            target=worker_main, name=f"chess-worker-{index}", daemon=True,
+            args=(worker_channel, self.memory_budget, self.collect_stats,
+                  self.time_control, self.book_paths))
+        process.start()
+        worker_channel.close()
+        channel.setblocking(False)
+        self.workers[index] = (process, channel)
+
+    def restart_dead_workers(self):
+        for index, (process, channel) in list(self.workers.items()):
+            if not process.is_alive():
+                logging.warning("Worker %s exited with code %s, restarting",
+                                index, process.exitcode)
+                channel.close()
+                self.spawn(index)
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            self.restart_dead_workers()
+
+    async def start(self, host=HOST, port=PORT, spectator_port=SPECTATOR_PORT):
+        """
+        Starts accepting connections, returns the player and spectator
+        listening sockets
+        """
+        listeners = []
+        for listen_port in (port, spectator_port):
+            listener = socket.create_server((host, listen_port), backlog=BACKLOG)
+            listener.setblocking(False)
+            listeners.append(listener)
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self.accept(listeners[0], self.join)),
+                      loop.create_task(self.accept(listeners[1], self.route_spectator)),
+                      loop.create_task(self.monitor())]
+        return listeners
+
+    async def serve(self, host=HOST, port=PORT, spectator_port=SPECTATOR_PORT):
+        listeners = await self.start(host, port, spectator_port)
+        logging.info("Listening on %s:%s, spectators on %s, with %s workers",
+                     host, port, spectator_port, len(self.workers))
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            for listener in listeners:
+                listener.close()
+            self.close()
+
+    async def accept(self, listener, handle):
+        loop = asyncio.get_running_loop()
+        while True:
+            sock, addr = await loop.sock_accept(listener)
+            logging.info("Connected by %s", addr)
+            result = handle(sock)
+            if asyncio.iscoroutine(result):
+                task = loop.create_task(result)
+                self.routing.add(task)
+                task.add_done_callback(self.routing.discard)
+
+    async def route_spectator(self, sock):
+        """
+        Passes a spectator to the worker owning the game it asks to watch.
+        The watch request is peeked at, not read, so the worker answers it.
+        A seek request is read here and the client queued for a game.
+        """
+        queued = False
+        try:
+            line = await asyncio.wait_for(_peek_line(sock), FIRST_LINE_TIMEOUT)
+            request, end = TEXT.next_request(line, 0)
+            if isinstance(request, tuple) and request[0] == SEEK:
+                sock.recv(end)
+                try:
+                    time_control = request[2] and TimeControl.parse(request[2])
+                except ValueError:
+                    sock.send(TEXT.status(INVALID_REQUEST))
+                    return
+                queued = True
+                await self.seek(sock, request[1], time_control)
+                return
+            if not (isinstance(request, tuple) and request[0] == WATCH):
+                sock.send(TEXT.status(INVALID_REQUEST))
+                return
+            index = self.ring.lookup(request[1])
+            if not await self.send_to_worker(index, SPECTATOR_HANDOFF, [sock.fileno()]):
+                sock.send(TEXT.status(INVALID_REQUEST))
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            if not queued:
+                sock.close()
+
+    def join(self, sock):
+        return self.seek(sock)
+
+    async def seek(self, sock, rating=None, time_control=None):
+        """
+        Pairs a client with a waiting one as GameServer.seek does, handing
+        the game to its worker, or makes it wait
+        """
+        time_control = time_control or self.time_control
+        opponent = self.matchmaker.seek(sock, rating, time_control and str(time_control))
+        if opponent is None:
+            try:
+                sock.send(TEXT.status(WAITING))
+            except OSError:
+                self.matchmaker.cancel(sock)
+                sock.close()
+            return
+        self.games_started += 1
+        await self.hand_off(self.games_started, opponent, sock, time_control)
+
+    async def hand_off(self, game_id, white, black, time_control=None):
+        """
+        Passes the sockets of a game to its worker and closes them here,
+        telling the players their game is over if the worker cannot take it
+        """
+        index = self.ring.lookup(game_id)
+        msg = f"{game_id} {time_control}" if time_control else str(game_id)
+        try:
+            if not await self.send_to_worker(index, msg.encode(),
+                                             [white.fileno(), black.fileno()]):
+                logging.warning("Worker %s did not take game %s", index, game_id)
+                for sock in (white, black):
+                    try:
+                        sock.send(TEXT.status(OPPONENT_LEFT))
+                    except OSError:
+                        pass
+        finally:
+            white.close()
+            black.close()
+
+    async def send_to_worker(self, index, msg, fds):
+        """
+        Passes file descriptors to a worker without blocking the event loop,
+        trying again once if the worker died since the last check
+
+        Returns:
+            True if the worker got them, False if not
+        """
+        for attempt in range(2):
+            try:
+                await asyncio.wait_for(_send_fds(self.workers[index][1], msg, fds),
+                                       HANDOFF_TIMEOUT)
+                return True
+            except (OSError, asyncio.TimeoutError):
+                self.restart_dead_workers()
+        return False
+
+    def close(self):
+        for task in [*getattr(self, "tasks", ()), *self.routing]:
+            task.cancel()
+        for process, channel in self.workers.values():
+            channel.close()
+            process.terminate()
+        for process, _ in self.workers.values():
+            process.join()
+
+
+def _waiting_alive(sock):
+    """
+    Returns True if a waiting client is still connected, closing it if not
+    """
+    if _peer_closed(sock):
+        sock.close()
+        return False
+    return True
+
+def _peer_closed(sock):
+    """
+    Returns True if a waiting client has already disconnected
+    """
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+async def _send_fds(channel, msg, fds):
+    """
+    Sends file descriptors on a non-blocking channel, waiting on the event
+    loop while the channel is full
+    """
+    loop = asyncio.get_running_loop()
+    fd = channel.fileno()
+    while True:
+        try:
+            socket.send_fds(channel, [msg], fds)
+            return
+        except BlockingIOError:
+            pass
+        writable = loop.create_future()
+        loop.add_writer(fd, lambda: writable.done() or writable.set_result(None))
+        try:
+            await writable
+        finally:
+            loop.remove_writer(fd)
+
+async def _peek_line(sock):
+    """
+    Returns the data waiting on a socket once it holds a whole line, without
+    reading it off the socket
+    """
+    while True:
+        try:
+            data = sock.recv(MAX_LINE, socket.MSG_PEEK)
+            if not data or b"\n" in data or len(data) >= MAX_LINE:
+                return data
+        except BlockingIOError:
+            pass
+        await asyncio.sleep(0.01)
@@ -0,0 +1,119 @@
+#Counters and latency histograms of the server, rendered in the Prometheus
+#text format for the stats command and the stats port. Collection is off
+#until enabled: instrumented code checks STATS.enabled before reading the
+#clock, so when off each instrumented spot costs one attribute lookup.
+import bisect
+import time
+
+#histogram upper bounds in seconds, 1us doubling up to about 1s
+BUCKETS = tuple(2**i / 1e6 for i in range(21))
+PREFIX = "chess_"
+
+#phases of a request timed in the phase_seconds histogram
+PARSE = "parse" #decoding a request from the read buffer
+MOVE = "move" #Board.move_piece, validation including check detection
+CHECK = "check" #the check, checkmate/stalemate and draw tests of a move
+REPLY = "reply" #encoding the replies to a move and queueing them on the sockets
+WRITE = "write" #queueing a batch of replies on the client socket
+DRAIN = "drain" #waiting for the client to read its replies
+
+clock = time.perf_counter
+
+
+class Histogram:
+    """
+    Counts of observations per bucket of BUCKETS, plus their count and sum
+    """
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) #last one is above every bound
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q quantile (0-1),
+        inf if above every bound and 0 with no observations
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0.0
+
+
+class Stats:
+    """
+    Counters and phase histograms, shared by everything in a process
+    """
+    def __init__(self):
+        self.enabled = False
+        self.counters = {} #(name, labels) -> value
+        self.histograms = {} #phase -> Histogram
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def count(self, name, labels="", amount=1):
+        """
+        Adds to a counter
+
+        Arguments:
+            name: metric name without prefix, eg. "requests"
+            labels: Prometheus labels, eg. 'kind="move"'
+        """
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, phase, seconds):
+        histogram = self.histograms.get(phase)
+        if histogram is None:
+            histogram = self.histograms[phase] = Histogram()
+        histogram.observe(seconds)
+
+    def render(self, gauges=None, totals=None):
+        """
+        Returns the metrics in the Prometheus text format
+
+        Arguments:
+            gauges: dict of gauge name -> current value, eg. open games
+            totals: dict of (name, labels) -> value of counters kept outside
+                the stats, rendered with them, eg. cache hits
+        """
+        lines = []
+        for name, value in sorted((gauges or {}).items()):
+            lines += [f"# TYPE {PREFIX}{name} gauge", f"{PREFIX}{name} {value}"]
+        last = None
+        for (name, labels), value in sorted({**self.counters, **(totals or {})}.items()):
+            if name != last:
+                lines.append(f"# TYPE {PREFIX}{name}_total counter")
+                last = name
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{PREFIX}{name}_total{labels} {value}")
+        if self.histograms:
+            metric = f"{PREFIX}phase_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+        for phase, histogram in sorted(self.histograms.items()):
+            seen = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                seen += count
+                lines.append(f'{metric}_bucket{{phase="{phase}",le="{bound:g}"}} {seen}')
+            lines.append(f'{metric}_bucket{{phase="{phase}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{metric}_sum{{phase="{phase}"}} {histogram.total:.9f}')
+            lines.append(f'{metric}_count{{phase="{phase}"}} {histogram.count}')
+        return "".join(line + "\n" for line in lines)
+
+
+STATS = Stats()
@@ -0,0 +1,42 @@
+import asyncio
+
+from src.chess_client.client import LoadGenerator, LoadResult, quantile, text_playable
+from src.chess_server.games import read_moves, read_pgn
+from src.chess_server.server import GameServer
+
+SCHOLARS_MATE = read_pgn("1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0")[0]
+OPENING = read_moves("d2-d4\nd7-d5\nc2-c4\ne7-e6\n")
+
+def run_load(binary, **options):
+    async def main():
+        game_server = GameServer()
+        server = await game_server.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            generator = LoadGenerator([SCHOLARS_MATE, OPENING], port=port,
+                                      binary=binary, **options)
+            return await generator.run()
+    return asyncio.run(main())
+
+def test_quantile_nearest_rank():
+    latencies = [i / 1000 for i in range(1, 1001)]
+    assert quantile(latencies, 0.5) == 0.5
+    assert quantile(latencies, 0.999) == 0.999
+    assert quantile([], 0.99) == 0.0
+
+def test_text_playable_cuts_underpromotion():
+    moves = [((1, 2), (1, 4), None), ((1, 7), (1, 8), "C")]
+    assert text_playable(moves) == moves[:1]
+
+def test_load_generator_text():
+    result = run_load(False, connections=4, duration=0.5, warmup=0.1)
+    summary = result.summary()
+    assert summary["moves"] > 0 and summary["errors"] == 0
+    assert summary["p50_ms"] <= summary["p99_ms"] <= summary["p999_ms"]
+    assert result.games >= 2
+
+def test_load_generator_binary_holds_rate():
+    result = run_load(True, connections=2, rate=100, duration=0.5, warmup=0.1)
+    assert result.errors == 0
+    assert isinstance(result, LoadResult)
+    assert 40 <= result.summary()["moves"] <= 51
@@ -0,0 +1,35 @@
+import itertools
+
+from src.chess_client.validate import validate_files, validate_games
+
+GAMES = [("opening", ["e2-e4", "e7-e5", "g1-f3"], False),
+         ("fools mate", ["f3", "e5", "g4", "Qh4#"], True),
+         ("illegal", ["e4", "e5", "Ke3"], True),
+         ("after mate", ["f2-f3", "e7-e5", "g2-g4", "d8-h4", "a2-a3"], False)]
+
+def test_reports_first_illegal_move_and_final_state():
+    reports = list(validate_games(GAMES, workers=1))
+    assert [report.name for report in reports] == [name for name, _, _ in GAMES]
+    assert reports[0].valid() and reports[0].to_move == "black"
+    assert reports[0].position[6] == " " and reports[0].position[21] == "C"
+    assert reports[1].valid() and reports[1].outcome == "checkmate"
+    assert reports[2].illegal[:2] == (3, "Ke3") and reports[2].moves == 2
+    assert reports[3].illegal[0] == 5 and "over" in reports[3].illegal[2]
+
+def test_pool_keeps_order():
+    games = GAMES * 20
+    pooled = [report.summary() for report in validate_games(games, workers=2, batch_size=3)]
+    assert pooled == [report.summary() for report in validate_games(games, workers=1)]
+
+def test_streams_games():
+    endless = itertools.cycle(GAMES)
+    reports = itertools.islice(validate_games(endless, workers=2, batch_size=2), 10)
+    assert len(list(reports)) == 10
+
+def test_validate_files(tmp_path):
+    (tmp_path / "a.pgn").write_text('[Event "1"]\n\n1. e4 e5 *\n\n[Event "2"]\n\n'
+                                    '1. e4 {comment\nover lines} Ke7 1-0\n')
+    (tmp_path / "b").write_text("d2-d4\nd7-d5\n")
+    reports = list(validate_files([str(tmp_path)], workers=1))
+    assert [report.name.rsplit("/", 1)[1] for report in reports] == ["a.pgn#1", "a.pgn#2", "b"]
+    assert [report.valid() for report in reports] == [True, False, True]
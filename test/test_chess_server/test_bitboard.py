@@ -0,0 +1,81 @@
+import random
+
+from src.chess_server.engine import BLACK, WHITE, Board, Piece, create_board, load_fens
+from src.chess_server.bitboard import BitBoard, square_index, index_to_square
+from src.chess_server.parser import msg_to_move
+
+def test_create_board_representations():
+    assert isinstance(create_board(), Board)
+    assert isinstance(create_board("bitboard"), BitBoard)
+
+def test_square_index_round_trip():
+    assert square_index((1, 1)) == 0
+    assert square_index((8, 8)) == 63
+    assert all(square_index(index_to_square(i)) == i for i in range(64))
+
+def test_same_starting_board():
+    assert BitBoard().display_board() == Board().display_board()
+
+def test_bitboard_castling_and_check():
+    board = BitBoard()
+    for move in [((5, 2), (5, 4)), ((1, 7), (1, 6)), ((6, 1), (2, 5)),
+                 ((6, 7), (6, 6)), ((4, 1), (8, 5))]:
+        assert board.move_piece(*move)
+    assert board.move_history[-1][5]
+    assert board.king_in_check(BLACK)
+    assert not board.move_piece((5, 8), (6, 7)) #into check
+    assert board.move_piece((7, 7), (7, 6))
+    assert board.move_piece((7, 1), (6, 3))
+    assert board.move_piece((5, 7), (5, 5))
+    assert board.move_piece((5, 1), (7, 1))
+    assert board.piece_at((7, 1)) == "K"
+    assert board.piece_at((6, 1)) == "R"
+
+def _random_game_matches(seed, plies):
+    rng = random.Random(seed)
+    dict_board = create_board("dict")
+    bit_board = create_board("bitboard")
+    for _ in range(plies):
+        color = WHITE if dict_board.last_moved_color == BLACK else BLACK
+        candidates = sorted((piece.pos, to_pos)
+            for piece in list(dict_board.board.values()) if piece.color == color
+            for to_pos in piece.list_moves() if Piece._in_bounds(to_pos))
+        if not candidates:
+            break
+        #also throw in arbitrary moves, which both engines should reject
+        move = rng.choice(candidates + [((rng.randint(1, 8), rng.randint(1, 8)),
+                                         (rng.randint(1, 8), rng.randint(1, 8)))])
+        assert bool(dict_board.move_piece(*move)) == bit_board.move_piece(*move)
+        assert dict_board.king_in_check(color) == bit_board.king_in_check(color)
+    assert dict_board.move_history == bit_board.move_history
+    assert dict_board.display_board() == bit_board.display_board()
+
+def test_random_games_match_dict_engine():
+    for seed in range(10):
+        _random_game_matches(seed, 80)
+
+def test_perft_matches_dict_engine():
+    dict_board = Board()
+    bit_board = BitBoard()
+    for msg in ["e2-e4", "d7-d5", "e4-e5", "f7-f5", "g1-f3", "b8-c6"]:
+        move = msg_to_move(msg)
+        assert dict_board.move_piece(*move) and bit_board.move_piece(*move)
+    assert (sorted(dict_board.legal_moves(WHITE)) ==
+            sorted(bit_board.legal_moves(WHITE)))
+    assert dict_board.perft(2) == bit_board.perft(2)
+
+def test_from_fen_matches_board():
+    fens = ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+            "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8"]
+    for bit_board, board in zip(load_fens(fens, "bitboard"), load_fens(fens)):
+        assert bit_board.to_fen() == board.to_fen()
+        assert bit_board.perft(2) == board.perft(2)
+
+def test_bad_promotion_rejected_like_board():
+    fen = "8/P6k/8/8/8/8/8/K7 w - - 0 1"
+    for representation in ("dict", "bitboard"):
+        board, = load_fens([fen], representation)
+        for promotion in ("QR", "RB", "X", "K"):
+            assert not board.move_piece((1, 7), (1, 8), promotion), representation
+        assert board.to_fen() == fen
+        assert board.move_piece((1, 7), (1, 8), "r") and board.to_fen().startswith("R7/")
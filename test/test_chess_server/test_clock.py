@@ -0,0 +1,78 @@
+import pytest
+
+from src.chess_server.clock import GameClock, TimeControl, TimerWheel
+from src.chess_server.engine import WHITE, BLACK
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_timers_fire_in_order_and_never_early():
+    wheel = TimerWheel(tick=1, slots=8, clock=FakeTime())
+    fired = []
+    for when in (5.5, 2.5, 3):
+        wheel.schedule(when, fired.append, when)
+    assert len(wheel) == 3
+    assert wheel.advance(2.9) == 0
+    assert wheel.advance(3) == 2
+    assert fired == [2.5, 3] #the same tick, in the order set
+    assert wheel.advance(5.9) == 0
+    assert wheel.advance(6) == 1
+    assert fired == [2.5, 3, 5.5] and len(wheel) == 0
+    for when in (9.9, 9.1, 9.5):
+        wheel.schedule(when, fired.append, when)
+    wheel.cancel(wheel.schedule(9.2, fired.append, 9.2))
+    assert wheel.advance(10) == 3
+    assert fired[3:] == [9.9, 9.1, 9.5]
+
+def test_far_timers_wait_their_rounds():
+    wheel = TimerWheel(tick=1, slots=8, clock=FakeTime())
+    fired = []
+    wheel.schedule(20.5, fired.append, "far") #more than two turns of the wheel
+    wheel.schedule(4.5, fired.append, "near") #same slot, this turn
+    wheel.advance(5)
+    assert fired == ["near"]
+    wheel.advance(20)
+    assert fired == ["near"]
+    wheel.advance(21)
+    assert fired == ["near", "far"]
+
+def test_cancelled_timers_do_not_fire():
+    wheel = TimerWheel(tick=1, slots=8, clock=FakeTime())
+    fired = []
+    timer = wheel.schedule(3, fired.append, 1)
+    wheel.cancel(timer)
+    wheel.cancel(timer)
+    assert len(wheel) == 0
+    assert wheel.advance(10) == 0 and fired == []
+
+def test_idle_wheel_skips_to_the_present():
+    time = FakeTime()
+    wheel = TimerWheel(tick=1, slots=8, clock=time)
+    time.now = 1000
+    fired = []
+    wheel.schedule(1001.5, fired.append, 1)
+    assert wheel.advance(1001) == 0
+    assert wheel.advance(1002) == 1
+
+def test_game_clock_increment():
+    clock = GameClock(TimeControl(60, 2), now=10.0)
+    assert clock.running == WHITE and clock.deadline() == 70.0
+    clock.press(15.0)
+    assert clock.remaining[WHITE] == 57.0
+    assert clock.running == BLACK and clock.left(BLACK, 20.0) == 55.0
+    assert clock.left(WHITE, 20.0) == 57.0
+    clock.press(25.0)
+    assert clock.remaining[BLACK] == 52.0 and clock.deadline() == 82.0
+
+def test_parse_time_control():
+    control = TimeControl.parse("5+3")
+    assert (control.base, control.increment) == (300, 3)
+    assert str(control) == "5+3"
+    assert TimeControl.parse("0.5+0").base == 30
+    for text in ("5", "0+3", "5+x", "+3"):
+        with pytest.raises(ValueError):
+            TimeControl.parse(text)
@@ -0,0 +1,113 @@
+import random
+
+from src.chess_server.engine import BLACK, WHITE, THREEFOLD_REPETITION, Board
+from src.chess_server.compact import (CompactBoard, PackedHistory, SQUARES,
+    SNAPSHOT, SNAPSHOT_PLIES, START_SNAPSHOT)
+from src.chess_server.parser import msg_to_move, tuple_to_square, write_msg
+
+def play(game, msgs):
+    for msg in msgs.split():
+        assert game.move_piece(*msg_to_move(msg)), msg
+    return game
+
+def random_game(seed, plies):
+    rng = random.Random(seed)
+    game = Board()
+    entries = []
+    for _ in range(plies):
+        color = WHITE if game.last_moved_color == BLACK else BLACK
+        moves = sorted(game.legal_moves(color), key=str)
+        if game.outcome or not moves:
+            break
+        assert game.move_piece(*rng.choice(moves))
+        entries.append(game.move_history[-1])
+    return game, entries
+
+def test_packed_history_matches_list_entries():
+    for seed in range(5):
+        game, entries = random_game(seed, 150)
+        assert list(game.move_history) == entries
+        assert game.move_history == PackedHistory(entries)
+        assert game.move_history[-2:] == entries[-2:]
+        assert [write_msg(move) for move in game.move_history] == \
+               [write_msg(move) for move in entries]
+        snapshots = len(entries) // SNAPSHOT_PLIES + 1 #the first is the start, not kept
+        assert game.move_history.nbytes() == 3 * len(entries) + snapshots * SNAPSHOT.size
+
+def test_packed_history_promotion_and_outcome():
+    history = PackedHistory()
+    history.append([1, (8, 7), "P", (7, 8), "c", True, "Q", None])
+    history.append([2, (2, 2), "p", (2, 1), None, False, "C", "stalemate"])
+    assert history[0] == [1, (8, 7), "P", (7, 8), "c", True, "Q", None]
+    assert history[-1] == [2, (2, 2), "p", (2, 1), None, False, "c", "stalemate"]
+    assert history.pop()[7] == "stalemate"
+    assert len(history) == 1 and history[-1][7] is None
+
+def test_compact_round_trip():
+    game = play(Board(), "e2-e4 g8-h6 e4-e5 a7-a6 e1-e2")
+    compact = game.compact()
+    assert isinstance(compact, CompactBoard) and len(compact.squares) == 64
+    assert compact.castling_rights() == "kq"
+    assert compact.piece_at((5, 2)).symbol == "K"
+    restored = Board.from_compact(compact)
+    assert restored.display_board() == game.display_board()
+    assert restored.zobrist_hash == game.zobrist_hash
+    assert restored.castling_rights() == "kq"
+    assert restored.move_history is game.move_history
+    #en passant and the history carry on from the restored board
+    play(restored, "d7-d5")
+    restored = Board.from_compact(restored.compact())
+    play(restored, "e5-d6")
+    assert restored.move_history[-1][4] == "p"
+
+def test_compact_keeps_repetitions():
+    game = play(Board(), "g1-f3 g8-f6 f3-g1 f6-g8 g1-f3 g8-f6")
+    game = Board.from_compact(game.compact())
+    play(game, "f3-g1 f6-g8")
+    assert game.outcome == THREEFOLD_REPETITION
+
+def test_changed_since_castling_and_en_passant():
+    game = play(Board(), "e2-e4 g8-h6 e4-e5 d7-d5")
+    version = game.version
+    play(game, "e5-d6 h6-g8 f1-e2 g8-h6 g1-f3 h6-g8 e1-g1")
+    assert game.version == version + 7
+    changed = game.changed_since(version)
+    squares = [tuple_to_square(SQUARES[index]) for index in changed]
+    #the pawn taken en passant on d5 and the rook moved when castling
+    assert {"d5", "h1", "f1"} <= set(squares)
+    symbols = game.square_symbols()
+    assert all(symbols[index] == symbol for index, symbol in changed.items())
+    assert game.changed_since(game.version) == {}
+    assert game.changed_since(-1) is None
+    assert game.compact().changed_since(version) == changed
+
+def test_compact_to_bytes_round_trip():
+    game = play(Board(), "e2-e4 g8-h6 e4-e5 d7-d5 a2-a3")
+    compact = game.compact()
+    stored = CompactBoard.from_bytes(compact.to_bytes())
+    for name in CompactBoard.__slots__:
+        assert getattr(stored, name) == getattr(compact, name), name
+
+def test_history_snapshots_stored_and_truncated():
+    game, entries = random_game(3, 2 * SNAPSHOT_PLIES + 5)
+    compact = game.compact()
+    snapshot = compact.pack_snapshot()
+    assert len(snapshot) == SNAPSHOT.size
+    position = CompactBoard.from_snapshot(snapshot, compact.history)
+    assert (position.squares, position.castling_rights(), position.en_passant,
+            position.halfmove_clock) == (compact.squares, compact.castling_rights(),
+                                         compact.en_passant, compact.halfmove_clock)
+    stored = CompactBoard.from_bytes(compact.to_bytes())
+    assert stored.history.snapshots == compact.history.snapshots
+    assert Board.from_compact(stored).position_at(20).to_fen() == game.position_at(20).to_fen()
+    first = game.move_history.copy(SNAPSHOT_PLIES + 1)
+    assert list(first) == entries[:SNAPSHOT_PLIES + 1]
+    assert first.snapshot_before(SNAPSHOT_PLIES + 1)[0] == SNAPSHOT_PLIES
+    first.pop()
+    first.pop()
+    assert first.snapshot_before(SNAPSHOT_PLIES) == (0, START_SNAPSHOT)
+    #histories without snapshots, eg. recovered from the game log
+    history = PackedHistory(entries)
+    assert history.snapshot_before(len(entries)) == (0, START_SNAPSHOT)
+    game.move_history = history
+    assert game.position_at(30).to_fen() == Board.from_compact(stored).position_at(30).to_fen()
@@ -1,5 +1,13 @@
+import random
+
+import pytest
+
 from src.chess_server.engine import BLACK, WHITE, CARDINALS, DIAGONALS
+from src.chess_server.engine import CHECKMATE, STALEMATE, THREEFOLD_REPETITION, FIFTY_MOVE_RULE
 from src.chess_server.engine import Board, Pawn, Rook, Knight, Bishop, Queen, King, Piece
+from src.chess_server.engine import load_fens, TAKEBACK_PLIES
+from src.chess_server.compact import START_FEN, SNAPSHOT_PLIES
+from src.chess_server.parser import msg_to_move, write_msg
 
 board = Board()
 
@@ -102,7 +110,7 @@ def test_move_checks_opponent():
     board.move_piece((4, 1), (8, 5))
     print(board.move_history)
     print(board.display_board())
-    assert board.move_history[-1][4] #looks at last move in history and sees if check
+    assert board.move_history[-1][5] #looks at last move in history and sees if check
 
 def test_move_king_into_check():
     board.move_piece((5, 8), (6, 7))
@@ -121,3 +129,363 @@ def test_castling():
     print(board.display_board())
     assert board.board[(7, 1)].symbol == 'K'
     assert board.board[(6, 1)].symbol == 'R'
+
+
+def _board_state(board):
+    return {pos: (piece, piece.pos, getattr(piece, "has_moved", None))
+            for pos, piece in board.board.items()}
+
+def test_make_unmake_restores_board():
+    state = _board_state(board)
+    for piece in list(board.board.values()):
+        for to_pos in piece.list_moves():
+            if not Piece._in_bounds(to_pos):
+                continue
+            record = board._make_move(piece.pos, to_pos)
+            board._unmake_move(record)
+            assert _board_state(board) == state
+
+def test_unmake_castling():
+    castling_board = Board()
+    for pos in ((6, 1), (7, 1)):
+        castling_board._remove_piece(pos)
+    state = _board_state(castling_board)
+    record = castling_board._make_move((5, 1), (7, 1))
+    assert castling_board.board[(6, 1)].has_moved
+    castling_board._unmake_move(record)
+    assert _board_state(castling_board) == state
+    assert not castling_board.board[(8, 1)].has_moved
+
+def test_rejected_move_leaves_history():
+    history = list(board.move_history)
+    assert not board.move_piece((6, 3), (6, 5))
+    assert board.move_history == history
+
+def test_attack_maps_follow_moves():
+    rng = random.Random(1)
+    game = Board()
+    for _ in range(60):
+        color = WHITE if game.last_moved_color == BLACK else BLACK
+        moves = sorted((piece.pos, to_pos) for piece in list(game.board.values())
+            if piece.color == color for to_pos in piece.list_moves()
+            if Piece._in_bounds(to_pos))
+        game.move_piece(*rng.choice(moves))
+        attack_map = game.attack_map
+        game._rebuild_attack_maps()
+        assert attack_map == game.attack_map
+        for color in (WHITE, BLACK):
+            king = game.kings[color]
+            assert game.king_in_check(color) == any(
+                piece.verify_move(king.pos) for piece in game.board.values()
+                if piece.color != color)
+
+def test_attackers_of():
+    game = Board()
+    attackers = game.attackers_of((6, 3), WHITE)
+    assert {piece.symbol for piece in attackers} == {"P", "C"}
+    assert not game.attackers_of((5, 5), WHITE)
+
+def test_castling_through_check():
+    game = Board()
+    for move in [((7, 2), (7, 3)), ((4, 7), (4, 6)), ((7, 1), (6, 3)),
+                 ((3, 8), (8, 3)), ((5, 2), (5, 3)), ((1, 7), (1, 6)),
+                 ((6, 1), (5, 2)), ((1, 6), (1, 5))]:
+        assert game.move_piece(*move)
+    #f1 is attacked by the bishop on h3
+    assert not game.move_piece((5, 1), (7, 1))
+    game = Board()
+    for move in [((5, 2), (5, 4)), ((5, 7), (5, 5)), ((7, 1), (6, 3)),
+                 ((2, 8), (3, 6)), ((6, 1), (3, 4)), ((3, 6), (4, 4)),
+                 ((7, 2), (7, 3)), ((4, 4), (6, 3))]:
+        assert game.move_piece(*move)
+    #king on e1 is in check from the knight on f3
+    assert not game.move_piece((5, 1), (7, 1))
+
+def test_perft_start_position():
+    assert [Board().perft(depth) for depth in (1, 2, 3)] == [20, 400, 8902]
+
+def test_legal_moves_respect_check():
+    game = Board()
+    for move in [((5, 2), (5, 4)), ((6, 7), (6, 6)), ((4, 1), (8, 5))]:
+        assert game.move_piece(*move)
+    #black is in check from the queen on h5, only g7-g6 blocks it
+    assert list(game.legal_moves(BLACK)) == [((7, 7), (7, 6), None)]
+
+def test_en_passant():
+    game = Board()
+    for move in [((5, 2), (5, 4)), ((1, 7), (1, 6)), ((5, 4), (5, 5)),
+                 ((4, 7), (4, 5))]:
+        assert game.move_piece(*move)
+    assert game.en_passant == (4, 6)
+    assert ((5, 5), (4, 6), None) in game.legal_moves(WHITE)
+    assert game.move_piece((5, 5), (4, 6))
+    assert not game.board.get((4, 5))
+    assert game.move_history[-1][4] == "p"
+    assert game.en_passant is None
+
+def test_promotion_and_undo():
+    game = Board()
+    for move in [((8, 2), (8, 4)), ((7, 7), (7, 5)), ((8, 4), (7, 5)),
+                 ((8, 7), (8, 6)), ((7, 5), (8, 6)), ((1, 7), (1, 6)),
+                 ((8, 6), (8, 7)), ((5, 7), (5, 6))]:
+        assert game.move_piece(*move)
+    promotions = [move for move in game.legal_moves(WHITE) if move[2]]
+    assert sorted(move[2] for move in promotions) == ["B", "C", "Q", "R"]
+    record = game._make_move((8, 7), (7, 8), "C")
+    assert game.board[(7, 8)].symbol == "C"
+    game._unmake_move(record)
+    assert game.board[(8, 7)].symbol == "P"
+    assert game.board[(7, 8)].symbol == "c"
+    assert game.move_piece((8, 7), (7, 8))
+    assert game.board[(7, 8)].symbol == "Q"
+    assert game.move_history[-1][4] == "c"
+    assert game.move_history[-1][6] == "Q"
+
+def test_zobrist_hash_follows_moves():
+    rng = random.Random(2)
+    game = Board()
+    for _ in range(80):
+        color = WHITE if game.last_moved_color == BLACK else BLACK
+        moves = sorted(game.legal_moves(color), key=str)
+        for move in moves:
+            record = game._make_move(*move)
+            assert game.zobrist_hash == game.compute_hash()
+            game._unmake_move(record)
+        assert game.move_piece(*rng.choice(moves))
+        assert game.zobrist_hash == game.compute_hash()
+
+def test_transposition_same_hash():
+    first, second = Board(), Board()
+    for move in [((7, 1), (6, 3)), ((7, 8), (6, 6)), ((2, 1), (3, 3))]:
+        first.move_piece(*move)
+    for move in [((2, 1), (3, 3)), ((7, 8), (6, 6)), ((7, 1), (6, 3))]:
+        second.move_piece(*move)
+    assert first.zobrist_hash == second.zobrist_hash
+    first.move_piece((2, 8), (3, 6))
+    assert first.zobrist_hash != second.zobrist_hash
+
+def test_threefold_repetition():
+    game = Board()
+    shuffle = [((7, 1), (6, 3)), ((7, 8), (6, 6)), ((6, 3), (7, 1)), ((6, 6), (7, 8))]
+    for move in shuffle*2:
+        assert game.move_piece(*move)
+    assert game.outcome == THREEFOLD_REPETITION
+    assert game.move_history[-1][7] == THREEFOLD_REPETITION
+    assert not game.move_piece((5, 2), (5, 4))
+
+def test_fifty_move_rule():
+    game = Board()
+    game.halfmove_clock = 98
+    assert game.move_piece((7, 1), (6, 3))
+    assert not game.outcome
+    assert game.move_piece((7, 8), (6, 6))
+    assert game.outcome == FIFTY_MOVE_RULE
+    game = Board()
+    game.halfmove_clock = 98
+    game.move_piece((5, 2), (5, 4)) #pawn moves reset the count
+    assert game.halfmove_clock == 0
+
+def play(game, msgs):
+    for msg in msgs.split():
+        assert game.move_piece(*msg_to_move(msg)), msg
+    return game
+
+def test_checkmate():
+    game = play(Board(), "f2-f3 e7-e5 g2-g4")
+    assert game.has_legal_move(BLACK)
+    play(game, "d8-h4")
+    assert game.outcome == CHECKMATE
+    assert write_msg(game.move_history[-1]) == \
+        "4. black queen moves from d8 to h4. Check. Checkmate, black wins"
+    assert not game.move_piece((1, 2), (1, 3))
+
+def test_check_that_can_be_blocked_is_not_mate():
+    game = play(Board(), "e2-e4 f7-f6 d2-d4 b7-b6 d1-h5")
+    assert game.move_history[-1][5]
+    assert not game.outcome
+
+def test_stalemate():
+    game = play(Board(), "e2-e3 a7-a5 d1-h5 a8-a6 h5-a5 h7-h5 h2-h4 a6-h6 "
+                         "a5-c7 f7-f6 c7-d7 e8-f7 d7-b7 d8-d3 b7-b8 d3-h7 "
+                         "b8-c8 f7-g6")
+    assert game.has_legal_move(WHITE)
+    play(game, "c8-e6")
+    assert game.outcome == STALEMATE
+    assert not game.king_in_check(BLACK)
+
+def test_display_board_cached_per_version():
+    game = Board()
+    pretty_board = game.display_board()
+    assert game.display_board() is pretty_board
+    assert not game.move_piece((5, 2), (5, 5))
+    assert game.version == 0 and game.display_board() is pretty_board
+    assert game.move_piece((5, 2), (5, 4))
+    assert game.version == 1
+    assert "4 |   |   |   |   | P |" in game.display_board()
+
+KIWIPETE = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+def test_fen_round_trip():
+    new_board = Board()
+    assert new_board.to_fen() == START_FEN
+    new_board.move_piece((5, 2), (5, 4))
+    fen = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+    assert new_board.to_fen() == fen
+    loaded = Board.from_fen(fen)
+    assert loaded.to_fen() == fen
+    assert loaded.zobrist_hash == new_board.zobrist_hash
+    assert loaded.display_board() == new_board.display_board()
+
+def test_fen_castling_rights_and_en_passant():
+    loaded = Board.from_fen("r3k2r/8/8/3pP3/8/8/8/R3K2R w Kq d6 0 20")
+    assert loaded.castling_rights() == "Kq"
+    assert loaded.board[(1, 1)].has_moved and not loaded.board[(8, 1)].has_moved
+    assert not loaded.move_piece((5, 1), (3, 1))
+    assert loaded.move_piece((5, 5), (4, 6)) #en passant
+    assert (4, 5) not in loaded.board
+    assert loaded.to_fen() == "r3k2r/8/3P4/8/8/8/8/R3K2R b Kq - 0 20"
+
+def test_fen_perft_and_outcome():
+    assert Board.from_fen(KIWIPETE).perft(2) == 2039
+    assert Board.from_fen("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1").outcome == CHECKMATE
+    assert Board.from_fen("7k/8/6QK/8/8/8/8/8 b - - 0 1").outcome == STALEMATE
+
+@pytest.mark.parametrize("fen", [
+    "8/8/8/8/8/8/8/8 w - - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1",
+    "rnbqkbn1/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e3 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1",
+])
+def test_bad_fen(fen):
+    with pytest.raises(ValueError):
+        Board.from_fen(fen)
+
+@pytest.mark.parametrize("fen, error", [
+    ("P6k/8/8/8/8/8/8/K7 w - - 0 1", "first or last row"),
+    ("k7/8/8/8/8/8/8/K5p1 b - - 0 1", "first or last row"),
+    ("k7/8/8/3P4/8/8/8/K7 w - e6 0 1", "en passant"), #no pawn passed e6
+    ("k7/8/4p3/3Pp3/8/8/8/K7 w - e6 0 1", "en passant"), #e6 taken
+    ("k7/4p3/8/3Pp3/8/8/8/K7 w - e6 0 1", "en passant"), #e7 not empty
+    ("k7/8/8/8/3pP3/8/8/K7 b - e3 0 1", None), #e2 and e3 empty
+    ("k6R/8/8/8/8/8/8/K7 w - - 0 1", "not to move is in check"),
+    ("k7/8/8/8/8/8/1p6/K7 b - - 0 1", "not to move is in check"),
+    ("k7/8/8/8/8/8/1p6/K7 w - - 0 1", None), #white to move is in check
+])
+@pytest.mark.parametrize("representation", ["dict", "bitboard"])
+def test_impossible_fen(fen, error, representation):
+    lines = [START_FEN, fen]
+    if error is None:
+        assert load_fens(lines, representation)[1].to_fen() == fen
+        return
+    with pytest.raises(ValueError, match=error):
+        Board.from_fen(fen)
+    with pytest.raises(ValueError, match=f"line 2: .*{error}"):
+        load_fens(lines, representation)
+
+def test_load_fens():
+    lines = ["# perft suite", "", KIWIPETE + " ;D1 48 ;D2 2039",
+             "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -"]
+    boards = load_fens(lines)
+    assert [b.to_fen() for b in boards] == [KIWIPETE, "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"]
+    with pytest.raises(ValueError, match="line 2"):
+        load_fens([START_FEN, "not a fen"])
+
+def random_plies(game, seed, plies):
+    """
+    Plays random legal moves, returning the state after each ply
+    """
+    rng = random.Random(seed)
+    states = [state(game)]
+    for _ in range(plies):
+        color = WHITE if game.last_moved_color == BLACK else BLACK
+        moves = sorted(game.legal_moves(color), key=str)
+        if game.outcome or not moves:
+            break
+        assert game.move_piece(*rng.choice(moves))
+        states.append(state(game))
+    return states
+
+def state(game):
+    return (game.to_fen(), game.zobrist_hash, game.castling_rights(),
+            dict(game.position_counts), game.outcome, len(game.move_history))
+
+def attacks(game):
+    return {color: {pos: sorted(piece.symbol for piece in pieces)
+                    for pos, pieces in attack_map.items()}
+            for color, attack_map in game.attack_map.items()}
+
+#castling both ways, en passant, a rook taken in its corner and a promotion
+#taking a piece
+SPECIAL_MOVES = ("e2-e4 d7-d5 e4-e5 f7-f5 e5-f6 g7-f6 g1-f3 b8-c6 f1-e2 c8-e6 "
+                 "e1-g1 d8-d6 b2-b3 e8-c8 c1-b2 h7-h5 b2-f6 h5-h4 f6-h8 h4-h3 "
+                 "h8-d4 h3-g2 d4-a7 g2-f1", "g2-g3 b7-b6 f1-g2 e7-e6 g2-a8 b6-b5")
+
+def scripted_plies(game, msgs):
+    states = [state(game)]
+    for msg in msgs.split():
+        play(game, msg)
+        states.append(state(game))
+    return states
+
+def test_position_at_rebuilds_every_ply():
+    games = []
+    for seed in range(4):
+        game = Board()
+        games.append((game, random_plies(game, seed, 120)))
+    for msgs in SPECIAL_MOVES:
+        game = Board()
+        games.append((game, scripted_plies(game, msgs)))
+    for game, states in games:
+        for ply, expected in enumerate(states):
+            position = game.position_at(ply)
+            assert state(position) == expected
+            assert position.version == ply and not position.changed_since(ply)
+        with pytest.raises(IndexError):
+            game.position_at(len(states))
+    #histories keep the snapshots of games set up from a FEN
+    game = Board.from_fen(KIWIPETE)
+    states = random_plies(game, 1, 2 * SNAPSHOT_PLIES)
+    assert state(game.position_at(0)) == states[0]
+    assert state(game.position_at(SNAPSHOT_PLIES + 3)) == states[SNAPSHOT_PLIES + 3]
+
+def test_takeback_in_place_and_from_snapshots():
+    for msgs in SPECIAL_MOVES:
+        game = Board()
+        states = scripted_plies(game, msgs)
+        for plies in range(len(states) - 1, 0, -1):
+            assert game.takeback() and state(game) == states[plies - 1]
+    game = Board()
+    states = random_plies(game, 7, 60)
+    for plies in range(len(states) - 1, 0, -1):
+        version = game.version
+        assert game.takeback()
+        assert state(game) == states[plies - 1]
+        assert game.changed_since(version) is None #full board instead of a delta
+        assert attacks(game) == attacks(Board.from_fen(game.to_fen()))
+    assert not game.takeback()
+    assert game.display_board() == Board().display_board()
+    #play on after taking back further than the records kept
+    assert len(game.takebacks) == 0 and TAKEBACK_PLIES < len(states)
+    assert state(game) == state(Board())
+    play(game, "g1-f3 g8-f6")
+    assert game.changed_since(game.version - 2) == {6: " ", 21: "C", 62: " ", 45: "c"}
+
+def test_takeback_ends_and_repetitions():
+    game = play(Board(), "f2-f3 e7-e5 g2-g4 d8-h4")
+    assert game.outcome == CHECKMATE
+    assert game.takeback() and game.outcome is None
+    assert not game.move_history.outcome and len(game.move_history) == 3
+    play(game, "d8-g5")
+    #the repetition counts are restored with the move that cleared them
+    shuffle = "g1-h3 g8-h6 h3-g1 h6-g8"
+    game = play(Board(), shuffle + " g1-h3 g8-h6 h3-g1")
+    assert game.takeback() and game.takeback()
+    play(game, "g8-h6 h3-g1 h6-g8")
+    assert game.outcome == THREEFOLD_REPETITION
+    game = play(Board(), "e2-e4 e7-e5 " + shuffle)
+    counts = dict(game.position_counts)
+    play(game, "d2-d4")
+    assert game.takeback() and dict(game.position_counts) == counts
@@ -0,0 +1,45 @@
+from src.chess_server.engine import Board
+from src.chess_server.gamelog import GameLog, read_log
+from src.chess_server.parser import msg_to_move
+
+def log_game(game_log, game_id, msgs):
+    game = Board()
+    game_log.game_started(game_id)
+    for msg in msgs.split():
+        assert game.move_piece(*msg_to_move(msg)), msg
+        game_log.moved(game_id, game)
+    return game
+
+def test_recovers_games_replaying_after_snapshot(tmp_path):
+    path = str(tmp_path / "games.log")
+    game_log = GameLog(path, snapshot_every=4)
+    first = log_game(game_log, 1, "e2-e4 e7-e5 g1-f3 b8-c6 f1-c4 g8-f6 e1-g1")
+    second = log_game(game_log, 2, "d2-d4 d7-d5")
+    log_game(game_log, 3, "f2-f3 e7-e5 g2-g4 d8-h4")
+    game_log.game_ended(3)
+    game_log.close()
+    logged = read_log(path)
+    assert sorted(logged) == [1, 2]
+    assert logged[1].snapshot_moves == 4 and len(logged[1].moves) == 7
+    games = GameLog(path).recover()
+    assert sorted(games) == [1, 2]
+    for game, compact in ((first, games[1]), (second, games[2])):
+        restored = Board.from_compact(compact)
+        assert restored.display_board() == game.display_board()
+        assert restored.move_history == game.move_history
+        assert restored.zobrist_hash == game.zobrist_hash
+        assert restored.version == game.version
+    #the rewritten log ends each game with a snapshot, nothing to replay
+    logged = read_log(path)
+    assert logged[1].snapshot_moves == len(logged[1].moves) == 7
+
+def test_torn_record_at_the_end_is_ignored(tmp_path):
+    path = str(tmp_path / "games.log")
+    game_log = GameLog(path)
+    log_game(game_log, 1, "e2-e4 e7-e5")
+    game_log.close()
+    with open(path, "ab") as log_file:
+        log_file.write(b"\x02\x01\x00")
+    games = GameLog(path).recover()
+    assert len(games[1].history) == 2
+    assert read_log(path)[1].snapshot_moves == 2
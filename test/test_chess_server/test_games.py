@@ -0,0 +1,35 @@
+import pytest
+
+from src.chess_server.games import GameFileError, read_moves, read_pgn, resolve_san
+from src.chess_server.engine import Board
+from src.chess_server.parser import msg_to_move
+
+def test_read_moves_own_format():
+    moves = read_moves("# opening\ne2-e4\n\ne7-e5 # reply\ng1-f3\n")
+    assert moves == [((5, 2), (5, 4), None), ((5, 7), (5, 5), None),
+                     ((7, 1), (6, 3), None)]
+
+def test_read_moves_rejects_illegal_move():
+    with pytest.raises(GameFileError, match="game:2"):
+        read_moves("e2-e4\ne2-e4\n")
+
+def test_read_pgn_skips_tags_comments_and_variations():
+    games = read_pgn('[Event "Test"]\n[Result "0-1"]\n\n'
+                     '1. f3 {weak} e5 (1... d5 2. e4) 2. g4?? $4 Qh4# 0-1\n\n'
+                     '[Event "Second"]\n1.e4 e5 2.Nf3 Nc6 3.Bb5 a6 4.O-O *\n')
+    assert len(games) == 2
+    assert games[0][-1] == ((4, 8), (8, 4), None)
+    assert games[1][-1] == ((5, 1), (7, 1), None)
+
+def test_resolve_san_disambiguation_and_promotion():
+    board = Board()
+    for move in ("a2-a4", "b7-b5", "a4-b5", "a7-a6", "b5-a6", "c8-b7",
+                 "a6-b7", "b8-c6", "g1-f3", "e7-e6"):
+        assert board.move_piece(*msg_to_move(move))
+    assert resolve_san(board, "bxa8=N") == ((2, 7), (1, 8), "C")
+    board = Board()
+    for move in ("b1-c3", "a7-a6", "g1-h3", "a6-a5", "h3-f4", "a5-a4"):
+        assert board.move_piece(*msg_to_move(move))
+    assert resolve_san(board, "Ncd5") == ((3, 3), (4, 5), None)
+    with pytest.raises(GameFileError, match="ambiguous"):
+        resolve_san(board, "Nd5")
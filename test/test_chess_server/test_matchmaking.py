@@ -0,0 +1,61 @@
+from src.chess_server.matchmaking import Matchmaker
+
+def test_unrated_clients_paired_in_arrival_order():
+    matchmaker = Matchmaker()
+    assert matchmaker.seek("a") is None
+    assert matchmaker.seek("b") == "a"
+    assert matchmaker.seek("c") is None and matchmaker.seek("d") == "c"
+    assert len(matchmaker) == 0
+
+def test_rated_clients_paired_with_nearest_bucket_in_range():
+    matchmaker = Matchmaker(rating_range=200, bucket_width=50)
+    for client, rating in (("low", 1200), ("mid", 1480), ("high", 1800)):
+        assert matchmaker.seek(client, rating) is None
+    assert matchmaker.seek("unrated") is None #rated clients do not play unrated ones
+    assert matchmaker.seek("far", 2100) is None #1800 is 6 buckets away
+    assert matchmaker.seek("x", 1530) == "mid"
+    assert matchmaker.seek("y", 1350) == "low" #4 buckets away
+    assert matchmaker.seek("z", 1990) == "high"
+    assert set(matchmaker.seeks) == {"unrated", "far"}
+
+def test_nearest_bucket_preferred():
+    matchmaker = Matchmaker(rating_range=200, bucket_width=50)
+    matchmaker.seek("1400", 1400)
+    matchmaker.seek("1650", 1650) #5 buckets from 1400, both wait
+    assert matchmaker.seek("new", 1600) == "1650"
+
+def test_time_controls_kept_apart():
+    matchmaker = Matchmaker()
+    assert matchmaker.seek("blitz", 1500, "5+3") is None
+    assert matchmaker.seek("rapid", 1500, "15+10") is None
+    assert matchmaker.seek("other", 1500, "15+10") == "rapid"
+
+def test_cancelled_and_gone_clients_skipped():
+    gone = set()
+    matchmaker = Matchmaker(alive=lambda client: client not in gone)
+    matchmaker.seek("a", 1500)
+    matchmaker.cancel("a")
+    assert "a" not in matchmaker and len(matchmaker) == 0
+    assert matchmaker.seek("b", 1500) is None
+    gone.add("b")
+    assert matchmaker.seek("c", 1500) is None
+    assert list(matchmaker.seeks) == ["c"]
+    assert matchmaker.seek("d", 1500) == "c"
+    assert len(matchmaker) == 0 and not matchmaker.pools
+    #a new seek replaces the old one
+    matchmaker.seek("e", 1500)
+    matchmaker.seek("e", 2500)
+    assert matchmaker.seek("f", 1500) is None
+
+def test_empty_pools_deleted():
+    matchmaker = Matchmaker()
+    for number in range(100):
+        matchmaker.seek(f"paired{number}", 1500, f"{number}+0")
+        matchmaker.seek(f"other{number}", 1510, f"{number}+0")
+        matchmaker.seek(f"left{number}", number * 10, f"{number}+1")
+        matchmaker.cancel(f"left{number}")
+    assert matchmaker.pools == {} and len(matchmaker) == 0
+    matchmaker.seek("a", 1500, "1+0")
+    matchmaker.seek("b", None, "1+0")
+    matchmaker.cancel("a")
+    assert list(matchmaker.pools["1+0"]) == [None]
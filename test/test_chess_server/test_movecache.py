@@ -0,0 +1,50 @@
+from src.chess_server.engine import Board, CHECKMATE
+from src.chess_server.movecache import MoveCache, MOVE_CACHE, ILLEGAL
+
+FOOLS_MATE = [((6, 2), (6, 3)), ((5, 7), (5, 5)), ((7, 2), (7, 4)), ((4, 8), (8, 4))]
+
+def test_least_recently_used_evicted():
+    cache = MoveCache(2)
+    cache.put("a", ILLEGAL)
+    cache.put("b", (1, False, True))
+    assert cache.get("a") is ILLEGAL
+    cache.put("c", (2, True, True))
+    assert cache.get("b") is None
+    assert cache.get("a") is ILLEGAL and len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.resize(1)
+    assert cache.get("c") is None and cache.get("a") is ILLEGAL
+
+def test_size_zero_caches_nothing():
+    cache = MoveCache(0)
+    cache.put("a", ILLEGAL)
+    assert cache.get("a") is None and len(cache) == 0
+
+def test_cached_game_plays_the_same():
+    MOVE_CACHE.clear()
+    boards = [Board(), Board()]
+    for board in boards:
+        assert not board.move_piece((5, 2), (5, 5)) #illegal, cached as such
+        for move in FOOLS_MATE:
+            assert board.move_piece(*move)
+    assert MOVE_CACHE.hits == 5 and MOVE_CACHE.misses == 5
+    assert boards[1].outcome == CHECKMATE
+    assert list(boards[0].move_history) == list(boards[1].move_history)
+    assert boards[0].zobrist_hash == boards[1].zobrist_hash
+
+def test_castling_rights_and_en_passant_in_key():
+    castling = Board.from_fen("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    assert castling.move_piece((5, 1), (7, 1))
+    no_rights = Board.from_fen("r3k2r/8/8/8/8/8/8/R3K2R w kq - 0 1")
+    assert not no_rights.move_piece((5, 1), (7, 1))
+    en_passant = Board.from_fen("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1")
+    assert en_passant.move_piece((5, 5), (4, 6))
+    no_en_passant = Board.from_fen("4k3/8/8/3pP3/8/8/8/4K3 w - - 0 1")
+    assert not no_en_passant.move_piece((5, 5), (4, 6))
+
+def test_hash_collision_validated_from_scratch():
+    board = Board()
+    #a result for e2-e5 as if it were legal, leading to some other position
+    MOVE_CACHE.put((board.zobrist_hash, (5, 2), (5, 5), None), (1, False, True))
+    assert not board.move_piece((5, 2), (5, 5))
+    assert board.zobrist_hash == Board().zobrist_hash and not board.move_history
@@ -0,0 +1,48 @@
+import pytest
+
+from src.chess_server.engine import Board
+from src.chess_server.games import GameFileError, parse_move
+from src.chess_server.openings import OpeningBook
+from src.chess_server.protocol import TEXT, BINARY
+
+def moves(text):
+    return [parse_move(msg) for msg in text.split()]
+
+def test_book_positions_built_lazily():
+    book = OpeningBook([moves("e2-e4 e7-e5 g1-f3"), ["e4", "c5"], moves("d2-d4")])
+    assert book.line_count == 3 and book.root.children is None
+    e4 = book.root.child(((5, 2), (5, 4), None))
+    assert set(book.root.children) == {((5, 2), (5, 4), None), ((4, 2), (4, 4), None)}
+    assert e4.children is None
+    sicilian = e4.child(((3, 7), (3, 5), None))
+    board = Board()
+    for move in moves("e2-e4 c7-c5"):
+        board.move_piece(*move)
+    assert sicilian.snapshot.squares == board.compact().squares
+    assert sicilian.snapshot.history == board.move_history
+    assert sicilian.replies[TEXT][0] == TEXT.move(board.move_history[-1], own=True)
+    assert sicilian.updates[BINARY] == BINARY.update(board.move_history[-1], board)
+    assert e4.child(((1, 7), (1, 6), None)) is None #out of the book
+
+def test_plies_limit_illegal_and_ending_moves():
+    book = OpeningBook([moves("e2-e4 e7-e5 g1-f3"), ["e4", "Ke2"], ["e4", "e5"]],
+                       plies=2)
+    e4 = book.root.child(((5, 2), (5, 4), None))
+    e5 = e4.child(((5, 7), (5, 5), None))
+    assert set(e4.children) == {((5, 7), (5, 5), None)} #Ke2 is not black's
+    assert e5.child(((7, 1), (6, 3), None)) is None
+    book = OpeningBook([moves("f2-f3 e7-e5 g2-g4 d8-h4")])
+    node = book.root
+    for move in moves("f2-f3 e7-e5 g2-g4"):
+        node = node.child(move)
+    assert node.child(((4, 8), (8, 4), None)) is None #checkmate ends the game as usual
+
+def test_book_from_files(tmp_path):
+    (tmp_path / "lines.txt").write_text("e2-e4 e7-e5 # open game\n\nd2-d4 d7-d5\n")
+    (tmp_path / "games.pgn").write_text('[Event "x"]\n\n1. c4 e5 2. Nc3 *\n')
+    book = OpeningBook.from_files([str(tmp_path)])
+    assert book.line_count == 3
+    assert book.root.child(((3, 2), (3, 4), None)).child(((5, 7), (5, 5), None))
+    (tmp_path / "bad.txt").write_text("e2-e4 hello\n")
+    with pytest.raises(GameFileError):
+        OpeningBook.from_files([str(tmp_path / "bad.txt")])
@@ -0,0 +1,20 @@
+from src.chess_server.parser import valid_msg, msg_to_move, write_msg
+
+def test_valid_msg():
+    assert valid_msg("e2-e4")
+    assert valid_msg("display_board")
+    assert not valid_msg("e2-e9")
+
+def test_msg_to_move():
+    assert msg_to_move("e2-e4") == ((5, 2), (5, 4))
+
+def test_write_msg_move_and_take():
+    assert write_msg([1, (5, 2), "P", (5, 4), None, False, None, None]) == \
+        "1. white pawn moves from e2 to e4"
+    assert write_msg([6, (4, 1), "Q", (6, 7), "p", True, None, None]) == \
+        "6. white queen on d1 takes black pawn on f7. Check"
+
+def test_write_msg_draw():
+    msg = write_msg([8, (6, 6), "c", (7, 8), None, False, None,
+                     "threefold repetition"])
+    assert msg == "8. black knight moves from f6 to g8. Draw by threefold repetition"
@@ -0,0 +1,29 @@
+import asyncio
+
+from src.chess_server.engine import Board
+from src.chess_server.profiling import GameProfiler, parse_profile_command
+
+def test_parse_profile_command():
+    assert parse_profile_command("profile 3 20 moves") == ([3], 20, None, False)
+    assert parse_profile_command("profile 1,12 2.5 seconds sampling") == \
+        ([1, 12], None, 2.5, True)
+    assert parse_profile_command("profile 1 moves") is None
+
+def test_sampling_writes_collapsed_stacks(tmp_path):
+    board = Board()
+    def handle_request():
+        return board.perft(3)
+    async def main():
+        profiler = GameProfiler([1], sampling=True, report_dir=str(tmp_path),
+                                interval=0.0005)
+        done = profiler.start()
+        assert profiler.run(handle_request) == 8902
+        profiler.finish()
+        return await done
+    with open(asyncio.run(main())) as report:
+        lines = report.read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.startswith("test_profiling.test_sampling_writes_collapsed_stacks.<locals>"
+                            ".handle_request;engine.Board.perft")
+    assert int(count) > 0
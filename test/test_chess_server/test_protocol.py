@@ -0,0 +1,79 @@
+from src.chess_server.engine import Board
+from src.chess_server.parser import DISPLAY_BOARD
+from src.chess_server.protocol import (BINARY, TEXT, INCOMPLETE, SWITCH_TO_BINARY,
+    BOARD, BOARD_DELTA, COMMAND, DELTA, FRAME, SEEK, SHOW_CLOCK, CLOCK_REPLY, CLOCK_TIMES,
+    TIME_OUT, GAME_STARTED, GAME_ID, WATCHING, decode_move_flags, encode_delta_request, encode_request)
+
+def test_text_requests():
+    buffer = b"e2-e4\ndisplay_board\nbinary\nhello\ne7-e"
+    requests, start = [], 0
+    while True:
+        request, start = TEXT.next_request(buffer, start)
+        if request is INCOMPLETE:
+            break
+        requests.append(request)
+    assert requests == [((5, 2), (5, 4), None), DISPLAY_BOARD, SWITCH_TO_BINARY, None]
+    assert buffer[start:] == b"e7-e"
+
+def test_seek_requests():
+    assert TEXT.next_request(b"seek\n", 0) == ((SEEK, None, None), 5)
+    assert TEXT.next_request(b"seek 1500\n", 0) == ((SEEK, 1500, None), 10)
+    assert TEXT.next_request(b"seek 1500 5+3\n", 0) == ((SEEK, 1500, "5+3"), 14)
+    assert TEXT.next_request(b"seek 0.5+0\n", 0) == ((SEEK, None, "0.5+0"), 11)
+    assert TEXT.next_request(b"seek high\n", 0) == (None, 10)
+
+def test_binary_requests():
+    buffer = (encode_request((1, 7), (2, 8), "C") + encode_request((5, 2), (5, 4), "Q")
+              + bytes((COMMAND, 0, 64, 0, 1)))
+    assert BINARY.next_request(buffer, 0) == (((1, 7), (2, 8), "C"), 2)
+    assert BINARY.next_request(buffer, 2) == (((5, 2), (5, 4), None), 4)
+    assert BINARY.next_request(buffer, 4) == (DISPLAY_BOARD, 6)
+    assert BINARY.next_request(buffer, 6) == (None, 8)
+    assert BINARY.next_request(buffer, 8) == (INCOMPLETE, 8)
+
+def test_move_replies_match_history():
+    board = Board()
+    for move in [((6, 2), (6, 3)), ((5, 7), (5, 5)), ((7, 2), (7, 4)), ((4, 8), (8, 4))]:
+        assert board.move_piece(*move)
+    move = board.move_history[-1]
+    assert TEXT.move(move, own=True).endswith(b"Checkmate, black wins\n")
+    frame = BINARY.move(move, own=False)
+    assert frame[1:3] == bytes((59, 31))
+    assert decode_move_flags(frame[3]) == (False, True, None, "checkmate")
+
+def test_delta_requests_and_replies():
+    assert TEXT.next_request(b"delta 3\ndelta x\n", 0) == ((DELTA, 3), 8)
+    assert TEXT.next_request(b"delta 3\ndelta x\n", 8) == (None, 16)
+    assert BINARY.next_request(encode_delta_request(258)[:3], 0) == (INCOMPLETE, 0)
+    assert BINARY.next_request(encode_delta_request(258), 0) == ((DELTA, 258), 4)
+    board = Board()
+    assert board.move_piece((5, 2), (5, 4))
+    assert TEXT.delta(board, 0) == b"Delta 1 e2=- e4=P\n"
+    assert TEXT.delta(board, 1) == b"Delta 1\n"
+    assert TEXT.delta(board, 5).startswith(b"Board 1\n    a   b")
+    assert BINARY.delta(board, 0) == FRAME.pack(BOARD_DELTA, 2, 0, 1) + b"\x0c \x1cP"
+    assert BINARY.delta(board, 2)[:4] == FRAME.pack(BOARD, 0, 0, 1)
+
+def test_clock_requests_and_replies():
+    assert TEXT.next_request(b"clock\n", 0) == (SHOW_CLOCK, 6)
+    assert BINARY.next_request(bytes((COMMAND, 3)), 0) == (SHOW_CLOCK, 2)
+    assert TEXT.clock(61.25, 0.04) == b"Clock white 61.2 black 0.0\n"
+    reply = BINARY.clock(61.25, -0.5)
+    assert FRAME.unpack(reply[:FRAME.size])[0] == CLOCK_REPLY
+    assert CLOCK_TIMES.unpack(reply[FRAME.size:]) == (61250, 0)
+    assert TEXT.time_out("black") == b"Time out, black loses\n"
+    assert BINARY.time_out("black") == FRAME.pack(TIME_OUT, 1, 0, 0)
+
+def test_game_ids_above_16_bits():
+    game_id = 0x12345678
+    reply = BINARY.game_started(game_id, "black", None)
+    assert reply[:FRAME.size] == FRAME.pack(GAME_STARTED, 1, 0, 0)
+    assert GAME_ID.unpack(reply[FRAME.size:]) == (game_id,)
+    board = Board()
+    reply = BINARY.watching(0x10000, board)
+    assert reply[:FRAME.size] == FRAME.pack(WATCHING, 0, 0, 0)
+    assert GAME_ID.unpack(reply[FRAME.size:FRAME.size + GAME_ID.size]) == (0x10000,)
+    assert reply[FRAME.size + GAME_ID.size:] == BINARY.board(board)
+    #resume starts like a game start
+    assert BINARY.resumed(game_id, "white", board).startswith(
+        FRAME.pack(GAME_STARTED, 0, 0, 0) + GAME_ID.pack(game_id))
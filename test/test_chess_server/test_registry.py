@@ -0,0 +1,57 @@
+import os
+
+from src.chess_server.engine import Board
+from src.chess_server.parser import msg_to_move
+from src.chess_server.registry import GameRegistry
+from src.chess_server.server import Game
+
+def parked_game(game_id, msgs=""):
+    board = Board()
+    for msg in msgs.split():
+        assert board.move_piece(*msg_to_move(msg)), msg
+    return Game(game_id, None, None, board.compact())
+
+def test_spills_least_recently_used_games(tmp_path):
+    games = GameRegistry(memory_budget=1500, spill_dir=str(tmp_path))
+    for game_id in (1, 2, 3, 4):
+        games[game_id] = parked_game(game_id, "e2-e4 e7-e5")
+    assert games.resident_bytes <= 1500
+    assert [games[i].spilled() for i in (1, 2, 3, 4)] == [True, True, False, False]
+    assert sorted(os.listdir(tmp_path)) == ["1.game", "2.game"]
+    display = games[3].position().display_board()
+    games.touch(games[1])
+    assert not games[1].spilled() and games[3].spilled()
+    assert games[1].board.move_history[-1][3] == (5, 5)
+    games.touch(games[3])
+    assert games[3].position().display_board() == display
+    assert games.reloads == 2
+    del games[2]
+    assert sorted(os.listdir(tmp_path)) == ["4.game"]
+
+def test_temporary_spill_dir_removed_on_close():
+    games = GameRegistry(memory_budget=0)
+    games[1] = parked_game(1)
+    games[2] = parked_game(2)
+    spill_dir = games.spill_dir
+    assert os.listdir(spill_dir) == ["1.game"]
+    games.close()
+    assert not os.path.exists(spill_dir)
+
+def test_idle_games_parked():
+    now = [0.0]
+    games = GameRegistry(park_after=30, clock=lambda: now[0])
+    games[1] = Game(1, None, None)
+    games[2] = Game(2, None, None)
+    games[1].board.move_piece(*msg_to_move("e2-e4"))
+    now[0] = 20.0
+    games.touch(games[2])
+    assert games[1].compact_board is None and games[2].compact_board is None
+    now[0] = 40.0
+    games.touch(games[2])
+    #game 1 has been idle for 40 seconds, game 2 was touched 20 seconds ago
+    assert games[1].compact_board is not None and games[2].compact_board is None
+    assert games.resident[1] == games[1].compact_board.nbytes()
+    assert list(games.last_used) == [2]
+    assert games[1].board.move_history[-1][3] == (5, 4)
+    games.touch(games[1])
+    assert list(games.last_used) == [2, 1]
@@ -0,0 +1,404 @@
+import asyncio
+import pstats
+
+from src.chess_server import compact
+from src.chess_server.server import Game, GameServer
+from src.chess_server.gamelog import GameLog, read_log
+from src.chess_server.stats import STATS
+from src.chess_server.clock import TimeControl
+from src.chess_server.movecache import MOVE_CACHE
+from src.chess_server.openings import OpeningBook
+from src.chess_server.games import parse_move
+from src.chess_server.protocol import (BOARD, COMMAND, FRAME, INVALID_MOVE,
+    INVALID_REQUEST, OK, OPPONENT_MOVED, TextProtocol, decode_move_flags,
+    encode_request)
+
+def run_with_server(scenario, **options):
+    """
+    Runs scenario(server, connect) against a server on a free local port,
+    options are passed to GameServer
+    """
+    async def main():
+        game_server = GameServer(**options)
+        server = await game_server.start("127.0.0.1", 0)
+        spectator_server = await asyncio.start_server(game_server.handle_spectator,
+                                                      "127.0.0.1", 0)
+        ports = [s.sockets[0].getsockname()[1] for s in (server, spectator_server)]
+        async def connect(spectator=False):
+            return await asyncio.open_connection("127.0.0.1", ports[spectator])
+        async with server, spectator_server:
+            await asyncio.wait_for(scenario(game_server, connect), 5)
+    asyncio.run(main())
+
+async def expect(reader, start):
+    """
+    Skips lines (such as board displays) until one starting with start
+    """
+    while True:
+        line = (await reader.readline()).decode()
+        assert line, f"connection closed before {start!r}"
+        if line.startswith(start):
+            return line.strip()
+
+async def send(writer, msg):
+    writer.write(msg.encode() + b"\n")
+    await writer.drain()
+
+async def pair(connect):
+    white_reader, white_writer = await connect()
+    await expect(white_reader, "Waiting for an opponent")
+    black_reader, black_writer = await connect()
+    await expect(white_reader, "Game")
+    await expect(black_reader, "Game")
+    return (white_reader, white_writer), (black_reader, black_writer)
+
+def test_pairs_clients_and_enforces_turns():
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        assert len(game_server.games) == 1
+        await send(black, "e7-e5")
+        assert await expect(black_reader, "Not") == "Not your turn"
+        await send(white, "e2-e4")
+        reply = "1. white pawn moves from e2 to e4"
+        assert await expect(white_reader, "1.") == reply
+        assert await expect(black_reader, "1.") == reply
+        await send(white, "d2-d4")
+        assert await expect(white_reader, "Not") == "Not your turn"
+        await send(black, "hello")
+        assert await expect(black_reader, "Invalid") == "Invalid request"
+        await send(black, "e7-e4")
+        assert await expect(black_reader, "Invalid") == "Invalid Move"
+        white.close()
+        black.close()
+    run_with_server(scenario)
+
+def test_concurrent_games_are_separate():
+    async def scenario(game_server, connect):
+        first = await pair(connect)
+        second = await pair(connect)
+        assert sorted(game_server.games) == [1, 2]
+        await send(first[0][1], "e2-e4")
+        await expect(first[1][0], "1. white pawn moves from e2 to e4")
+        await send(second[0][1], "d2-d4")
+        await expect(second[1][0], "1. white pawn moves from d2 to d4")
+        for _, writer in first + second:
+            writer.close()
+    run_with_server(scenario)
+
+def test_checkmate_ends_game():
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        for ply, (writer, msg) in enumerate([(white, "f2-f3"), (black, "e7-e5"),
+                                             (white, "g2-g4"), (black, "d8-h4")], 1):
+            #wait for each move to arrive before the opponent answers it
+            await send(writer, msg)
+            line = await expect(white_reader, f"{ply}.")
+        assert line.endswith("Checkmate, black wins")
+        assert await white_reader.read() == b""
+        assert (await black_reader.read()).endswith(b"Checkmate, black wins\n")
+        assert not game_server.games
+    run_with_server(scenario)
+
+def test_disconnect_and_half_close():
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        #a half-closed client still gets the replies to what it sent
+        white.write(b"e2-e4\n")
+        white.write_eof()
+        await expect(white_reader, "1. white pawn moves from e2 to e4")
+        await expect(black_reader, "Opponent disconnected")
+        assert await black_reader.read() == b""
+        assert not game_server.games
+        assert len(game_server.matchmaker) == 0
+    run_with_server(scenario)
+
+def test_overlong_line_drops_client():
+    async def scenario(game_server, connect):
+        reader, writer = await connect()
+        await expect(reader, "Waiting")
+        writer.write(b"x" * 5000)
+        await writer.drain()
+        assert await reader.read() == b""
+        assert len(game_server.matchmaker) == 0
+    run_with_server(scenario)
+
+def test_binary_protocol_pipelined_with_text_opponent():
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        #switch and pipeline a board request, an invalid move and a move at once
+        white.write(b"binary\n" + bytes((COMMAND, 0)) + encode_request((5, 2), (5, 5))
+                    + encode_request((5, 2), (5, 4)))
+        assert await expect(white_reader, "OK") == "OK binary"
+        board = await white_reader.readexactly(4 + 64)
+        assert board[0] == BOARD and board[4:12] == b"RCBQKBCR"
+        assert await white_reader.readexactly(4) == FRAME.pack(INVALID_MOVE, 0, 0, 0)
+        assert await white_reader.readexactly(4) == FRAME.pack(OK, 12, 28, 0)
+        await expect(black_reader, "1. white pawn moves from e2 to e4")
+        await send(black, "f7-f5")
+        assert await white_reader.readexactly(4) == FRAME.pack(OPPONENT_MOVED, 53, 37, 0)
+        white.write(encode_request((5, 4), (6, 5)) + bytes((COMMAND, 9)))
+        captured, check, promotion, outcome = decode_move_flags(
+            (await white_reader.readexactly(4))[3])
+        assert captured and not check and promotion is None and outcome is None
+        assert (await white_reader.readexactly(4))[0] == INVALID_REQUEST
+        white.close()
+        black.close()
+    run_with_server(scenario)
+
+def test_delta_of_parked_game():
+    async def scenario(game_server, connect):
+        game_server.games.park_after = 0 #parked after every request
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        await send(white, "e2-e4")
+        await expect(black_reader, "1.")
+        await send(black, "delta 0")
+        assert await expect(black_reader, "Delta") == "Delta 1 e2=- e4=P"
+        assert game_server.games[1].compact_board is not None
+        await send(black, "delta 7")
+        assert await expect(black_reader, "Board") == "Board 1"
+        white.close()
+        black.close()
+    run_with_server(scenario)
+
+def test_display_cached_for_parked_game(monkeypatch):
+    renders = []
+    format_squares = compact.format_squares
+    monkeypatch.setattr(compact, "format_squares",
+                        lambda symbols: renders.append(1) or format_squares(symbols))
+    game = Game(1, None, None)
+    game.board.move_piece((5, 2), (5, 4))
+    pretty_board = game.board.display_board()
+    game.park()
+    #the render of the Board is kept by its CompactBoard
+    assert game.position().display_board() is pretty_board and not renders
+    game.board.move_piece((5, 7), (5, 5))
+    game.park()
+    pretty_board = game.position().display_board()
+    assert game.position().display_board() is pretty_board and len(renders) == 1
+    #and the other way, unparked
+    assert game.board.display_board() is pretty_board
+    game.park()
+    assert game.position().display_board() is pretty_board and len(renders) == 1
+
+def test_spectators_share_encoded_updates(monkeypatch):
+    encodes = []
+    update = TextProtocol.update
+    monkeypatch.setattr(TextProtocol, "update",
+                        staticmethod(lambda *args: encodes.append(1) or update(*args)))
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        spectators = [await connect(spectator=True) for _ in range(3)]
+        for reader, writer in spectators:
+            await send(writer, "watch 1")
+            assert await expect(reader, "Watching") == "Watching game 1"
+        binary_reader, binary_writer = await connect(spectator=True)
+        binary_writer.write(b"watch 1\nbinary\n")
+        await expect(binary_reader, "OK binary")
+        await send(white, "e2-e4")
+        for reader, _ in spectators:
+            await expect(reader, "1. white pawn moves from e2 to e4")
+            await expect(reader, "4 |   |   |   |   | P |")
+        assert await binary_reader.readexactly(4) == FRAME.pack(OPPONENT_MOVED, 12, 28, 0)
+        assert len(encodes) == 1
+        await send(spectators[0][1], "e7-e5")
+        assert await expect(spectators[0][0], "Spec") == "Spectators cannot move"
+        await send(spectators[0][1], "watch 9")
+        assert await expect(spectators[0][0], "Invalid") == "Invalid request"
+        white.close()
+        for reader, _ in spectators:
+            await expect(reader, "Player disconnected")
+            assert await reader.read() == b""
+    run_with_server(scenario)
+
+def test_watch_unknown_game():
+    async def scenario(game_server, connect):
+        reader, writer = await connect(spectator=True)
+        await send(writer, "watch 3")
+        assert await expect(reader, "No") == "No such game"
+        await send(writer, "e2-e4")
+        assert await expect(reader, "Waiting") == "Waiting for an opponent"
+        writer.close()
+    run_with_server(scenario)
+
+def test_games_recovered_after_restart(tmp_path):
+    path = str(tmp_path / "games.log")
+    async def before_crash(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        await send(white, "e2-e4")
+        await expect(black_reader, "1.")
+        #the server dies without logging anything after this sync
+        game_server.game_log.sync()
+    run_with_server(before_crash, game_log=GameLog(path))
+    async def after_restart(game_server, connect):
+        game_server.restore_games()
+        assert list(game_server.games) == [1]
+        black_reader, black = await connect(spectator=True)
+        await send(black, "resume 1 black")
+        assert await expect(black_reader, "Game") == "Game 1 resumed, you play black"
+        await expect(black_reader, "4 |   |   |   |   | P |")
+        white_reader, white = await connect(spectator=True)
+        await send(white, "resume 1 black")
+        assert await expect(white_reader, "Invalid") == "Invalid request"
+        await send(white, "resume 1 white")
+        await expect(white_reader, "Game 1 resumed")
+        await send(black, "e7-e5")
+        assert await expect(white_reader, "2.") == "2. black pawn moves from e7 to e5"
+        await pair(connect) #new games get new ids
+        assert sorted(game_server.games) == [1, 2]
+    run_with_server(after_restart, game_log=GameLog(path))
+
+def test_idle_games_spilled_and_reloaded(tmp_path):
+    async def scenario(game_server, connect):
+        first = await pair(connect)
+        second = await pair(connect)
+        games = game_server.games
+        assert games[1].spilled() and not games[2].spilled()
+        await send(first[0][1], "e2-e4")
+        await expect(first[1][0], "1. white pawn moves from e2 to e4")
+        assert games[2].spilled()
+        await send(second[1][1], "display_board")
+        await expect(second[1][0], "2 | P | P | P | P | P |")
+        await send(first[1][1], "display_board")
+        await expect(first[1][0], "4 |   |   |   |   | P |")
+        assert games.spills >= 3 and games.reloads >= 2
+        for _, writer in first + second:
+            writer.close()
+    run_with_server(scenario, memory_budget=1000, spill_dir=str(tmp_path))
+
+def test_stats_command_and_port(monkeypatch):
+    monkeypatch.setattr(STATS, "enabled", True)
+    STATS.reset()
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        await send(white, "e2-e4")
+        await expect(black_reader, "1.")
+        await send(black, "stats")
+        assert await expect(black_reader, "chess_games") == "chess_games 1"
+        await expect(black_reader, 'chess_requests_total{kind="move"} 1')
+        await expect(black_reader, 'chess_phase_seconds_count{phase="check"} 1')
+        await expect(black_reader, "# EOF")
+        stats_server = await asyncio.start_server(game_server.handle_stats,
+                                                  "127.0.0.1", 0)
+        async with stats_server:
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", stats_server.sockets[0].getsockname()[1])
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+            response = await reader.read()
+        assert response.startswith(b"HTTP/1.0 200 OK\r\n")
+        assert b'chess_requests_total{kind="stats"} 1' in response
+        white.close()
+        black.close()
+    try:
+        run_with_server(scenario)
+    finally:
+        STATS.reset()
+
+def test_admin_profiles_chosen_game(tmp_path):
+    async def scenario(game_server, connect):
+        first = await pair(connect)
+        second = await pair(connect)
+        admin_server = await asyncio.start_server(game_server.handle_admin,
+                                                  "127.0.0.1", 0)
+        async with admin_server:
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", admin_server.sockets[0].getsockname()[1])
+            await send(writer, "profile 2 2 moves")
+            assert await expect(reader, "Profiling") == "Profiling games 2"
+            for game, msgs in ((first, ("e2-e4", "e7-e5")), (second, ("d2-d4", "d7-d5"))):
+                for (player_reader, player), msg in zip(game, msgs):
+                    await send(player, msg)
+                    await expect(player_reader, f"{msgs.index(msg) + 1}.")
+            line = await expect(reader, "Profile written to ")
+            writer.close()
+        stats = pstats.Stats(line[len("Profile written to "):])
+        calls = {function[2]: stat[1] for function, stat in stats.stats.items()}
+        #only the two moves of game 2 ran under the profiler
+        assert calls["move_piece"] == 2
+        assert "has_legal_move" in calls
+        for _, writer in first + second:
+            writer.close()
+    MOVE_CACHE.clear() #the moves are validated, not taken from the cache
+    run_with_server(scenario, profile_dir=str(tmp_path))
+
+def test_flag_falls_for_stalling_player():
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        await send(white, "e2-e4")
+        await expect(black_reader, "1.")
+        await send(black, "clock")
+        line = await expect(black_reader, "Clock")
+        assert line.startswith("Clock white 1.") and " black " in line
+        #black stalls until their flag falls, with nothing sent
+        assert await expect(white_reader, "Time out") == "Time out, black loses"
+        assert await expect(black_reader, "Time out") == "Time out, black loses"
+        assert await black_reader.read() == b""
+        assert len(game_server.games) == 0 and len(game_server.timers) == 0
+        white.close()
+        black.close()
+    run_with_server(scenario, time_control=TimeControl(0.3, 1))
+
+def test_clock_of_untimed_game():
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        await send(white, "clock")
+        await expect(white_reader, "Invalid request")
+        white.close()
+        black.close()
+    run_with_server(scenario)
+
+def test_seeks_paired_by_time_control_and_rating():
+    async def scenario(game_server, connect):
+        fast_reader, fast = await connect(spectator=True)
+        await send(fast, "seek 1500 1+0")
+        await expect(fast_reader, "Waiting for an opponent")
+        far_reader, far = await connect(spectator=True)
+        await send(far, "seek 2000 5+3")
+        await expect(far_reader, "Waiting for an opponent")
+        near_reader, near = await connect(spectator=True)
+        await send(near, "seek 1550 5+3")
+        await expect(near_reader, "Waiting for an opponent")
+        assert len(game_server.matchmaker) == 3
+        #in range of the 1550 seek, and too far from the 2000 one
+        close_reader, close = await connect(spectator=True)
+        await send(close, "seek 1600 5+3")
+        await expect(close_reader, "Game")
+        await expect(near_reader, "Game")
+        game = game_server.games[1]
+        assert game.clock is not None and game.clock.increment == 3
+        await send(near, "e2-e4") #the waiting client plays white
+        await expect(close_reader, "1.")
+        await send(fast, "seek 1500 bad")
+        await expect(fast_reader, "Invalid request")
+        assert len(game_server.matchmaker) == 2
+        for writer in (fast, far, near, close):
+            writer.close()
+    run_with_server(scenario)
+
+def test_opening_book_moves_then_validation(tmp_path):
+    book = OpeningBook([[parse_move(msg) for msg in "e2-e4 e7-e5 g1-f3".split()]])
+    async def scenario(game_server, connect):
+        (white_reader, white), (black_reader, black) = await pair(connect)
+        game = game_server.games[1]
+        await send(white, "e2-e4")
+        assert await expect(black_reader, "1.") == "1. white pawn moves from e2 to e4"
+        await send(black, "e7-e5")
+        await expect(white_reader, "2.")
+        assert game.book is not None and game.compact_board is game.book.snapshot
+        await send(white, "b1-c3") #out of the book
+        assert await expect(black_reader, "3.") == "3. white knight moves from b1 to c3"
+        assert game.book is None
+        assert len(game.board.move_history) == 3
+        #the book position the game left is untouched
+        assert len(book.root.child(((5, 2), (5, 4), None)).snapshot.history) == 1
+        await send(black, "display_board")
+        await expect(black_reader, "8 |")
+        #book moves are logged as any other, with the snapshot after move 2
+        game_server.game_log.sync()
+        recovered = read_log(path)[1]
+        assert recovered.snapshot_moves == 2
+        assert recovered.compact().history == game.board.move_history
+        white.close()
+        black.close()
+    path = str(tmp_path / "games.log")
+    run_with_server(scenario, opening_book=book,
+                    game_log=GameLog(path, snapshot_every=2))
@@ -0,0 +1,148 @@
+import asyncio
+import socket
+
+from src.chess_server import sharding
+from src.chess_server.sharding import Dispatcher, HashRing
+
+async def expect(reader, start):
+    while True:
+        line = (await reader.readline()).decode()
+        assert line, f"connection closed before {start!r}"
+        if line.startswith(start):
+            return line.strip()
+
+async def new_game(port):
+    white = await asyncio.open_connection("127.0.0.1", port)
+    black = await asyncio.open_connection("127.0.0.1", port)
+    await expect(white[0], "Game")
+    await expect(black[0], "Game")
+    return white, black
+
+async def first_move(game, msg="e2-e4"):
+    (_, white_writer), (black_reader, _) = game
+    white_writer.write(msg.encode() + b"\n")
+    await expect(black_reader, "1. white pawn moves")
+
+def test_hash_ring_spreads_and_is_stable():
+    ring = HashRing(range(4))
+    owners = [ring.lookup(game_id) for game_id in range(4000)]
+    assert owners == [HashRing(range(4)).lookup(i) for i in range(4000)]
+    assert all(700 < owners.count(node) < 1300 for node in range(4))
+
+def test_hash_ring_adding_worker_moves_few_games():
+    ring = HashRing(range(4))
+    before = [ring.lookup(game_id) for game_id in range(4000)]
+    ring.add(4)
+    after = [ring.lookup(game_id) for game_id in range(4000)]
+    moved = [(old, new) for old, new in zip(before, after) if old != new]
+    assert all(new == 4 for _, new in moved)
+    assert len(moved) < 1300
+    ring.remove(4)
+    assert [ring.lookup(game_id) for game_id in range(4000)] == before
+
+def test_worker_crash_only_affects_its_games():
+    async def scenario():
+        dispatcher = Dispatcher(2)
+        try:
+            listeners = await dispatcher.start("127.0.0.1", 0, 0)
+            port = listeners[0].getsockname()[1]
+            games = [await new_game(port) for _ in range(4)]
+            owners = [dispatcher.ring.lookup(game_id) for game_id in range(1, 5)]
+            crashed = owners[0]
+            survivor = games[owners.index(1 - crashed)]
+
+            dispatcher.workers[crashed][0].kill()
+            await games[0][0][0].read()
+            await games[0][1][0].read()
+            await first_move(survivor)
+
+            await asyncio.sleep(1)
+            assert all(process.is_alive() for process, _ in dispatcher.workers.values())
+            #the restarted worker takes its place on the ring and plays new games
+            game_id = 5
+            while dispatcher.ring.lookup(game_id) != crashed:
+                await new_game(port)
+                game_id += 1
+            await first_move(await new_game(port), "d2-d4")
+        finally:
+            dispatcher.close()
+    asyncio.run(asyncio.wait_for(scenario(), 20))
+
+def test_spectators_routed_to_owning_worker():
+    async def scenario():
+        dispatcher = Dispatcher(2)
+        try:
+            listeners = await dispatcher.start("127.0.0.1", 0, 0)
+            port, spectator_port = (l.getsockname()[1] for l in listeners)
+            games = [await new_game(port) for _ in range(3)]
+            for game_id in (1, 2, 3):
+                reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                               spectator_port)
+                writer.write(f"watch {game_id}\n".encode())
+                assert await expect(reader, "Watching") == f"Watching game {game_id}"
+                await first_move(games[game_id - 1])
+                await expect(reader, "1. white pawn moves from e2 to e4")
+                writer.close()
+        finally:
+            dispatcher.close()
+    asyncio.run(asyncio.wait_for(scenario(), 20))
+
+def test_seeks_paired_by_dispatcher():
+    async def scenario():
+        dispatcher = Dispatcher(2)
+        try:
+            listeners = await dispatcher.start("127.0.0.1", 0, 0)
+            spectator_port = listeners[1].getsockname()[1]
+            seekers = []
+            for line in (b"seek 1500 5+3\n", b"seek 1600 5+3\n"):
+                reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                               spectator_port)
+                writer.write(line)
+                seekers.append((reader, writer))
+                if len(seekers) == 1:
+                    await expect(reader, "Waiting for an opponent")
+            await expect(seekers[0][0], "Game")
+            await expect(seekers[1][0], "Game")
+            await first_move(seekers)
+            seekers[1][1].write(b"clock\n")
+            assert (await expect(seekers[1][0], "Clock")).startswith("Clock white 30")
+            for _, writer in seekers:
+                writer.close()
+        finally:
+            dispatcher.close()
+    asyncio.run(asyncio.wait_for(scenario(), 20))
+
+def test_stuck_worker_does_not_block_dispatcher(monkeypatch):
+    monkeypatch.setattr(sharding, "HANDOFF_TIMEOUT", 0.5)
+    async def scenario():
+        dispatcher = Dispatcher(1)
+        process, channel = dispatcher.workers[0]
+        #a channel nobody reads, full before the game is handed over
+        stuck, reader = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        stuck.setblocking(False)
+        try:
+            while True:
+                stuck.send(b"x" * 1024)
+        except BlockingIOError:
+            pass
+        dispatcher.workers[0] = (process, stuck)
+        try:
+            listeners = await dispatcher.start("127.0.0.1", 0, 0)
+            port = listeners[0].getsockname()[1]
+            players = []
+            for _ in range(2):
+                players.append(await asyncio.open_connection("127.0.0.1", port))
+                if len(players) == 1:
+                    await expect(players[0][0], "Waiting for an opponent")
+            #the dispatcher keeps accepting while the handoff waits
+            waiting = await asyncio.open_connection("127.0.0.1", port)
+            await expect(waiting[0], "Waiting for an opponent")
+            for player_reader, _ in players:
+                await expect(player_reader, "Opponent disconnected")
+                assert await player_reader.read() == b""
+        finally:
+            dispatcher.workers[0] = (process, channel)
+            stuck.close()
+            reader.close()
+            dispatcher.close()
+    asyncio.run(asyncio.wait_for(scenario(), 20))
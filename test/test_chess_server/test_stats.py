@@ -0,0 +1,29 @@
+from src.chess_server.stats import BUCKETS, Histogram, Stats
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram()
+    for seconds in [0.5e-6] * 90 + [3e-6] * 9 + [5.0]:
+        histogram.observe(seconds)
+    assert histogram.count == 100
+    assert histogram.counts[0] == 90 and histogram.counts[2] == 9
+    assert histogram.counts[-1] == 1
+    assert histogram.quantile(0.5) == BUCKETS[0]
+    assert histogram.quantile(0.99) == BUCKETS[2]
+    assert histogram.quantile(1) == float("inf")
+    assert Histogram().quantile(0.5) == 0
+
+def test_render_prometheus_text():
+    stats = Stats()
+    stats.count("requests", 'kind="move"')
+    stats.count("requests", 'kind="move"')
+    stats.count("bytes_sent", amount=80)
+    stats.observe("parse", 1.5e-6)
+    lines = stats.render({"games": 3}, {("cache_lookups", 'result="hit"'): 7}).splitlines()
+    assert lines[:2] == ["# TYPE chess_games gauge", "chess_games 3"]
+    assert 'chess_cache_lookups_total{result="hit"} 7' in lines
+    assert 'chess_requests_total{kind="move"} 2' in lines
+    assert "chess_bytes_sent_total 80" in lines
+    assert 'chess_phase_seconds_bucket{phase="parse",le="1e-06"} 0' in lines
+    assert 'chess_phase_seconds_bucket{phase="parse",le="2e-06"} 1' in lines
+    assert 'chess_phase_seconds_bucket{phase="parse",le="+Inf"} 1' in lines
+    assert 'chess_phase_seconds_count{phase="parse"} 1' in lines